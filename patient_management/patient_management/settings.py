@@ -84,6 +84,31 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# LocMemCache evicts least recently used entries once MAX_ENTRIES is reached. It is
+# per process: with several server processes, point 'patients' at a shared backend
+# (Redis, Memcached) so invalidation from one process reaches the others.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'patients': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'patients',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
+# Cache alias patients/cache.py stores serialized patient state and history pages in
+PATIENT_CACHE_ALIAS = 'patients'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -168,3 +193,10 @@ LOGGING = {
         },
     },
 }
+
+# Numbers substituted for the symbolic day thresholds ("Y", "Z") used in
+# patients/transitions.py when the rule engine compiles the table.
+TRANSITION_THRESHOLDS = {
+    'Y': 7,
+    'Z': 3,
+}
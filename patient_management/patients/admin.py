@@ -13,6 +13,10 @@ from .models import (
     InitialTransitionStage, 
     FinalTransitionStage, 
     ClosedStage,
+    StageRecord,
+    CohortOccupancy,
+    TransitionRollup,
+    PopulationSnapshot,
     CohortAStage
     #PatientStage
 )
@@ -31,5 +35,9 @@ admin.site.register(ClinicalStage)
 admin.site.register(InitialTransitionStage)
 admin.site.register(FinalTransitionStage)
 admin.site.register(ClosedStage)
+admin.site.register(StageRecord)
+admin.site.register(CohortOccupancy)
+admin.site.register(TransitionRollup)
+admin.site.register(PopulationSnapshot)
 #admin.site.register(CohortAStage)
 #admin.site.register(PatientStage)
@@ -0,0 +1,89 @@
+import csv
+import json
+
+from .parsers import InvalidLine
+from .serializers import PatientSerializer
+from .services import admit_patients
+
+
+def admit_rows(numbered_rows):
+    """
+    Validate a chunk of (row number, data) pairs with PatientSerializer(many=True) and
+    admit the valid ones in one admit_patients() transaction.
+
+    Returns (patient ids, errors) where each error is {"row": number, "errors": {...}}.
+    A chunk with invalid rows is validated a second time without them; the valid rows
+    in it are still admitted.
+    """
+    errors = []
+    candidates = []
+    for number, row in numbered_rows:
+        if isinstance(row, InvalidLine):
+            errors.append({"row": number, "errors": {"non_field_errors": [row.message]}})
+        else:
+            candidates.append((number, row))
+
+    serializer = PatientSerializer(data=[row for _, row in candidates], many=True)
+    if not serializer.is_valid():
+        valid = []
+        for (number, row), row_errors in zip(candidates, serializer.errors):
+            if row_errors:
+                errors.append({"row": number, "errors": row_errors})
+            else:
+                valid.append((number, row))
+        serializer = PatientSerializer(data=[row for _, row in valid], many=True)
+        serializer.is_valid()
+    patients = admit_patients(serializer.validated_data)
+    return [patient.id for patient in patients], errors
+
+
+def _lines(f, start):
+    """Yield raw lines from the binary file, starting at byte `start`, tracking the offset reached."""
+    f.seek(start)
+    position = start
+    for line in iter(f.readline, b''):
+        position += len(line)
+        yield position, line
+
+
+def iter_ndjson(f, start=0, encoding='utf-8'):
+    """Yield (offset after the record, data) for each non-blank NDJSON line from byte `start`."""
+    for position, line in _lines(f, start):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield position, json.loads(line.decode(encoding))
+        except ValueError as e:
+            yield position, InvalidLine(f"Invalid JSON: {e}")
+
+
+def read_csv_header(f, encoding='utf-8'):
+    """(column names, offset of the first record) of a CSV file."""
+    f.seek(0)
+    line = f.readline()
+    return next(csv.reader([line.decode(encoding)])), len(line)
+
+
+def iter_csv(f, columns, start, encoding='utf-8'):
+    """
+    Yield (offset after the record, data) for each CSV record from byte `start`, which
+    must be a record boundary. Empty cells are left out so model defaults apply.
+    Quoted fields may span lines: the reader pulls as many lines as a record needs,
+    and the offset is read only once it has.
+    """
+    position = start
+    lines = _lines(f, start)
+
+    def text():
+        nonlocal position
+        for position, line in lines:
+            yield line.decode(encoding)
+
+    for record in csv.reader(text()):
+        if not any(record):
+            continue
+        if len(record) != len(columns):
+            yield position, InvalidLine(f"Expected {len(columns)} columns, found {len(record)}")
+            continue
+        yield position, {column: value for column, value in zip(columns, record) if value != ''}
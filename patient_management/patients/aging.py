@@ -0,0 +1,164 @@
+from datetime import datetime, time, timedelta
+
+from django.db import NotSupportedError, models
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+from .cache import invalidate_all
+from .models import Patient
+
+# Legacy day counters and the timestamp each one can be derived from.
+# "since" counters count whole days elapsed from the anchor, "until" counters
+# count calendar days left before the anchor date.
+DAY_COUNTERS = {
+    'days_since_follow_up': ('last_follow_up_at', 'since'),
+    'days_since_last_contact': ('last_contact_at', 'since'),
+    'days_until_admission': ('admission_date', 'until'),
+}
+
+
+def day_count(patient, counter, now=None):
+    """
+    Current value of a day counter for the patient.
+
+    Derived from the anchor timestamp when the patient has one, otherwise the
+    stored legacy counter is returned unchanged.
+    """
+    anchor_field, direction = DAY_COUNTERS[counter]
+    anchor = getattr(patient, anchor_field)
+    if anchor is None:
+        return getattr(patient, counter)
+    now = now or timezone.now()
+    if direction == 'since':
+        return (now - anchor).days
+    return (anchor - timezone.localdate(now)).days
+
+
+def day_count_q(counter, lookup, value, now=None):
+    """
+    Q selecting patients whose day counter satisfies `counter <lookup> value`.
+
+    Patients with an anchor are compared on the anchor column directly, so the
+    filter is a plain range comparison instead of per-row date arithmetic; the
+    rest fall back to the stored counter.
+    """
+    anchor_field, direction = DAY_COUNTERS[counter]
+    now = now or timezone.now()
+    legacy = Q(**{f"{anchor_field}__isnull": True, f"{counter}__{lookup}": value})
+
+    if direction == 'since':
+        # days_since >= N  <=>  anchor <= now - N days
+        at_least = now - timedelta(days=value)
+        above = now - timedelta(days=value + 1)
+        anchored = {
+            'gte': Q(**{f"{anchor_field}__lte": at_least}),
+            'gt': Q(**{f"{anchor_field}__lte": above}),
+            'lte': Q(**{f"{anchor_field}__gt": above}),
+            'lt': Q(**{f"{anchor_field}__gt": at_least}),
+            'exact': Q(**{f"{anchor_field}__lte": at_least, f"{anchor_field}__gt": above}),
+        }[lookup]
+    else:
+        # days_until <= N  <=>  anchor date <= today + N days
+        target = timezone.localdate(now) + timedelta(days=value)
+        anchored = Q(**{f"{anchor_field}__{lookup}": target})
+
+    return legacy | anchored
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def day_count_true_from(patient, counter, lookup, value, now=None):
+    """
+    Earliest moment, from `now` on, at which the anchored counter satisfies
+    `counter <lookup> value`, or None if it never will without the patient changing.
+
+    The patient must have the counter's anchor set.
+    """
+    anchor_field, direction = DAY_COUNTERS[counter]
+    anchor = getattr(patient, anchor_field)
+    now = now or timezone.now()
+
+    # [start, end) window of time during which the comparison holds; None is unbounded
+    if direction == 'since':
+        day = lambda n: anchor + timedelta(days=n)
+        start, end = {
+            'gte': (day(value), None),
+            'gt': (day(value + 1), None),
+            'lte': (None, day(value + 1)),
+            'lt': (None, day(value)),
+            'exact': (day(value), day(value + 1)),
+        }[lookup]
+    else:
+        day = lambda n: _start_of_day(anchor - timedelta(days=n))
+        start, end = {
+            'lte': (day(value), None),
+            'lt': (day(value - 1), None),
+            'gte': (None, day(value - 1)),
+            'gt': (None, day(value)),
+            'exact': (day(value), day(value - 1)),
+        }[lookup]
+
+    if end is not None and now >= end:
+        return None
+    if start is None or start < now:
+        return now
+    return start
+
+
+class DaysSince(models.Func):
+    """
+    Whole days between a datetime/date column and `now`, floored like timedelta.days so
+    it agrees with day_count(); negative for dates ahead of `now`.
+    """
+
+    output_field = models.IntegerField()
+
+    def __init__(self, expression, now, **extra):
+        super().__init__(expression, models.Value(now), **extra)
+
+    def _compile_operands(self, compiler):
+        column_sql, column_params = compiler.compile(self.source_expressions[0])
+        now_sql, now_params = compiler.compile(self.source_expressions[1])
+        return column_sql, now_sql, (*now_params, *column_params)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f"DaysSince has no SQL for the {connection.vendor} database backend.")
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        column_sql, now_sql, params = self._compile_operands(compiler)
+        days = f"(julianday({now_sql}) - julianday({column_sql}))"
+        # CAST truncates toward zero; step back one for negative fractions to floor
+        sql = f"(CAST({days} AS INTEGER) - ({days} < CAST({days} AS INTEGER)))"
+        return sql, params * 3
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        column_sql, now_sql, params = self._compile_operands(compiler)
+        sql = f"FLOOR(EXTRACT(EPOCH FROM ({now_sql}::timestamptz - {column_sql}::timestamptz)) / 86400)::integer"
+        return sql, params
+
+
+def refresh_day_counters(now=None, queryset=None):
+    """
+    Rewrite the legacy day counters from their anchors with one set-based UPDATE.
+
+    Only rows that have at least one anchor are touched, and each counter is only rewritten
+    where its own anchor is set; every touched row gets one version bump. Returns the
+    number of rows updated.
+    """
+    now = now or timezone.now()
+    if queryset is None:
+        queryset = Patient.objects.all()
+    values = {}
+    anchored = Q()
+    for counter, (anchor_field, direction) in DAY_COUNTERS.items():
+        if direction == 'since':
+            value = DaysSince(F(anchor_field), now)
+        else:
+            value = -DaysSince(F(anchor_field), timezone.localdate(now))
+        values[counter] = Case(When(**{f"{anchor_field}__isnull": False}, then=value), default=F(counter))
+        anchored |= Q(**{f"{anchor_field}__isnull": False})
+    updated = queryset.filter(anchored).update(**values, version=F('version') + 1)
+    invalidate_all()
+    return updated
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class PatientsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'patients'
+
+    def ready(self):
+        # Compile the state transition table once at startup
+        from . import rules  # noqa: F401
+        from . import signals  # noqa: F401
+        # Registers the system check routing every transition target to a stage table
+        from . import stages  # noqa: F401
@@ -0,0 +1,131 @@
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from .cache import acached
+from .models import Patient
+from .pagination import InvalidCursor, akeyset_page
+from .rules import rule_engine
+from .serializers import HistoryPageSerializer, PatientSerializer
+from .services import HISTORY_ORDERING, MAX_TRANSITION_RETRIES, apatient_validators
+from .values_serializers import history_entry_values
+from .views import PatientViewSet, VersionConflict
+
+logger = logging.getLogger(__name__)
+
+# Native async versions of the patient create, transition and history endpoints, for
+# deployments served through asgi.py. Under ASGI a DRF view runs in a worker thread for
+# the whole request; these views stay on the event loop and only leave it for database
+# work. Reads use the async ORM. Writes that span several statements need a transaction,
+# which the async ORM does not offer, so each runs as one sync_to_async call into the
+# same code the sync views use.
+_views = PatientViewSet()
+
+
+def _json_response(data, status_code, headers=None):
+    # Rendered by DRF's JSONRenderer so the body matches the sync views byte for byte
+    return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json', headers=headers)
+
+
+def _json_body(request):
+    """(data, None) for a JSON request body, or (None, error response) like DRF's parser gives."""
+    if request.content_type != 'application/json':
+        return None, _json_response({"detail": f'Unsupported media type "{request.content_type}" in request.'},
+                                    status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    if not request.body:
+        return {}, None
+    try:
+        return json.loads(request.body), None
+    except ValueError as e:
+        return None, _json_response({"detail": f"JSON parse error - {e}"}, status.HTTP_400_BAD_REQUEST)
+
+
+@csrf_exempt
+@require_POST
+async def create_patient(request):
+    data, error = _json_body(request)
+    if error is not None:
+        return error
+    serializer = PatientSerializer(data=data)
+    if not serializer.is_valid():
+        logger.warning(f"Patient admission failed with errors: {serializer.errors}")
+        return _json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+    try:
+        patient = await sync_to_async(_views._admit)(serializer)
+    except Exception as e:
+        logger.error(f"Failed to admit patient: {e}")
+        return _json_response({"error": "Failed to admit patient"}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+    logger.info(f"Patient admitted successfully with ID: {patient.id}")
+    return _json_response({"message": "Patient admitted successfully", "patient_id": patient.id}, status.HTTP_201_CREATED)
+
+
+@csrf_exempt
+@require_http_methods(['PUT'])
+async def transition_patient(request, patient_id):
+    # Same optimistic compare-and-swap loop as PatientViewSet.transition
+    for attempt in range(MAX_TRANSITION_RETRIES + 1):
+        try:
+            patient = await Patient.objects.aget(id=patient_id)
+            logger.info(f"Transition initiated for patient ID: {patient_id}")
+        except Patient.DoesNotExist:
+            logger.error(f"Patient with ID {patient_id} not found")
+            return _json_response({"error": "Patient not found"}, status.HTTP_404_NOT_FOUND)
+
+        rule = rule_engine.match(patient)
+        if rule is None:
+            logger.warning("No transition applied.")
+            return _json_response({"message": "No transition applied"}, status.HTTP_400_BAD_REQUEST)
+
+        previous_cohort, previous_sub_stage, dwell = _views._apply_rule(patient, rule)
+        try:
+            await sync_to_async(_views._commit_transition)(patient, rule, previous_cohort, previous_sub_stage, dwell)
+        except VersionConflict:
+            logger.info(f"Patient ID {patient_id} changed concurrently, retrying transition (attempt {attempt + 1}).")
+            continue
+        except Exception as e:
+            logger.error(f"Failed to transition patient {patient_id}, changes rolled back: {e}")
+            return _json_response({"error": "Failed to transition patient"}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return _json_response({"message": "Patient transitioned successfully", "patient_id": patient.id}, status.HTTP_200_OK)
+
+    logger.warning(f"Transition for patient ID {patient_id} kept conflicting with concurrent updates.")
+    return _json_response({"error": "Patient was modified concurrently, retry the transition"}, status.HTTP_409_CONFLICT)
+
+
+@require_GET
+async def patient_history(request, patient_id):
+    # Same pages, cache entries and validators as PatientViewSet.get_history
+    params = HistoryPageSerializer(data=request.GET)
+    if not params.is_valid():
+        return _json_response(params.errors, status.HTTP_400_BAD_REQUEST)
+
+    validators = await acached('validators', patient_id, {}, lambda: apatient_validators(patient_id))
+    if validators is None:
+        logger.error(f"Patient with ID {patient_id} not found")
+        return _json_response({"error": "Patient not found"}, status.HTTP_404_NOT_FOUND)
+    etag, last_modified = _views._history_validators(patient_id, params.validated_data, validators)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    try:
+        page = await acached('history', patient_id, params.validated_data,
+                             lambda: _history_page(patient_id, params.validated_data))
+    except InvalidCursor as e:
+        logger.warning(f"Rejected history cursor for patient {patient_id}: {e}")
+        return _json_response({"error": "Invalid cursor"}, status.HTTP_400_BAD_REQUEST)
+    return _json_response(page, status.HTTP_200_OK, headers=_views._history_headers(etag, last_modified))
+
+
+async def _history_page(patient_id, params):
+    rows, next_cursor = await akeyset_page(
+        _views._history_entries(patient_id, params), HISTORY_ORDERING, params.get('cursor'), params['limit'],
+    )
+    return {"patient_id": patient_id, "history": history_entry_values.many(rows), "next_cursor": next_cursor}
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import threading
+import uuid
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+# Every entry key embeds a global epoch and the patient's generation token. Invalidating
+# a patient replaces its token, invalidating everything replaces the epoch; the orphaned
+# entries are never read again and age out of the LRU.
+KEY_PREFIX = 'patients'
+EPOCH_KEY = f'{KEY_PREFIX}:epoch'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'PATIENT_CACHE_ALIAS', 'default')]
+
+
+def _generation_key(patient_id):
+    return f'{KEY_PREFIX}:gen:{patient_id}'
+
+
+def _token(cache, key, current):
+    # A missing token, never set or evicted, is replaced by a fresh one rather than a
+    # constant, so entries written under an evicted token can never be read back
+    if current is not None:
+        return current
+    cache.add(key, uuid.uuid4().hex, timeout=None)
+    return cache.get(key)
+
+
+def _count(kind, outcome):
+    with _stats_lock:
+        _stats[(kind, outcome)] += 1
+
+
+def params_digest(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _lookup(cache, kind, patient_id, params):
+    """(entry key, cached value or None) for the kind of data, the patient and the request params."""
+    generation_key = _generation_key(patient_id)
+    tokens = cache.get_many([EPOCH_KEY, generation_key])
+    epoch = _token(cache, EPOCH_KEY, tokens.get(EPOCH_KEY))
+    generation = _token(cache, generation_key, tokens.get(generation_key))
+    key = f'{KEY_PREFIX}:{epoch}:{patient_id}:{generation}:{kind}:{params_digest(params)}'
+    return key, cache.get(key)
+
+
+def cached(kind, patient_id, params, compute):
+    """
+    Return compute() through the cache, keyed by the kind of data, the patient and
+    the request params that shape it. None results (missing patients) are not cached.
+    """
+    cache = _cache()
+    key, value = _lookup(cache, kind, patient_id, params)
+    if value is not None:
+        _count(kind, 'hits')
+        return value
+    _count(kind, 'misses')
+    value = compute()
+    if value is not None:
+        cache.set(key, value)
+    return value
+
+
+async def acached(kind, patient_id, params, compute):
+    """
+    cached() for async views, with `compute` a coroutine function. The locmem backend
+    lives in this process and never blocks, so it is used straight from the event loop;
+    any other backend costs one thread hop for the lookup and one for the store.
+    """
+    cache = _cache()
+    local = isinstance(cache, LocMemCache)
+    if local:
+        key, value = _lookup(cache, kind, patient_id, params)
+    else:
+        key, value = await sync_to_async(_lookup)(cache, kind, patient_id, params)
+    if value is not None:
+        _count(kind, 'hits')
+        return value
+    _count(kind, 'misses')
+    value = await compute()
+    if value is not None:
+        if local:
+            cache.set(key, value)
+        else:
+            await cache.aset(key, value)
+    return value
+
+
+def _drop(patient_ids):
+    _cache().delete_many([_generation_key(patient_id) for patient_id in patient_ids])
+
+
+def invalidate_patients(patient_ids):
+    """
+    Forget the cached state and history of the patients: right away, for reads later
+    in this transaction, and again once it commits, for reads that raced the write
+    and cached the pre-commit rows.
+    """
+    patient_ids = list(patient_ids)
+    if not patient_ids:
+        return
+    _drop(patient_ids)
+    transaction.on_commit(lambda: _drop(patient_ids))
+
+
+def invalidate_all():
+    """Forget every cached patient, for writes that touch the whole table."""
+    _cache().delete(EPOCH_KEY)
+    transaction.on_commit(lambda: _cache().delete(EPOCH_KEY))
+
+
+def cache_stats():
+    """Hit and miss counts per kind of cached data since this process started."""
+    with _stats_lock:
+        kinds = sorted({kind for kind, _ in _stats})
+        return {
+            kind: {'hits': _stats[(kind, 'hits')], 'misses': _stats[(kind, 'misses')]}
+            for kind in kinds
+        }
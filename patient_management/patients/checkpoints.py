@@ -0,0 +1,28 @@
+import json
+import os
+
+
+def load_checkpoint(path):
+    """Return the saved checkpoint dict, or None when there is nothing to resume."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, data):
+    # Write to a temp file and rename so a crash mid-write never leaves a torn checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def clear_checkpoint(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,27 @@
+from functools import reduce
+from operator import or_
+
+from django.db.models import Case, F, Q, Value, When
+
+
+def increment(model, key_fields, deltas, count_field='count'):
+    """
+    Add each delta to the counter row identified by its key, a tuple of values for
+    `key_fields`. Two statements whatever the number of keys: an insert that ignores
+    rows which already exist, then one UPDATE with a CASE per key. The increments are
+    applied by the database, so concurrent writers never overwrite each other.
+
+    `key_fields` must be covered by a unique constraint on the model.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    model.objects.bulk_create(
+        [model(**dict(zip(key_fields, key))) for key in deltas],
+        ignore_conflicts=True,
+    )
+    keys = [Q(**dict(zip(key_fields, key))) for key in deltas]
+    model.objects.filter(reduce(or_, keys)).update(**{count_field: F(count_field) + Case(
+        *[When(key, then=Value(delta)) for key, delta in zip(keys, deltas.values())],
+        default=Value(0),
+    )})
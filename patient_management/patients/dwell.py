@@ -0,0 +1,68 @@
+import math
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import PatientHistory
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+# Days a dwell report covers when the request leaves out part of its window
+DEFAULT_WINDOW_DAYS = 30
+
+
+def _day_bounds(start, end):
+    """[start of `start`, start of the day after `end`) as aware datetimes, so the filter stays a range on the index."""
+    lower = timezone.make_aware(datetime.combine(start, time.min))
+    upper = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+    return lower, upper
+
+
+def dwell_window(start=None, end=None):
+    """The report window with missing ends filled in: DEFAULT_WINDOW_DAYS ending today, or at `end`."""
+    if end is None:
+        end = max(timezone.localdate(), start) if start else timezone.localdate()
+    if start is None:
+        start = end - timedelta(days=DEFAULT_WINDOW_DAYS - 1)
+    return start, end
+
+
+def dwell_percentiles(start=None, end=None, percentiles=DEFAULT_PERCENTILES):
+    """
+    Nearest-rank dwell time percentiles, in seconds, of every (cohort, sub_stage) patients
+    left during the inclusive day range. A missing end is today and a missing start is
+    DEFAULT_WINDOW_DAYS before the end, so a report never scans the whole history.
+
+    Reads the dwell time stored on each history row when it was written, in one query
+    over history_dwell_idx with no pairing of history rows. The rows are ranked per stage
+    in the database and only the rows at a requested rank come back, so memory does not
+    grow with the number of transitions. Rows without a dwell time (written before it
+    was recorded) are left out.
+    """
+    lower, upper = _day_bounds(*dwell_window(start, end))
+    stage = [F('previous_cohort'), F('previous_sub_stage')]
+    rows = PatientHistory.objects.filter(
+        dwell_time__isnull=False, transition_date__gte=lower, transition_date__lt=upper,
+    ).annotate(
+        rank=Window(RowNumber(), partition_by=stage, order_by=[F('dwell_time'), F('id')]),
+        transitions=Window(Count('id'), partition_by=stage),
+    )
+    # Nearest rank is ceil(p / 100 * n), written as integer division; rank 1 keeps
+    # every stage in the result whatever percentiles are asked for
+    targets = {p: (F('transitions') * p + 99) / 100 for p in percentiles}
+    at_rank = Q(rank=1)
+    for target in targets.values():
+        at_rank |= Q(rank=target)
+    rows = rows.filter(at_rank).values_list(
+        'previous_cohort', 'previous_sub_stage', 'transitions', 'rank', 'dwell_time',
+    )
+
+    stats = {}
+    for cohort, sub_stage, transitions, rank, dwell in rows:
+        entry = stats.setdefault((cohort, sub_stage), {'cohort': cohort, 'sub_stage': sub_stage, 'transitions': transitions})
+        for p in percentiles:
+            if rank == max(1, math.ceil(p / 100 * transitions)):
+                entry[f'p{p}'] = dwell.total_seconds()
+    return [stats[key] for key in sorted(stats)]
@@ -0,0 +1,17 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from patients.rollups import backfill_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily transition rollup from PatientHistory, for all days or an inclusive date range."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help="First day to rebuild (YYYY-MM-DD)")
+        parser.add_argument('--end', type=date.fromisoformat, help="Last day to rebuild (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        written = backfill_rollups(options['start'], options['end'])
+        self.stdout.write(self.style.SUCCESS(f"Transition rollup rebuilt: {written} day/edge rows written."))
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.asgi import get_asgi_application
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.test import RequestFactory
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from patients.management.commands.benchmark_rules import build_population
+from patients.management.commands.benchmark_sweep import _use_database
+from patients.models import Patient
+from patients.services import schedule_patients
+
+# (method, path template, share of the requests)
+WORKLOAD = [
+    ('GET', '/api/{prefix}patients/{id}/history/', 0.7),
+    ('PUT', '/api/{prefix}patients/{id}/transition/', 0.2),
+    ('POST', '/api/{prefix}patients/', 0.1),
+]
+ADMISSION = json.dumps({"name": "Load test", "current_cohort": "A", "current_sub_stage": "Follow-up"}).encode()
+
+# (label, interface, URL prefix of the views it calls)
+MODES = [
+    ('WSGI, sync views', 'wsgi', ''),
+    ('ASGI, sync views', 'asgi', ''),
+    ('ASGI, async views', 'asgi', 'async/'),
+]
+
+
+def build_requests(count, patients, seed=0):
+    """The same mixed request sequence for every mode: (method, path with {prefix}, body)."""
+    rng = random.Random(seed)
+    methods = [(method, path) for method, path, _ in WORKLOAD]
+    weights = [share for _, _, share in WORKLOAD]
+    requests = []
+    for _ in range(count):
+        method, path = rng.choices(methods, weights)[0]
+        requests.append((method, path.replace('{id}', str(rng.randint(1, patients))), ADMISSION if method == 'POST' else b''))
+    return requests
+
+
+def _percentile(latencies, percent):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the patient create, transition and history endpoints at high concurrency: "
+        "sync views under WSGI, sync views under ASGI and the async views under ASGI, each "
+        "against a fresh copy of the same scratch SQLite database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=2000, help="Patients in the scratch database")
+        parser.add_argument('--requests', type=int, default=3000, help="Requests sent per mode")
+        parser.add_argument('--concurrency', type=int, default=64,
+                            help="Requests in flight: WSGI worker threads, or concurrent ASGI requests")
+
+    def handle(self, *args, **options):
+        # Requests are driven through Django's own WSGI and ASGI handlers in this process,
+        # so the comparison measures the application stack rather than a particular server
+        setup_test_environment()
+        # Both handlers are built up front: building one runs django.setup(), which would
+        # reapply LOGGING. Request logging is then quietened so it isn't what gets measured.
+        applications = {'wsgi': get_wsgi_application(), 'asgi': get_asgi_application()}
+        logging.getLogger('patients').setLevel(logging.WARNING)
+        original_name = connections['default'].settings_dict['NAME']
+        scratch_dir = tempfile.mkdtemp(prefix='benchmark_asgi_')
+        template = os.path.join(scratch_dir, 'template.sqlite3')
+        try:
+            self._build_template(template, options['patients'])
+            requests = build_requests(options['requests'], options['patients'])
+            self.stdout.write(f"{len(requests)} requests per mode at concurrency {options['concurrency']} "
+                              f"({', '.join(f'{share:.0%} {method}' for method, _, share in WORKLOAD)})")
+            for label, interface, prefix in MODES:
+                run_db = os.path.join(scratch_dir, f'run_{interface}_{prefix.strip("/") or "sync"}.sqlite3')
+                shutil.copyfile(template, run_db)
+                _use_database(run_db)
+                caches['patients'].clear()
+
+                mode_requests = [(method, path.replace('{prefix}', prefix), body) for method, path, body in requests]
+                if interface == 'wsgi':
+                    elapsed, latencies, statuses = self._run_wsgi(applications['wsgi'], mode_requests, options['concurrency'])
+                else:
+                    elapsed, latencies, statuses = asyncio.run(
+                        self._run_asgi(applications['asgi'], mode_requests, options['concurrency'])
+                    )
+                connections.close_all()
+
+                latencies.sort()
+                self.stdout.write(
+                    f"{label}: {len(latencies) / elapsed:.0f} req/s, "
+                    f"p50 {_percentile(latencies, 50) * 1000:.1f} ms, p99 {_percentile(latencies, 99) * 1000:.1f} ms, "
+                    f"statuses {dict(sorted(statuses.items()))}"
+                )
+        finally:
+            _use_database(original_name)
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+            teardown_test_environment()
+
+    def _build_template(self, path, count):
+        _use_database(path)
+        call_command('migrate', verbosity=0)
+        Patient.objects.bulk_create(build_population(count), batch_size=1000)
+        schedule_patients(Patient.objects.all())
+        connections.close_all()
+        self.stdout.write(f"Scratch database with {count} patients ready")
+
+    def _run_wsgi(self, application, requests, concurrency):
+        # A threaded WSGI server: each request holds one of `concurrency` threads throughout
+        factory = RequestFactory()
+
+        def send(request):
+            method, path, body = request
+            environ = factory.generic(method, path, body, content_type='application/json').environ
+            outcome = {}
+
+            def start_response(status, headers, exc_info=None):
+                outcome['status'] = int(status.split()[0])
+
+            started = time.perf_counter()
+            response = application(environ, start_response)
+            b''.join(response)
+            response.close()
+            return time.perf_counter() - started, outcome['status']
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(send, requests))
+        elapsed = time.monotonic() - started
+        return elapsed, [latency for latency, _ in results], Counter(code for _, code in results)
+
+    async def _run_asgi(self, application, requests, concurrency):
+        queue = list(reversed(requests))
+        latencies = []
+        statuses = Counter()
+
+        async def send(method, path, body):
+            finished = asyncio.Event()
+            delivered = False
+
+            async def receive():
+                nonlocal delivered
+                if not delivered:
+                    delivered = True
+                    return {'type': 'http.request', 'body': body, 'more_body': False}
+                # Django listens for a disconnect while the view runs; only send one once it is done
+                await finished.wait()
+                return {'type': 'http.disconnect'}
+
+            async def reply(message):
+                if message['type'] == 'http.response.start':
+                    statuses[message['status']] += 1
+                elif not message.get('more_body'):
+                    finished.set()
+
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+                'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+                'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode())],
+                'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+            }
+            started = time.perf_counter()
+            await application(scope, receive, reply)
+            latencies.append(time.perf_counter() - started)
+
+        async def worker():
+            while queue:
+                await send(*queue.pop())
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.monotonic() - started, latencies, statuses
@@ -0,0 +1,121 @@
+import copy
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from patients.models import Patient
+from patients.rules import RuleEngine, _resolve_value
+from patients.transitions import state_transitions
+
+
+def _legacy_evaluate_condition(patient, condition):
+    # Same logic as the old PatientViewSet._evaluate_condition, without the logging
+    patient_value = getattr(patient, condition['condition'], None)
+    if patient_value is None:
+        return False
+
+    operator = condition.get('operator')
+    value = condition['value']
+
+    if operator == ">=":
+        return patient_value >= value
+    elif operator == ">":
+        return patient_value > value
+    elif operator == "<=":
+        return patient_value <= value
+    elif operator == "<":
+        return patient_value < value
+    return patient_value == value
+
+
+def _legacy_check_conditions(patient, conditions):
+    for action in conditions.get('actions', []):
+        if not _legacy_evaluate_condition(patient, action):
+            return False
+    for disposition in conditions.get('dispositions', []):
+        if not _legacy_evaluate_condition(patient, disposition):
+            return False
+    return True
+
+
+def legacy_match(patient, transitions):
+    """The linear scan PatientViewSet.transition used before the rule engine."""
+    for transition in transitions['state_transitions']:
+        if (patient.current_sub_stage == transition['current_sub_stage'] and
+                patient.current_cohort == transition['current_cohort']):
+            if _legacy_check_conditions(patient, transition['conditions']):
+                return transition
+    return None
+
+
+def _resolved_table():
+    # The legacy interpreter compared ints against the raw "Y"/"Z" placeholders,
+    # give it the same numbers the engine uses so both do the same work.
+    table = copy.deepcopy(state_transitions)
+    for transition in table['state_transitions']:
+        for group in transition['conditions'].values():
+            for condition in group:
+                condition['value'] = _resolve_value(condition['value'])
+    return table
+
+
+def build_population(size, seed=0):
+    """Unsaved patients spread over every rule key plus some that match nothing."""
+    rng = random.Random(seed)
+    keys = [(t['current_sub_stage'], t['current_cohort']) for t in state_transitions['state_transitions']]
+    keys.append(("A", "Follow-up"))
+    patients = []
+    for _ in range(size):
+        sub_stage, cohort = rng.choice(keys)
+        patients.append(Patient(
+            name="bench",
+            current_cohort=cohort,
+            current_sub_stage=sub_stage,
+            days_since_follow_up=rng.randint(0, 10),
+            days_since_last_contact=rng.randint(0, 10),
+            days_until_admission=rng.randint(0, 10),
+            clinical_intervention_required=rng.random() < 0.8,
+            quotation_phase_required=rng.random() < 0.8,
+            patient_ready=rng.random() < 0.8,
+            clinical_intervention_completed=rng.random() < 0.5,
+            quotation_accepted=rng.random() < 0.5,
+            scheduled_admission=rng.random() < 0.5,
+            scheduled_date_in_past=rng.random() < 0.5,
+            admission_completed=rng.random() < 0.5,
+            lead_management_ends=rng.random() < 0.5,
+            final_response_received=rng.random() < 0.5,
+            admission_status=rng.choice(['Postponed', 'Cancelled', 'Pending']),
+        ))
+    return patients
+
+
+class Command(BaseCommand):
+    help = "Compare the compiled rule engine against the legacy state transition interpreter."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=10000, help="Number of in-memory patients to evaluate")
+        parser.add_argument('--repeat', type=int, default=5, help="Timing runs, the best one is reported")
+
+    def handle(self, *args, **options):
+        patients = build_population(options['patients'])
+        table = _resolved_table()
+        engine = RuleEngine(state_transitions)
+
+        def run_legacy():
+            for patient in patients:
+                legacy_match(patient, table)
+
+        def run_engine():
+            for patient in patients:
+                engine.match(patient)
+
+        legacy = min(timeit.repeat(run_legacy, number=1, repeat=options['repeat']))
+        compiled = min(timeit.repeat(run_engine, number=1, repeat=options['repeat']))
+
+        count = len(patients)
+        self.stdout.write(f"patients evaluated: {count}")
+        self.stdout.write(f"legacy interpreter: {legacy * 1000:.2f} ms ({legacy / count * 1e6:.2f} us/patient)")
+        self.stdout.write(f"compiled engine:    {compiled * 1000:.2f} ms ({compiled / count * 1e6:.2f} us/patient)")
+        if compiled:
+            self.stdout.write(self.style.SUCCESS(f"speedup: {legacy / compiled:.1f}x"))
@@ -0,0 +1,75 @@
+import random
+import timeit
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from patients.management.commands.benchmark_rules import build_population
+from patients.models import PatientHistory
+from patients.serializers import PatientHistoryEntrySerializer, PatientSerializer
+from patients.values_serializers import history_entry_values, patient_values
+
+
+def _values_row(instance, columns):
+    # What values(*columns) would return for the instance
+    return {column: getattr(instance, column) for column in columns}
+
+
+def build_history(size, seed=0):
+    """Unsaved history rows with realistic timestamps and dwell times."""
+    rng = random.Random(seed)
+    now = timezone.now()
+    return [
+        PatientHistory(
+            id=i + 1, patient_id=rng.randint(1, 1000),
+            previous_cohort="Ready to Schedule", previous_sub_stage="A4",
+            next_cohort="Pre-Admission Prep", next_sub_stage="Pre-Admission Prep",
+            transition_date=now - timedelta(seconds=rng.randint(0, 10 ** 7), microseconds=rng.randint(0, 999999)),
+            dwell_time=timedelta(seconds=rng.randint(0, 10 ** 6)) if rng.random() < 0.9 else None,
+        )
+        for i in range(size)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Compare the values() serializers against the DRF serializers they stand in for, rendered to JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help="Rows serialized per run")
+        parser.add_argument('--repeat', type=int, default=5, help="Timing runs, the best one is reported")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        patients = build_population(options['rows'])
+        for i, patient in enumerate(patients, start=1):
+            patient.id = i
+            patient.next_evaluation_at = now + timedelta(minutes=i)
+        history = build_history(options['rows'])
+
+        cases = [
+            ("patient", patients, PatientSerializer, patient_values),
+            ("history entry", history, PatientHistoryEntrySerializer, history_entry_values),
+        ]
+        renderer = JSONRenderer()
+        for label, instances, serializer_class, values in cases:
+            rows = [_values_row(instance, values.columns) for instance in instances]
+
+            def run_drf():
+                return renderer.render(serializer_class(instances, many=True).data)
+
+            def run_values():
+                return renderer.render(values.many(rows))
+
+            if run_drf() != run_values():
+                raise CommandError(f"{label}: values serializer output differs from {serializer_class.__name__}")
+
+            drf = min(timeit.repeat(run_drf, number=1, repeat=options['repeat']))
+            lean = min(timeit.repeat(run_values, number=1, repeat=options['repeat']))
+            count = len(rows)
+            self.stdout.write(f"{label} rows: {count} (byte-identical output)")
+            self.stdout.write(f"  {serializer_class.__name__}: {drf * 1000:.2f} ms ({drf / count * 1e6:.2f} us/row)")
+            self.stdout.write(f"  values serializer: {lean * 1000:.2f} ms ({lean / count * 1e6:.2f} us/row)")
+            if lean:
+                self.stdout.write(self.style.SUCCESS(f"  speedup: {drf / lean:.1f}x"))
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from patients.management.commands.benchmark_rules import build_population
+from patients.models import Patient
+from patients.services import schedule_patients
+from patients.sweep import id_ranges, merge_summaries, run_parallel_sweep, sweep_candidates, sweep_range
+
+
+def _use_database(path):
+    # Point the default connection at a scratch SQLite file so the real database is never touched
+    connections['default'].close()
+    connections['default'].settings_dict['NAME'] = path
+
+
+class Command(BaseCommand):
+    help = "Measure sweep throughput for 1, 2, 4 and 8 worker processes on a scratch SQLite copy."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=50000, help="Patients in the scratch database")
+        parser.add_argument('--workers', default='1,2,4,8', help="Comma separated worker counts to measure")
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        worker_counts = [int(w) for w in options['workers'].split(',')]
+        original_name = connections['default'].settings_dict['NAME']
+        scratch_dir = tempfile.mkdtemp(prefix='benchmark_sweep_')
+        template = os.path.join(scratch_dir, 'template.sqlite3')
+        try:
+            self._build_template(template, options['patients'])
+            baseline = None
+            for workers in worker_counts:
+                run_db = os.path.join(scratch_dir, f'run_{workers}.sqlite3')
+                shutil.copyfile(template, run_db)
+                _use_database(run_db)
+
+                elapsed, total = self._run(workers, options['chunk_size'])
+                baseline = baseline or elapsed
+                self.stdout.write(
+                    f"workers={workers}: {elapsed:.2f}s, {total['scanned'] / elapsed:.0f} patients/s, "
+                    f"{total['transitioned']} transitioned, {total['retries']} busy retries, "
+                    f"speedup {baseline / elapsed:.2f}x"
+                )
+        finally:
+            _use_database(original_name)
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    def _build_template(self, path, count):
+        _use_database(path)
+        call_command('migrate', verbosity=0)
+        Patient.objects.bulk_create(build_population(count), batch_size=1000)
+        schedule_patients(Patient.objects.all())
+        connections['default'].close()
+        self.stdout.write(f"Scratch database with {count} patients ready")
+
+    def _run(self, workers, chunk_size):
+        ranges = id_ranges(sweep_candidates(), workers * 4)
+        started = time.monotonic()
+        if workers == 1:
+            # Serial baseline in this process, no pool overhead
+            summaries = [sweep_range(id_range, chunk_size) for id_range in ranges]
+        else:
+            databases = {alias: connections[alias].settings_dict for alias in connections}
+            connections.close_all()
+            summaries = list(run_parallel_sweep(ranges, workers, databases, chunk_size))
+        return time.monotonic() - started, merge_summaries(summaries)
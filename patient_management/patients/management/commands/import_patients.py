@@ -0,0 +1,121 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.admissions import admit_rows, iter_csv, iter_ndjson, read_csv_header
+from patients.checkpoints import clear_checkpoint, load_checkpoint, save_checkpoint
+from patients.parsers import InvalidLine
+
+DEFAULT_BATCH_SIZE = 1000
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Admit patients from a CSV or NDJSON file, streamed a record at a time and committed in batches. "
+        "Rows are validated like POST /patients/; rejected rows are reported and skipped. "
+        "A checkpoint records the byte offset after each committed batch, so a killed import resumes "
+        "where it stopped; a kill between a commit and its checkpoint re-imports that one batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="CSV with a header row, or one JSON object per line")
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help="Input format; by default taken from the file extension")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Rows per batch; each batch is committed in its own transaction")
+        parser.add_argument('--map', action='append', default=[], metavar='COLUMN=FIELD',
+                            help="Read a Patient field from a differently named column; repeatable")
+        parser.add_argument('--encoding', default='utf-8')
+        parser.add_argument('--checkpoint', help="File recording the last committed offset; defaults to <file>.checkpoint")
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint and start from the first row")
+
+    def handle(self, *args, **options):
+        path = options['file']
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+        fmt = options['format'] or FORMATS.get(os.path.splitext(path)[1].lower())
+        if fmt is None:
+            raise CommandError(f"Cannot tell the format of {path}; pass --format")
+        mapping = self._mapping(options['map'])
+        checkpoint_path = options['checkpoint'] or f"{path}.checkpoint"
+
+        checkpoint = None if options['restart'] else load_checkpoint(checkpoint_path)
+        if checkpoint and checkpoint.get('file') == os.path.abspath(path):
+            self.stdout.write(f"Resuming after row {checkpoint['rows']} (byte {checkpoint['offset']})")
+        else:
+            checkpoint = {'file': os.path.abspath(path), 'offset': 0, 'rows': 0, 'created': 0, 'rejected': 0}
+
+        try:
+            f = open(path, 'rb')
+        except OSError as e:
+            raise CommandError(f"Cannot open {path}: {e}")
+
+        started = time.monotonic()
+        rows = created = rejected = 0
+        with f:
+            records = self._records(f, fmt, checkpoint['offset'], options['encoding'])
+            batch = []
+            for offset, row in records:
+                if mapping and not isinstance(row, InvalidLine):
+                    row = {mapping.get(column, column): value for column, value in row.items()}
+                batch.append((offset, row))
+                if len(batch) == batch_size:
+                    batch_created, batch_rejected = self._commit_batch(batch, checkpoint, checkpoint_path)
+                    rows += len(batch)
+                    created += batch_created
+                    rejected += batch_rejected
+                    batch = []
+                    self._report(rows, created, rejected, started)
+            if batch:
+                batch_created, batch_rejected = self._commit_batch(batch, checkpoint, checkpoint_path)
+                rows += len(batch)
+                created += batch_created
+                rejected += batch_rejected
+
+        elapsed = time.monotonic() - started
+        clear_checkpoint(checkpoint_path)
+        rate = rows / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Import complete: {rows} rows read, {created} patients admitted, {rejected} rejected "
+            f"in {elapsed:.2f}s ({rate:.0f} rows/s)"
+        ))
+
+    def _mapping(self, pairs):
+        mapping = {}
+        for pair in pairs:
+            column, sep, field = pair.partition('=')
+            if not sep or not column or not field:
+                raise CommandError(f"Invalid --map {pair!r}; expected COLUMN=FIELD")
+            mapping[column] = field
+        return mapping
+
+    def _records(self, f, fmt, offset, encoding):
+        if fmt == 'ndjson':
+            return iter_ndjson(f, offset, encoding)
+        try:
+            columns, first = read_csv_header(f, encoding)
+        except StopIteration:
+            return iter(())
+        return iter_csv(f, columns, max(offset, first), encoding)
+
+    def _commit_batch(self, batch, checkpoint, checkpoint_path):
+        # Rows are numbered from 0 across the whole file, resumed runs included
+        first = checkpoint['rows']
+        patient_ids, errors = admit_rows((first + i, row) for i, (_, row) in enumerate(batch))
+        for error in errors:
+            self.stderr.write(f"Row {error['row']} rejected: {error['errors']}")
+        # The batch is committed, record it before reading the next one
+        checkpoint['offset'] = batch[-1][0]
+        checkpoint['rows'] += len(batch)
+        checkpoint['created'] += len(patient_ids)
+        checkpoint['rejected'] += len(errors)
+        save_checkpoint(checkpoint_path, checkpoint)
+        return len(patient_ids), len(errors)
+
+    def _report(self, rows, created, rejected, started):
+        elapsed = time.monotonic() - started
+        rate = rows / elapsed if elapsed else 0
+        self.stdout.write(f"{rows} rows, {created} admitted, {rejected} rejected ({rate:.0f} rows/s)")
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from patients.snapshots import population_at, stage_at, take_snapshot
+
+
+def _moment(value):
+    at = parse_datetime(value)
+    if at is None:
+        raise CommandError(f"Not an ISO 8601 datetime: {value}")
+    return at if timezone.is_aware(at) else timezone.make_aware(at)
+
+
+class Command(BaseCommand):
+    help = (
+        "Take a population snapshot (run periodically, e.g. nightly), or with --at report the "
+        "population, or one --patient's stage, at a point in time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--at', type=_moment, help="Point in time to report on (ISO 8601)")
+        parser.add_argument('--patient', type=int, help="With --at, report this patient's stage instead")
+
+    def handle(self, *args, **options):
+        at = options['at']
+        if at is None:
+            if options['patient'] is not None:
+                raise CommandError("--patient needs --at")
+            snapshot = take_snapshot()
+            self.stdout.write(self.style.SUCCESS(f"Snapshot of {snapshot.patients} patients taken at {snapshot.taken_at}."))
+            return
+
+        if options['patient'] is not None:
+            stage = stage_at(options['patient'], at)
+            if stage is None:
+                raise CommandError(f"Patient {options['patient']} not found")
+            cohort, sub_stage, source = stage
+            if source == 'not_admitted':
+                self.stdout.write(f"Patient {options['patient']} had not been admitted at {at}")
+                return
+            self.stdout.write(f"Patient {options['patient']} at {at}: {cohort} ({sub_stage}), from {source}")
+            return
+
+        snapshot, stages = population_at(at)
+        if snapshot is None:
+            raise CommandError(f"No population snapshot at or before {at}")
+        self.stdout.write(f"Population at {at}, from the snapshot taken at {snapshot.taken_at}:")
+        for stage in stages:
+            self.stdout.write(f"{stage['cohort']} ({stage['sub_stage']}): {stage['count']}")
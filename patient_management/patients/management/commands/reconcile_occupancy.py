@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from patients.occupancy import reconcile_occupancy
+
+
+class Command(BaseCommand):
+    help = "Recount patients per cohort and sub-stage, report drift in the occupancy counters and rewrite them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report drift, leave the counters as they are")
+
+    def handle(self, *args, **options):
+        drift = reconcile_occupancy(apply=not options['dry_run'])
+        for cohort, sub_stage, counted, actual in drift:
+            self.stdout.write(f"{cohort} ({sub_stage}): counter {counted}, actual {actual} ({actual - counted:+d})")
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Occupancy counters match the patient table."))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{len(drift)} stages drifted; run without --dry-run to fix them."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{len(drift)} stages drifted and were rewritten."))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from patients.aging import refresh_day_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored day counters of every patient that has anchor timestamps, in one UPDATE."
+
+    def handle(self, *args, **options):
+        updated = refresh_day_counters()
+        self.stdout.write(f"{updated} patients refreshed")
+        self.stdout.write(self.style.SUCCESS("Day counters refreshed."))
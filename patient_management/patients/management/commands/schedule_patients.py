@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from patients.models import Patient
+from patients.services import DEFAULT_CHUNK_SIZE, schedule_patients
+
+
+class Command(BaseCommand):
+    help = (
+        "Work out next_evaluation_at for patients that have none, such as those admitted before "
+        "the column existed, so the default sweep picks them up. Run it once after migrating."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="Patients per chunk; each chunk is written with one bulk_update")
+        parser.add_argument('--all', action='store_true', dest='full',
+                            help="Recompute the schedule of every patient, not only the unscheduled ones")
+
+    def handle(self, *args, **options):
+        queryset = Patient.objects.all() if options['full'] else Patient.objects.filter(next_evaluation_at__isnull=True)
+        updated = schedule_patients(queryset, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"{updated} patients rescheduled."))
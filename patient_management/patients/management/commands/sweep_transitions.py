@@ -0,0 +1,103 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from patients.checkpoints import clear_checkpoint, load_checkpoint, save_checkpoint
+from patients.services import DEFAULT_CHUNK_SIZE, iter_patient_chunks, transition_patients
+from patients.sweep import id_ranges, merge_summaries, run_parallel_sweep, sweep_candidates
+
+
+class Command(BaseCommand):
+    help = "Apply every matching transition rule to the patients that are due, in id-ordered chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="Patients per chunk; each chunk is committed in its own transaction")
+        parser.add_argument('--checkpoint', default=str(settings.BASE_DIR / 'sweep_transitions.checkpoint'),
+                            help="File recording the last committed patient id")
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint and start from the first patient")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Worker processes; above 1 the id space is split into ranges swept in parallel")
+        parser.add_argument('--all', action='store_true', dest='full',
+                            help="Evaluate every patient instead of only those due, refreshing their schedule too")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        checkpoint_path = options['checkpoint']
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+        if options['workers'] > 1:
+            return self._handle_parallel(options['workers'], chunk_size, checkpoint_path, options['restart'], options['full'])
+
+        checkpoint = None if options['restart'] else load_checkpoint(checkpoint_path)
+        if checkpoint and 'last_id' in checkpoint:
+            self.stdout.write(f"Resuming after patient id {checkpoint['last_id']}")
+        else:
+            checkpoint = {'last_id': 0, 'scanned': 0, 'transitioned': 0}
+
+        queryset = sweep_candidates(options['full']).filter(id__gt=checkpoint['last_id'])
+
+        started = time.monotonic()
+        scanned = transitioned = 0
+        # Each chunk is a fresh keyset query, so no cursor is left open on patients_patient
+        # while the chunk's writes go out (SQLite gives no isolation within one connection)
+        for chunk in iter_patient_chunks(queryset, chunk_size):
+            transitioned += self._commit_chunk(chunk, checkpoint, checkpoint_path)
+            scanned += len(chunk)
+            self._report(scanned, transitioned, started)
+
+        elapsed = time.monotonic() - started
+        clear_checkpoint(checkpoint_path)
+        rate = scanned / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Sweep complete: {scanned} patients scanned, {transitioned} transitioned "
+            f"in {elapsed:.2f}s ({rate:.0f} patients/s)"
+        ))
+
+    def _handle_parallel(self, workers, chunk_size, checkpoint_path, restart, full):
+        checkpoint = None if restart else load_checkpoint(checkpoint_path)
+        if checkpoint and 'ranges' in checkpoint:
+            self.stdout.write(f"Resuming with {len(checkpoint['completed'])} of {len(checkpoint['ranges'])} ranges done")
+        else:
+            # A few ranges per worker so a dense range doesn't leave the others idle
+            checkpoint = {'ranges': id_ranges(sweep_candidates(full), workers * 4), 'completed': []}
+        pending = [r for r in checkpoint['ranges'] if r not in checkpoint['completed']]
+
+        # Every worker opens its own connection; don't hand the parent's to the pool
+        databases = {alias: connections[alias].settings_dict for alias in connections}
+        connections.close_all()
+
+        started = time.monotonic()
+        summaries = []
+        for summary in run_parallel_sweep(pending, workers, databases, chunk_size, full):
+            summaries.append(summary)
+            checkpoint['completed'].append(summary['range'])
+            save_checkpoint(checkpoint_path, checkpoint)
+            self._report(sum(s['scanned'] for s in summaries), sum(s['transitioned'] for s in summaries), started)
+
+        elapsed = time.monotonic() - started
+        clear_checkpoint(checkpoint_path)
+        total = merge_summaries(summaries)
+        rate = total['scanned'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Sweep complete: {total['scanned']} patients scanned, {total['transitioned']} transitioned "
+            f"across {total['ranges']} ranges with {workers} workers ({total['retries']} busy retries) "
+            f"in {elapsed:.2f}s ({rate:.0f} patients/s)"
+        ))
+
+    def _commit_chunk(self, chunk, checkpoint, checkpoint_path):
+        outcomes = transition_patients(chunk)
+        moved = sum(1 for outcome in outcomes if outcome['status'] == 'transitioned')
+        # The chunk is committed, record it before touching the next one
+        checkpoint['last_id'] = chunk[-1].id
+        checkpoint['scanned'] += len(chunk)
+        checkpoint['transitioned'] += moved
+        save_checkpoint(checkpoint_path, checkpoint)
+        return moved
+
+    def _report(self, scanned, transitioned, started):
+        elapsed = time.monotonic() - started
+        rate = scanned / elapsed if elapsed else 0
+        self.stdout.write(f"{scanned} scanned, {transitioned} transitioned ({rate:.0f} patients/s)")
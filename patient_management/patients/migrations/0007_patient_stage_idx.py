@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0006_alter_patient_admission_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['current_cohort', 'current_sub_stage'], name='patient_stage_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0007_patient_stage_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='admission_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='last_contact_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='last_follow_up_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0008_patient_day_counter_anchors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='next_evaluation_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
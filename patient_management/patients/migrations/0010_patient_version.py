@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0009_patient_next_evaluation_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:31
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0010_patient_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StageRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage_code', models.CharField(max_length=50)),
+                ('cohort', models.CharField(max_length=50)),
+                ('sub_stage', models.CharField(max_length=50)),
+                ('entered_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stage_records', to='patients.patient')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='current_stage',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='patients.stagerecord'),
+        ),
+        migrations.AddIndex(
+            model_name='stagerecord',
+            index=models.Index(fields=['stage_code', 'entered_at'], name='stage_record_code_entered_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='stagerecord',
+            constraint=models.UniqueConstraint(fields=('patient', 'stage_code'), name='stage_record_patient_stage_uniq'),
+        ),
+    ]
@@ -0,0 +1,94 @@
+from django.db import migrations
+
+# Frozen copy of the non-None entries of patients.stages.STAGE_REGISTRY at the time
+# of this migration: the stage table every (cohort, sub_stage) is filed under.
+STAGE_TABLES = {
+    ("A", "New Recommendations"): 'NewRecommendationsStage',
+    ("A", "Follow-up"): 'FollowUpStage',
+    ("B", "Clinical Intervention"): 'ClinicalInterventionStage',
+    ("B", "Quotation Phase"): 'QuotationPhaseStage',
+    ("B", "Pre-Admission Prep"): 'PreAdmissionPrepStage',
+    ("C", "Ready to Schedule"): 'ReadyToScheduleStage',
+    ("C", "Pre-Admission Prep"): 'PreAdmissionPrepStage',
+    ("C", "Postponed Admissions"): 'PostponedAdmissionsStage',
+    ("C", "Clinical Stage"): 'ClinicalStage',
+    ("D", "Clinical Stage"): 'ClinicalStage',
+    ("E", "Initial Transition"): 'InitialTransitionStage',
+    ("E", "Final Transition"): 'FinalTransitionStage',
+    ("End", "Closed"): 'ClosedStage',
+    ("A4", "Ready to Schedule"): 'ReadyToScheduleStage',
+}
+
+
+def backfill_stage_records(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    PatientHistory = apps.get_model('patients', 'PatientHistory')
+    StageRecord = apps.get_model('patients', 'StageRecord')
+
+    # Several (cohort, sub_stage) pairs share a table, so a record is labelled with the
+    # pair the patient actually entered: where it sits now if that is this table, else
+    # the latest history transition into this table, else the table's first registry key
+    current = {
+        patient_id: (cohort, sub_stage)
+        for patient_id, cohort, sub_stage in
+        Patient.objects.values_list('id', 'current_cohort', 'current_sub_stage').iterator(chunk_size=2000)
+    }
+    entered = {}
+    history = PatientHistory.objects.order_by('transition_date', 'id').values_list('patient_id', 'next_cohort', 'next_sub_stage')
+    for patient_id, cohort, sub_stage in history.iterator(chunk_size=2000):
+        model_name = STAGE_TABLES.get((cohort, sub_stage))
+        if model_name is not None:
+            entered[patient_id, model_name] = (cohort, sub_stage)
+    defaults = {}
+    for target, model_name in STAGE_TABLES.items():
+        defaults.setdefault(model_name, target)
+
+    for model_name, default in defaults.items():
+        stage_model = apps.get_model('patients', model_name)
+        payload_fields = [
+            field.name for field in stage_model._meta.concrete_fields
+            if field.name not in ('id', 'patient', 'timestamp')
+        ]
+        # Latest row per patient wins, matching the one-row-per-(patient, stage) store
+        latest = {}
+        for row in stage_model.objects.order_by('timestamp', 'id').iterator(chunk_size=2000):
+            latest[row.patient_id] = row
+        records = []
+        for row in latest.values():
+            where = current.get(row.patient_id)
+            if STAGE_TABLES.get(where) != model_name:
+                where = entered.get((row.patient_id, model_name), default)
+            records.append(StageRecord(
+                patient_id=row.patient_id,
+                stage_code=model_name.lower(),
+                cohort=where[0],
+                sub_stage=where[1],
+                entered_at=row.timestamp,
+                payload={name: getattr(row, name) for name in payload_fields},
+            ))
+        StageRecord.objects.bulk_create(records, batch_size=1000, ignore_conflicts=True)
+
+    # Point each patient at the record of the stage table its current stage is filed under
+    record_ids = {
+        (patient_id, stage_code): record_id
+        for record_id, patient_id, stage_code in
+        StageRecord.objects.values_list('id', 'patient_id', 'stage_code').iterator(chunk_size=2000)
+    }
+    pointed = []
+    for patient_id, where in current.items():
+        model_name = STAGE_TABLES.get(where)
+        record_id = record_ids.get((patient_id, model_name.lower())) if model_name else None
+        if record_id is not None:
+            pointed.append(Patient(id=patient_id, current_stage_id=record_id))
+    Patient.objects.bulk_update(pointed, ['current_stage'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0011_stage_record'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_stage_records, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0012_backfill_stage_records'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patienthistory',
+            index=models.Index(fields=['patient', 'transition_date', 'id'], name='history_patient_date_idx'),
+        ),
+    ]
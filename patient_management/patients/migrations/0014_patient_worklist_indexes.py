@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0013_patienthistory_date_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='patient',
+            name='patient_stage_idx',
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['current_cohort', 'current_sub_stage', 'id'], name='patient_stage_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['admission_status', 'current_cohort', 'current_sub_stage', 'id'], name='patient_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(condition=models.Q(('patient_ready', True)), fields=['current_cohort', 'current_sub_stage', 'id'], name='patient_ready_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(condition=models.Q(('clinical_intervention_completed', False), ('clinical_intervention_required', True)), fields=['current_cohort', 'current_sub_stage', 'id'], name='patient_intervention_due_idx'),
+        ),
+    ]
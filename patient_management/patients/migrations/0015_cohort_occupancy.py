@@ -0,0 +1,37 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:36
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_patients(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    CohortOccupancy = apps.get_model('patients', 'CohortOccupancy')
+    stages = Patient.objects.order_by().values('current_cohort', 'current_sub_stage').annotate(patients=Count('id'))
+    CohortOccupancy.objects.bulk_create([
+        CohortOccupancy(cohort=row['current_cohort'], sub_stage=row['current_sub_stage'], count=row['patients'])
+        for row in stages
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0014_patient_worklist_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CohortOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cohort', models.CharField(max_length=50)),
+                ('sub_stage', models.CharField(max_length=50)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cohort', 'sub_stage'), name='cohort_occupancy_stage_uniq')],
+            },
+        ),
+        migrations.RunPython(count_patients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0015_cohort_occupancy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransitionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('from_cohort', models.CharField(max_length=50)),
+                ('from_sub_stage', models.CharField(max_length=50)),
+                ('to_cohort', models.CharField(max_length=50)),
+                ('to_sub_stage', models.CharField(max_length=50)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'from_cohort', 'from_sub_stage', 'to_cohort', 'to_sub_stage'), name='transition_rollup_edge_uniq')],
+            },
+        ),
+    ]
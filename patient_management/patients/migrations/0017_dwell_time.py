@@ -0,0 +1,55 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:38
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Window
+from django.db.models.functions import Lag
+
+
+def backfill_dwell(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    PatientHistory = apps.get_model('patients', 'PatientHistory')
+
+    # A patient entered its current stage with its latest transition; without one, it is unknown
+    latest = PatientHistory.objects.filter(patient=OuterRef('pk')).order_by('-transition_date', '-id')
+    Patient.objects.update(stage_entered_at=Subquery(latest.values('transition_date')[:1]))
+
+    # Pair consecutive history rows once, here, so reports never have to
+    rows = PatientHistory.objects.annotate(entered_at=Window(
+        Lag('transition_date'),
+        partition_by=F('patient_id'),
+        order_by=[F('transition_date').asc(), F('id').asc()],
+    )).values_list('id', 'transition_date', 'entered_at')
+    batch = []
+    for history_id, transition_date, entered_at in rows.iterator():
+        if entered_at is not None:
+            batch.append(PatientHistory(id=history_id, dwell_time=transition_date - entered_at))
+        if len(batch) == 1000:
+            PatientHistory.objects.bulk_update(batch, ['dwell_time'])
+            batch = []
+    PatientHistory.objects.bulk_update(batch, ['dwell_time'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0016_transition_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='stage_entered_at',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True),
+        ),
+        migrations.AddField(
+            model_name='patienthistory',
+            name='dwell_time',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='patienthistory',
+            index=models.Index(fields=['transition_date', 'previous_cohort', 'previous_sub_stage', 'dwell_time'], name='history_dwell_idx'),
+        ),
+        migrations.RunPython(backfill_dwell, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0017_dwell_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopulationSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now, unique=True)),
+                ('patients', models.IntegerField(default=0)),
+                ('counts', models.JSONField(blank=True, default=list)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SnapshotMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('patient_id', models.IntegerField()),
+                ('cohort', models.CharField(max_length=50)),
+                ('sub_stage', models.CharField(max_length=50)),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='patients.populationsnapshot')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('snapshot', 'patient_id'), name='snapshot_membership_patient_uniq')],
+            },
+        ),
+    ]
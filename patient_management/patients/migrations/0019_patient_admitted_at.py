@@ -0,0 +1,24 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0018_population_snapshot'),
+    ]
+
+    operations = [
+        # Added without a default first so existing patients stay NULL (admitted at an
+        # unknown time) instead of all appearing to have been admitted at migration time
+        migrations.AddField(
+            model_name='patient',
+            name='admitted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='admitted_at',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True),
+        ),
+    ]
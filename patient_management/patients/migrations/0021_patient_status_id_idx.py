@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0020_backfill_next_evaluation_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['admission_status', 'id'], name='patient_status_id_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 class Patient(models.Model):
     # Patient-related fields
@@ -12,6 +13,30 @@ class Patient(models.Model):
     days_since_follow_up = models.IntegerField(default=0)
     days_since_last_contact = models.IntegerField(default=0)
     days_until_admission = models.IntegerField(default=0)  # For days-based conditions
+
+    # Anchors the day counters above are derived from (see aging.py). When set,
+    # they take precedence over the stored counters.
+    last_follow_up_at = models.DateTimeField(null=True, blank=True)
+    last_contact_at = models.DateTimeField(null=True, blank=True)
+    admission_date = models.DateField(null=True, blank=True)
+
+    # When a rule for the current stage can next apply; maintained from rules.py
+    # on save and transition so sweeps only read patients that are due.
+    next_evaluation_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    # Bumped on every write; transitions compare-and-swap on it instead of locking the row
+    version = models.PositiveIntegerField(default=0)
+
+    # When the patient entered its current stage; a transition stores now minus this
+    # as the dwell time of the stage it leaves. Null when unknown for legacy patients.
+    stage_entered_at = models.DateTimeField(null=True, blank=True, default=timezone.now)
+
+    # When the patient was admitted, so point-in-time queries can leave out patients that
+    # did not exist yet. Null for patients admitted before it was recorded.
+    admitted_at = models.DateTimeField(null=True, blank=True, default=timezone.now)
+
+    # The patient's row in the unified stage store, see StageRecord
+    current_stage = models.ForeignKey('StageRecord', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
     
     # Status flags
     clinical_intervention_required = models.BooleanField(default=False)
@@ -27,6 +52,22 @@ class Patient(models.Model):
     admission_status = models.CharField(max_length=50, choices=[('Postponed', 'Postponed'), ('Cancelled', 'Cancelled'), ('Pending', 'Pending')], default='Postponed')
     follow_up_attempts = models.CharField(max_length=50, default='None')
 
+    class Meta:
+        indexes = [
+            # Rule lookups and worklists filter on the patient's current stage first; the
+            # trailing id lets a worklist page by id straight off the index
+            models.Index(fields=['current_cohort', 'current_sub_stage', 'id'], name='patient_stage_idx'),
+            models.Index(fields=['admission_status', 'current_cohort', 'current_sub_stage', 'id'], name='patient_status_idx'),
+            # A status-only worklist pages by id without sorting
+            models.Index(fields=['admission_status', 'id'], name='patient_status_id_idx'),
+            # Partial indexes for the flag worklists; they only hold the matching minority of rows
+            models.Index(fields=['current_cohort', 'current_sub_stage', 'id'], condition=models.Q(patient_ready=True),
+                         name='patient_ready_idx'),
+            models.Index(fields=['current_cohort', 'current_sub_stage', 'id'],
+                         condition=models.Q(clinical_intervention_required=True, clinical_intervention_completed=False),
+                         name='patient_intervention_due_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -38,11 +79,123 @@ class PatientHistory(models.Model):
     next_cohort = models.CharField(max_length=50)
     next_sub_stage = models.CharField(max_length=50)
     transition_date = models.DateTimeField(auto_now_add=True)
+    # Time spent in previous_cohort/previous_sub_stage before this transition; null for legacy rows
+    dwell_time = models.DurationField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # History pages walk one patient's rows in (transition_date, id) order
+            models.Index(fields=['patient', 'transition_date', 'id'], name='history_patient_date_idx'),
+            # Dwell reports read a time window across all patients straight off this index
+            models.Index(fields=['transition_date', 'previous_cohort', 'previous_sub_stage', 'dwell_time'],
+                         name='history_dwell_idx'),
+        ]
 
     def __str__(self):
         return f"Transition of {self.patient.name} from {self.previous_cohort} ({self.previous_sub_stage}) to {self.next_cohort} ({self.next_sub_stage})"
 
 
+class StageRecord(models.Model):
+    """
+    Unified stage store: one row per (patient, stage) with the columns every stage
+    shares and the stage-specific fields kept in a JSON payload.
+
+    Written alongside the per-stage tables below so stage lookups and cross-stage
+    reports read a single indexed table.
+    """
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='stage_records')
+    stage_code = models.CharField(max_length=50)
+    cohort = models.CharField(max_length=50)
+    sub_stage = models.CharField(max_length=50)
+    entered_at = models.DateTimeField(default=timezone.now)
+    payload = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'stage_code'], name='stage_record_patient_stage_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['stage_code', 'entered_at'], name='stage_record_code_entered_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient.name} in {self.cohort} ({self.sub_stage})"
+
+
+class CohortOccupancy(models.Model):
+    """
+    Number of patients currently in each (cohort, sub_stage), kept in step with
+    Patient by occupancy.py in the same transaction as every admission and transition.
+    """
+    cohort = models.CharField(max_length=50)
+    sub_stage = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cohort', 'sub_stage'], name='cohort_occupancy_stage_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.cohort} ({self.sub_stage}): {self.count}"
+
+
+class PopulationSnapshot(models.Model):
+    """
+    Cohort membership of every patient at one moment. Point-in-time questions
+    start from the latest snapshot before the moment asked about and replay only
+    the history written after it (see snapshots.py).
+    """
+    taken_at = models.DateTimeField(default=timezone.now, unique=True)
+    patients = models.IntegerField(default=0)
+    # [{"cohort": ..., "sub_stage": ..., "count": ...}, ...] at taken_at
+    counts = models.JSONField(default=list, blank=True)
+
+    def __str__(self):
+        return f"Snapshot of {self.patients} patients at {self.taken_at}"
+
+
+class SnapshotMembership(models.Model):
+    snapshot = models.ForeignKey(PopulationSnapshot, on_delete=models.CASCADE, related_name='memberships')
+    # Plain id rather than a foreign key so snapshots keep describing patients deleted since
+    patient_id = models.IntegerField()
+    cohort = models.CharField(max_length=50)
+    sub_stage = models.CharField(max_length=50)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['snapshot', 'patient_id'], name='snapshot_membership_patient_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Patient {self.patient_id} in {self.cohort} ({self.sub_stage})"
+
+
+class TransitionRollup(models.Model):
+    """
+    Daily count of each stage-to-stage edge in PatientHistory, incremented by
+    rollups.py as the history rows are written. Funnel and transition matrix
+    reports read this instead of scanning the history.
+    """
+    day = models.DateField()
+    from_cohort = models.CharField(max_length=50)
+    from_sub_stage = models.CharField(max_length=50)
+    to_cohort = models.CharField(max_length=50)
+    to_sub_stage = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'from_cohort', 'from_sub_stage', 'to_cohort', 'to_sub_stage'],
+                name='transition_rollup_edge_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day}: {self.from_cohort} ({self.from_sub_stage}) -> {self.to_cohort} ({self.to_sub_stage}) x{self.count}"
+
+
 # Base model for all stage data
 class PatientStage(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
@@ -0,0 +1,72 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count
+
+from .counters import increment
+from .models import CohortOccupancy, Patient
+
+
+def arrival(patient):
+    return Counter({(patient.current_cohort, patient.current_sub_stage): 1})
+
+
+def departure(patient):
+    return Counter({(patient.current_cohort, patient.current_sub_stage): -1})
+
+
+def move(from_stage, to_stage):
+    """Deltas for one patient moving between two (cohort, sub_stage) pairs."""
+    deltas = Counter()
+    deltas[from_stage] -= 1
+    deltas[to_stage] += 1
+    return deltas
+
+
+def adjust_occupancy(deltas):
+    """
+    Apply (cohort, sub_stage) -> delta to the counters in two statements, whatever the
+    number of patients behind the deltas. Must run inside the transaction that moves the patients.
+    """
+    increment(CohortOccupancy, ('cohort', 'sub_stage'), deltas)
+
+
+def occupancy_stats():
+    """Current counters, one row per stage that has ever been occupied."""
+    return list(
+        CohortOccupancy.objects.exclude(count=0).order_by('cohort', 'sub_stage').values('cohort', 'sub_stage', 'count')
+    )
+
+
+def reconcile_occupancy(apply=True):
+    """
+    Recount patients per stage with a GROUP BY and compare against the counters.
+
+    Returns the drift as (cohort, sub_stage, counted, actual) tuples; with `apply` the
+    counters are rewritten to the actual numbers in the same transaction.
+    """
+    with transaction.atomic():
+        actual = {
+            (row['current_cohort'], row['current_sub_stage']): row['patients']
+            for row in Patient.objects.order_by().values('current_cohort', 'current_sub_stage').annotate(patients=Count('id'))
+        }
+        counted = {
+            (row.cohort, row.sub_stage): row
+            for row in CohortOccupancy.objects.select_for_update()
+        }
+        drift = [
+            (cohort, sub_stage, counted[(cohort, sub_stage)].count if (cohort, sub_stage) in counted else 0,
+             actual.get((cohort, sub_stage), 0))
+            for cohort, sub_stage in sorted(set(actual) | set(counted))
+        ]
+        drift = [row for row in drift if row[2] != row[3]]
+
+        if apply and drift:
+            CohortOccupancy.objects.bulk_create(
+                [CohortOccupancy(cohort=cohort, sub_stage=sub_stage, count=patients)
+                 for cohort, sub_stage, _, patients in drift],
+                update_conflicts=True,
+                unique_fields=['cohort', 'sub_stage'],
+                update_fields=['count'],
+            )
+    return drift
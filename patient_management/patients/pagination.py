@@ -0,0 +1,85 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    """The cursor could not be decoded against the ordering it is being used with."""
+
+
+def _cursor_value(value):
+    # Full-precision isoformat: DjangoJSONEncoder rounds to milliseconds, which would
+    # make the next page repeat or skip rows around the cursor
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def encode_cursor(values):
+    """Opaque, URL-safe token for the ordering values of the last row on a page."""
+    raw = json.dumps([_cursor_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    """Ordering values encoded in the cursor, converted back to Python with each model field."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(f"Malformed cursor {cursor!r}")
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor(f"Cursor {cursor!r} does not match the ordering")
+    try:
+        return [model._meta.get_field(name).to_python(value) for name, value in zip(ordering, values)]
+    except (ValidationError, TypeError, ValueError):
+        # to_python raises TypeError or ValueError rather than ValidationError for some wrong types
+        raise InvalidCursor(f"Cursor {cursor!r} does not match the ordering")
+
+
+def after(ordering, values):
+    """
+    Q for rows strictly after `values` in ascending `ordering`:
+    (a > x) OR (a = x AND b > y) OR ... — a plain range scan on a matching composite index.
+    """
+    condition = Q()
+    for position in range(len(ordering) - 1, -1, -1):
+        step = Q(**{f"{ordering[position]}__gt": values[position]})
+        if position < len(ordering) - 1:
+            step |= Q(**{ordering[position]: values[position]}) & condition
+        condition = step
+    return condition
+
+
+def _page_queryset(queryset, ordering, cursor, limit):
+    if cursor:
+        queryset = queryset.filter(after(ordering, decode_cursor(cursor, queryset.model, ordering)))
+    return queryset.order_by(*ordering)[:limit + 1]
+
+
+def _split_page(rows, ordering, limit):
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    get = last.get if isinstance(last, dict) else lambda name: getattr(last, name)
+    return rows, encode_cursor(get(name) for name in ordering)
+
+
+def keyset_page(queryset, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of the queryset in ascending `ordering`, which must end in a unique column.
+
+    The queryset may be a values() projection, in which case it has to include the
+    ordering columns. Returns (rows, next_cursor); next_cursor is None on the last page.
+    One query per page, whatever the offset.
+    """
+    return _split_page(list(_page_queryset(queryset, ordering, cursor, limit)), ordering, limit)
+
+
+async def akeyset_page(queryset, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """keyset_page() for async views, reading the page with async iteration."""
+    return _split_page([row async for row in _page_queryset(queryset, ordering, cursor, limit)], ordering, limit)
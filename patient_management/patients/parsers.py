@@ -0,0 +1,35 @@
+import json
+
+from rest_framework.parsers import BaseParser
+
+
+class InvalidLine:
+    """Stands in for an NDJSON line that is not valid JSON, so it can be reported against its row."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+class NDJSONParser(BaseParser):
+    """
+    Newline-delimited JSON. Returns a generator that reads and decodes one line at a
+    time from the request stream, so a large upload is never held in memory at once.
+    Blank lines are skipped.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        return self._rows(stream, encoding)
+
+    def _rows(self, stream, encoding):
+        if stream is None:
+            return
+        for line in iter(stream.readline, b''):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line.decode(encoding))
+            except ValueError as e:
+                yield InvalidLine(f"Invalid JSON: {e}")
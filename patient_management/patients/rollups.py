@@ -0,0 +1,83 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .counters import increment
+from .models import PatientHistory, TransitionRollup
+
+EDGE_FIELDS = ('day', 'from_cohort', 'from_sub_stage', 'to_cohort', 'to_sub_stage')
+
+
+def record_history(rows):
+    """
+    Count freshly written PatientHistory rows into the daily rollup, two statements
+    per call. Must run inside the transaction that writes the rows.
+    """
+    deltas = Counter(
+        (timezone.localdate(row.transition_date), row.previous_cohort, row.previous_sub_stage,
+         row.next_cohort, row.next_sub_stage)
+        for row in rows
+    )
+    increment(TransitionRollup, EDGE_FIELDS, deltas)
+
+
+def _in_range(queryset, start=None, end=None, field='day'):
+    if start is not None:
+        queryset = queryset.filter(**{f"{field}__gte": start})
+    if end is not None:
+        queryset = queryset.filter(**{f"{field}__lte": end})
+    return queryset
+
+
+def transition_matrix(start=None, end=None):
+    """Edge counts between stages over the inclusive day range, summed from the rollup."""
+    return list(
+        _in_range(TransitionRollup.objects.all(), start, end)
+        .values('from_cohort', 'from_sub_stage', 'to_cohort', 'to_sub_stage')
+        .annotate(count=Sum('count'))
+        .order_by('from_cohort', 'from_sub_stage', 'to_cohort', 'to_sub_stage')
+    )
+
+
+def funnel(start=None, end=None):
+    """How many transitions entered and left each stage over the inclusive day range."""
+    stages = {}
+    for edge in transition_matrix(start, end):
+        source = stages.setdefault((edge['from_cohort'], edge['from_sub_stage']), {'entered': 0, 'exited': 0})
+        source['exited'] += edge['count']
+        target = stages.setdefault((edge['to_cohort'], edge['to_sub_stage']), {'entered': 0, 'exited': 0})
+        target['entered'] += edge['count']
+    return [
+        {'cohort': cohort, 'sub_stage': sub_stage, **counts}
+        for (cohort, sub_stage), counts in sorted(stages.items())
+    ]
+
+
+def backfill_rollups(start=None, end=None, batch_size=1000):
+    """
+    Rebuild the rollup for the inclusive day range (everything by default) from
+    PatientHistory with one GROUP BY, replacing whatever was counted there before.
+    Returns the number of rollup rows written.
+    """
+    history = _in_range(PatientHistory.objects.all(), start, end, field='transition_date__date')
+    edges = (
+        history.annotate(day=TruncDate('transition_date'))
+        .order_by()
+        .values('day', 'previous_cohort', 'previous_sub_stage', 'next_cohort', 'next_sub_stage')
+        .annotate(count=Count('id'))
+    )
+    with transaction.atomic():
+        _in_range(TransitionRollup.objects.all(), start, end).delete()
+        rows = TransitionRollup.objects.bulk_create([
+            TransitionRollup(
+                day=edge['day'],
+                from_cohort=edge['previous_cohort'], from_sub_stage=edge['previous_sub_stage'],
+                to_cohort=edge['next_cohort'], to_sub_stage=edge['next_sub_stage'],
+                count=edge['count'],
+            )
+            for edge in edges
+        ], batch_size=batch_size)
+    return len(rows)
@@ -0,0 +1,222 @@
+import operator
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db.models import Q
+from django.utils import timezone
+
+from .aging import DAY_COUNTERS, day_count, day_count_q, day_count_true_from
+from .models import Patient
+from .transitions import state_transitions
+
+# Comparison used for each "operator" in the state transition table.
+# Conditions without an operator are equality checks.
+OPERATORS = {
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<=": operator.le,
+    "<": operator.lt,
+    None: operator.eq,
+}
+
+# ORM lookup equivalent to each operator, used to push conditions into SQL
+LOOKUPS = {
+    ">=": "gte",
+    ">": "gt",
+    "<=": "lte",
+    "<": "lt",
+    None: "exact",
+}
+
+
+def _resolve_value(value):
+    # The table uses placeholders such as "Y" and "Z" for day thresholds,
+    # the actual numbers come from settings.TRANSITION_THRESHOLDS.
+    thresholds = getattr(settings, 'TRANSITION_THRESHOLDS', {})
+    if isinstance(value, str) and value in thresholds:
+        return thresholds[value]
+    return value
+
+
+class CompiledCondition:
+    """A single condition from the table, resolved once into a field getter and a comparison."""
+
+    __slots__ = ('field', 'operator', 'value', 'compare', 'sub_condition', 'get')
+
+    def __init__(self, condition):
+        self.field = condition['condition']
+        try:
+            Patient._meta.get_field(self.field)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured(f"Transition condition refers to unknown Patient field: {self.field}")
+
+        self.operator = condition.get('operator')
+        if self.operator not in OPERATORS:
+            raise ImproperlyConfigured(f"Unsupported transition operator: {self.operator}")
+        self.compare = OPERATORS[self.operator]
+        if self.field in DAY_COUNTERS:
+            # Day counters are derived from their anchor timestamps at evaluation time
+            self.get = lambda patient, counter=self.field: day_count(patient, counter)
+        else:
+            self.get = operator.attrgetter(self.field)
+        self.value = _resolve_value(condition['value'])
+
+        sub_condition = condition.get('sub_condition')
+        self.sub_condition = CompiledCondition(sub_condition) if sub_condition else None
+
+    def __call__(self, patient):
+        patient_value = self.get(patient)
+        if patient_value is None or not self.compare(patient_value, self.value):
+            return False
+        return self.sub_condition is None or self.sub_condition(patient)
+
+    def true_from(self, patient, now):
+        """
+        When this condition will hold for the patient as stored: `now` if it already
+        does, a later time if only an anchored day counter has to catch up, or None.
+        """
+        anchor_field = DAY_COUNTERS.get(self.field, (None,))[0]
+        if anchor_field is not None and getattr(patient, anchor_field) is not None:
+            when = day_count_true_from(patient, self.field, LOOKUPS[self.operator], self.value, now)
+        else:
+            # Anything else only changes when the patient is written, which reschedules it
+            patient_value = self.get(patient)
+            when = now if patient_value is not None and self.compare(patient_value, self.value) else None
+        if when is None or self.sub_condition is None:
+            return when
+        sub_when = self.sub_condition.true_from(patient, now)
+        return None if sub_when is None else max(when, sub_when)
+
+    def as_q(self, now=None):
+        """The condition as a Q on Patient, selecting the same rows __call__ accepts."""
+        if self.field in DAY_COUNTERS:
+            q = day_count_q(self.field, LOOKUPS[self.operator], self.value, now)
+        else:
+            q = Q(**{f"{self.field}__{LOOKUPS[self.operator]}": self.value})
+        if self.sub_condition is not None:
+            q &= self.sub_condition.as_q(now)
+        return q
+
+    def __repr__(self):
+        return f"<CompiledCondition {self.field} {self.operator or '=='} {self.value!r}>"
+
+
+class CompiledRule:
+    """One entry of the state transition table with its conditions flattened into a predicate list."""
+
+    __slots__ = ('current_cohort', 'current_sub_stage', 'next_cohort', 'next_sub_stage', 'conditions', '_checks')
+
+    def __init__(self, transition):
+        self.current_cohort = transition['current_cohort']
+        self.current_sub_stage = transition['current_sub_stage']
+        self.next_cohort = transition['next_cohort']
+        self.next_sub_stage = transition['next_sub_cohort']
+        conditions = transition.get('conditions', {})
+        # Actions are checked before dispositions, same as the table order.
+        self.conditions = tuple(
+            CompiledCondition(condition)
+            for condition in conditions.get('actions', []) + conditions.get('dispositions', [])
+        )
+        # Flat (getter, compare, value, sub_condition) tuples so matches() avoids a call per condition.
+        self._checks = tuple(
+            (condition.get, condition.compare, condition.value, condition.sub_condition)
+            for condition in self.conditions
+        )
+
+    @property
+    def key(self):
+        return (self.current_sub_stage, self.current_cohort)
+
+    def matches(self, patient):
+        for get, compare, value, sub_condition in self._checks:
+            patient_value = get(patient)
+            if patient_value is None or not compare(patient_value, value):
+                return False
+            if sub_condition is not None and not sub_condition(patient):
+                return False
+        return True
+
+    def eligible_from(self, patient, now):
+        """Earliest time all conditions hold for the patient, or None if that needs a write first."""
+        eligible_at = now
+        for condition in self.conditions:
+            when = condition.true_from(patient, now)
+            if when is None:
+                return None
+            eligible_at = max(eligible_at, when)
+        return eligible_at
+
+    def as_q(self, now=None):
+        """The rule's stage and conditions as a single Q on Patient."""
+        now = now or timezone.now()
+        q = Q(current_cohort=self.current_cohort, current_sub_stage=self.current_sub_stage)
+        for condition in self.conditions:
+            q &= condition.as_q(now)
+        return q
+
+    def eligible_patients(self, queryset=None, now=None):
+        """Patients this rule would transition right now, selected by the database."""
+        if queryset is None:
+            queryset = Patient.objects.all()
+        return queryset.filter(self.as_q(now))
+
+    def __repr__(self):
+        return (f"<CompiledRule ({self.current_cohort}, {self.current_sub_stage}) -> "
+                f"({self.next_cohort}, {self.next_sub_stage})>")
+
+
+class RuleEngine:
+    """
+    The state transition table compiled into a dict keyed by (current_sub_stage, current_cohort).
+
+    Finding the rules for a patient is a single dict lookup, evaluating them only runs
+    the comparisons that were prepared at compile time.
+    """
+
+    def __init__(self, transitions):
+        self.rules = {}
+        for transition in transitions['state_transitions']:
+            rule = CompiledRule(transition)
+            self.rules.setdefault(rule.key, []).append(rule)
+        # Rules sharing a key are tried in table order.
+        self.rules = {key: tuple(rules) for key, rules in self.rules.items()}
+
+    def rules_for(self, patient):
+        return self.rules.get((patient.current_sub_stage, patient.current_cohort), ())
+
+    def match(self, patient):
+        """Return the first rule whose conditions hold for the patient, or None."""
+        for rule in self.rules.get((patient.current_sub_stage, patient.current_cohort), ()):
+            if rule.matches(patient):
+                return rule
+        return None
+
+    def next_evaluation_at(self, patient, now=None):
+        """
+        When the patient should next be evaluated against the rules of its current stage.
+
+        None means no rule can apply until the patient itself is changed.
+        """
+        now = now or timezone.now()
+        candidates = [
+            when for when in (rule.eligible_from(patient, now) for rule in self.rules_for(patient))
+            if when is not None
+        ]
+        return min(candidates) if candidates else None
+
+    def as_q(self, now=None):
+        """Q matching every patient that at least one rule would transition."""
+        now = now or timezone.now()
+        q = Q(pk__in=[])
+        for rules in self.rules.values():
+            for rule in rules:
+                q |= rule.as_q(now)
+        return q
+
+    def eligible_patients(self, queryset=None, now=None):
+        if queryset is None:
+            queryset = Patient.objects.all()
+        return queryset.filter(self.as_q(now))
+
+
+rule_engine = RuleEngine(state_transitions)
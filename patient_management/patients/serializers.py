@@ -1,15 +1,105 @@
 from rest_framework import serializers
-from .models import Patient, PatientHistory
+from .models import Patient, PatientHistory, StageRecord
+from .exports import EXPORT_FORMATS
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from .services import MAX_BATCH_PATIENTS, PATIENT_FLAGS, PATIENT_LIST_FIELDS
 
 class PatientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Patient
         fields = '__all__'
+        read_only_fields = ['stage_entered_at', 'admitted_at', 'next_evaluation_at', 'version', 'current_stage']
+
+class PatientListSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Patient
+        fields = PATIENT_LIST_FIELDS
+
+class PatientListQuerySerializer(serializers.Serializer):
+    # Validate a plain dict of the query params: on a QueryDict DRF reads absent booleans as False
+    current_cohort = serializers.CharField(max_length=50, required=False)
+    current_sub_stage = serializers.CharField(max_length=50, required=False)
+    admission_status = serializers.ChoiceField(choices=Patient._meta.get_field('admission_status').choices, required=False)
+    cursor = serializers.CharField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=MAX_PAGE_SIZE, default=DEFAULT_PAGE_SIZE)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for flag in PATIENT_FLAGS:
+            self.fields[flag] = serializers.BooleanField(required=False)
 
 class PatientHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = PatientHistory
         fields = '__all__'
+
+class PatientHistoryEntrySerializer(serializers.Serializer):
+    # Reads the values() rows of a history page; same keys as PatientHistorySerializer
+    id = serializers.IntegerField()
+    previous_cohort = serializers.CharField()
+    previous_sub_stage = serializers.CharField()
+    next_cohort = serializers.CharField()
+    next_sub_stage = serializers.CharField()
+    transition_date = serializers.DateTimeField()
+    dwell_time = serializers.DurationField(allow_null=True)
+    patient = serializers.IntegerField(source='patient_id')
+
+class HistoryPageSerializer(serializers.Serializer):
+    cursor = serializers.CharField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=MAX_PAGE_SIZE, default=DEFAULT_PAGE_SIZE)
+    since = serializers.DateTimeField(required=False)
+
+class BatchHistorySerializer(serializers.Serializer):
+    patient_ids = serializers.CharField(help_text="Comma separated patient ids")
+    latest = serializers.IntegerField(min_value=1, max_value=MAX_PAGE_SIZE, required=False)
+
+    def validate_patient_ids(self, value):
+        try:
+            patient_ids = list(dict.fromkeys(int(part) for part in value.split(',') if part.strip()))
+        except ValueError:
+            raise serializers.ValidationError("Expected a comma separated list of integer ids.")
+        if not patient_ids:
+            raise serializers.ValidationError("Provide at least one patient id.")
+        if len(patient_ids) > MAX_BATCH_PATIENTS:
+            raise serializers.ValidationError(f"At most {MAX_BATCH_PATIENTS} patient ids per request.")
+        return patient_ids
+
+class DateRangeSerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if 'start' in data and 'end' in data and data['start'] > data['end']:
+            raise serializers.ValidationError("start must not be after end.")
+        return data
+
+class PointInTimeSerializer(serializers.Serializer):
+    at = serializers.DateTimeField()
+
+class BulkAdmissionSerializer(serializers.Serializer):
+    chunk_size = serializers.IntegerField(min_value=1, max_value=5000, default=500)
+
+class ExportQuerySerializer(serializers.Serializer):
+    output = serializers.ChoiceField(choices=EXPORT_FORMATS, default='ndjson')
+    gzip = serializers.BooleanField(default=False)
+
+class StageRecordSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StageRecord
+        fields = ['id', 'stage_code', 'cohort', 'sub_stage', 'entered_at', 'payload']
+
+class BulkTransitionSerializer(serializers.Serializer):
+    patient_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+    cohort = serializers.CharField(max_length=50, required=False)
+    sub_stage = serializers.CharField(max_length=50, required=False)
+    chunk_size = serializers.IntegerField(min_value=1, max_value=5000, default=500)
+
+    def validate(self, data):
+        if 'patient_ids' in data and ('cohort' in data or 'sub_stage' in data):
+            raise serializers.ValidationError("Provide either patient_ids or a cohort/sub_stage filter, not both.")
+        if 'patient_ids' not in data and 'cohort' not in data and 'sub_stage' not in data:
+            raise serializers.ValidationError("Provide patient_ids or a cohort/sub_stage filter.")
+        return data
 # serializers.py
 
 
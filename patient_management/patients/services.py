@@ -0,0 +1,312 @@
+import logging
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .cache import invalidate_patients
+from .models import Patient, PatientHistory
+from .occupancy import adjust_occupancy, arrival, move
+from .rollups import record_history
+from .rules import rule_engine
+from .stages import build_stage_record, get_stage_class, is_registered, save_stage_records
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+
+# Columns a transition changes on Patient
+TRANSITION_FIELDS = [
+    'previous_cohort', 'previous_sub_stage', 'current_cohort', 'current_sub_stage', 'stage_entered_at', 'next_evaluation_at',
+]
+
+# Largest id list accepted by the batch history lookup, and how many ids go into one IN (...)
+MAX_BATCH_PATIENTS = 5000
+HISTORY_ID_CHUNK_SIZE = 1000
+
+HISTORY_ORDERING = ('transition_date', 'id')
+HISTORY_COLUMNS = (
+    'id', 'patient_id', 'previous_cohort', 'previous_sub_stage', 'next_cohort', 'next_sub_stage', 'transition_date', 'dwell_time',
+)
+
+# Columns a patient worklist returns, loaded with only()
+PATIENT_LIST_FIELDS = ['id', 'name', 'current_cohort', 'current_sub_stage', 'admission_status', 'next_evaluation_at', 'version']
+
+# Boolean status flags the patient list can filter on
+PATIENT_FLAGS = [
+    'clinical_intervention_required', 'quotation_phase_required', 'patient_ready', 'clinical_intervention_completed',
+    'quotation_accepted', 'scheduled_admission', 'scheduled_date_in_past', 'admission_completed',
+    'lead_management_ends', 'final_response_received',
+]
+
+# How many times a single transition re-reads and re-evaluates after losing a version race
+MAX_TRANSITION_RETRIES = 3
+
+
+def dwell_time(patient, now):
+    """How long the patient has been in its current stage, or None when its entry time is unknown."""
+    return now - patient.stage_entered_at if patient.stage_entered_at else None
+
+
+def iter_patient_chunks(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield lists of patients from the queryset, walking it by id so each chunk is one query."""
+    queryset = queryset.order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+
+def iter_patient_id_chunks(patient_ids, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield (requested ids, loaded patients) for an explicit list of ids, one query per chunk."""
+    for start in range(0, len(patient_ids), chunk_size):
+        ids = patient_ids[start:start + chunk_size]
+        yield ids, list(Patient.objects.filter(id__in=ids).order_by('id'))
+
+
+def schedule_patients(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Recompute next_evaluation_at for every patient in the queryset, one bulk_update per
+    chunk. Only patients whose schedule actually moved are written, versioned and
+    invalidated, so a reschedule that changes nothing leaves ETags and cache entries alone.
+    """
+    now = timezone.now()
+    updated = 0
+    for chunk in iter_patient_chunks(queryset, chunk_size):
+        changed = []
+        for patient in chunk:
+            next_evaluation_at = rule_engine.next_evaluation_at(patient, now)
+            if next_evaluation_at != patient.next_evaluation_at:
+                patient.next_evaluation_at = next_evaluation_at
+                patient.version = F('version') + 1
+                changed.append(patient)
+        if changed:
+            updated += Patient.objects.bulk_update(changed, ['next_evaluation_at', 'version'])
+            invalidate_patients(patient.id for patient in changed)
+    return updated
+
+
+def due_patients(now=None):
+    """Patients whose scheduled evaluation time has come, read through the next_evaluation_at index."""
+    return Patient.objects.filter(next_evaluation_at__lte=now or timezone.now())
+
+
+def _validators_query(patient_id):
+    latest = PatientHistory.objects.filter(patient_id=OuterRef('pk')).order_by('-transition_date', '-id')
+    return Patient.objects.filter(id=patient_id).values(
+        'version',
+        latest_history_id=Subquery(latest.values('id')[:1]),
+        latest_transition_at=Subquery(latest.values('transition_date')[:1]),
+    )
+
+
+def patient_validators(patient_id):
+    """
+    Cache validators for a patient's reads in one query: its version, plus the id and
+    date of its newest history row read off history_patient_date_idx. None if the patient does not exist.
+    """
+    return _validators_query(patient_id).first()
+
+
+async def apatient_validators(patient_id):
+    """patient_validators() for async views."""
+    return await _validators_query(patient_id).afirst()
+
+
+def patient_histories(patient_ids, latest=None, chunk_size=HISTORY_ID_CHUNK_SIZE):
+    """
+    History rows for many patients, grouped by patient id in (transition_date, id) order.
+
+    One values() query per chunk of ids. With `latest`, only each patient's newest
+    `latest` rows are kept, picked in the database with ROW_NUMBER() over a
+    per-patient window instead of loading every row. Every requested id gets a
+    list, empty when the patient has no history (or does not exist).
+    """
+    grouped = {patient_id: [] for patient_id in patient_ids}
+    for start in range(0, len(patient_ids), chunk_size):
+        rows = PatientHistory.objects.filter(patient_id__in=patient_ids[start:start + chunk_size])
+        if latest is not None:
+            rows = rows.annotate(recency=Window(
+                RowNumber(),
+                partition_by=F('patient_id'),
+                order_by=[F('transition_date').desc(), F('id').desc()],
+            )).filter(recency__lte=latest)
+        for row in rows.order_by('patient_id', *HISTORY_ORDERING).values(*HISTORY_COLUMNS):
+            grouped[row['patient_id']].append(row)
+    return grouped
+
+
+def enter_initial_stages(patients, now=None):
+    """
+    Write the stage rows for newly admitted patients' current stage, one bulk_create per
+    stage model and one StageRecord upsert, and point current_stage at the records.
+    Patients admitted into a stage without a stage table are left as they are.
+    """
+    now = now or timezone.now()
+    stage_rows = {}
+    for patient in patients:
+        stage_class = get_stage_class(patient.current_cohort, patient.current_sub_stage)
+        if stage_class is not None:
+            stage_rows.setdefault(stage_class, []).append(stage_class(patient=patient))
+
+    records = []
+    for stage_class, rows in stage_rows.items():
+        stage_class.objects.bulk_create(rows)
+        records.extend(build_stage_record(row.patient, stage_class, now) for row in rows)
+    if records:
+        save_stage_records(records)
+        for record in records:
+            record.patient.current_stage = record
+        Patient.objects.bulk_update([record.patient for record in records], ['current_stage'])
+
+
+def admit_patients(rows, now=None):
+    """
+    Create patients from validated PatientSerializer data in one transaction: a single
+    bulk_create, their initial stage rows and the occupancy counters. bulk_create skips
+    the model signals, so the scheduling and bookkeeping they do on save happens here.
+    Returns the saved patients.
+    """
+    now = now or timezone.now()
+    patients = [Patient(**row) for row in rows]
+    for patient in patients:
+        patient.stage_entered_at = now
+        patient.next_evaluation_at = rule_engine.next_evaluation_at(patient, now)
+
+    with transaction.atomic():
+        Patient.objects.bulk_create(patients)
+        enter_initial_stages(patients, now)
+        arrivals = Counter()
+        for patient in patients:
+            arrivals.update(arrival(patient))
+        adjust_occupancy(arrivals)
+        invalidate_patients(patient.id for patient in patients)
+    logger.info(f"Admitted {len(patients)} patients.")
+    return patients
+
+
+def transition_patients(patients):
+    """
+    Apply the matching transition rule to every patient in the list.
+
+    Rules are evaluated in memory, then all writes go out in one transaction: a version
+    claim per patient, one bulk_create per stage model touched, one upsert into StageRecord, a
+    single bulk_update on Patient, the occupancy counter adjustment, one bulk_create
+    on PatientHistory and the daily rollup increment. Patients written by someone else since they were
+    loaded are skipped with a "conflict" outcome. Patients that stay put but whose
+    next_evaluation_at changed are rescheduled with one more bulk_update. Returns one
+    outcome dict per patient, in input order.
+    """
+    now = timezone.now()
+    outcomes = []
+    moved = []
+    rescheduled = []
+    history = []
+    stage_rows = {}
+
+    for patient in patients:
+        rule = rule_engine.match(patient)
+        if rule is None:
+            next_evaluation_at = rule_engine.next_evaluation_at(patient, now)
+            if next_evaluation_at != patient.next_evaluation_at:
+                patient.next_evaluation_at = next_evaluation_at
+                rescheduled.append(patient)
+            outcomes.append({"patient_id": patient.id, "status": "no_transition"})
+            continue
+
+        history.append(PatientHistory(
+            patient=patient,
+            previous_cohort=patient.current_cohort,
+            previous_sub_stage=patient.current_sub_stage,
+            next_cohort=rule.next_cohort,
+            next_sub_stage=rule.next_sub_stage,
+            dwell_time=dwell_time(patient, now),
+        ))
+        patient.stage_entered_at = now
+        patient.previous_cohort = patient.current_cohort
+        patient.previous_sub_stage = patient.current_sub_stage
+        patient.current_cohort = rule.next_cohort
+        patient.current_sub_stage = rule.next_sub_stage
+        patient.next_evaluation_at = rule_engine.next_evaluation_at(patient, now)
+        moved.append(patient)
+
+        stage_class = get_stage_class(patient.current_cohort, patient.current_sub_stage)
+        if stage_class is None:
+            if not is_registered(patient.current_cohort, patient.current_sub_stage):
+                logger.error(f"Stage class not found for cohort {patient.current_cohort}, sub-stage {patient.current_sub_stage}")
+        else:
+            stage_rows.setdefault(stage_class, []).append(stage_class(patient=patient))
+
+        outcomes.append({
+            "patient_id": patient.id,
+            "status": "transitioned",
+            "cohort": patient.current_cohort,
+            "sub_stage": patient.current_sub_stage,
+            "stage": stage_class.__name__ if stage_class else None,
+        })
+
+    if moved or rescheduled:
+        with transaction.atomic():
+            # Claim every patient still at the version it was loaded with, so a concurrent
+            # transition is never applied twice; the rest are dropped as conflicts
+            claimed = _claim_versions(moved + rescheduled)
+            lost = {patient.id for patient in moved + rescheduled if patient.id not in claimed}
+            if lost:
+                moved = [patient for patient in moved if patient.id not in lost]
+                rescheduled = [patient for patient in rescheduled if patient.id not in lost]
+                history = [row for row in history if row.patient_id not in lost]
+                stage_rows = {
+                    stage_class: [row for row in rows if row.patient_id not in lost]
+                    for stage_class, rows in stage_rows.items()
+                }
+                outcomes = [
+                    {"patient_id": outcome['patient_id'], "status": "conflict"} if outcome['patient_id'] in lost else outcome
+                    for outcome in outcomes
+                ]
+                logger.warning(f"Bulk transition skipped {len(lost)} patients changed concurrently.")
+
+            if moved:
+                records = []
+                for stage_class, rows in stage_rows.items():
+                    if rows:
+                        stage_class.objects.bulk_create(rows)
+                        records.extend(build_stage_record(row.patient, stage_class, now) for row in rows)
+                save_stage_records(records)
+                current_stages = {record.patient_id: record for record in records}
+                for patient in moved:
+                    patient.version += 1
+                    patient.current_stage = current_stages.get(patient.id)
+                Patient.objects.bulk_update(moved, TRANSITION_FIELDS + ['current_stage'])
+                deltas = Counter()
+                for patient in moved:
+                    deltas.update(move((patient.previous_cohort, patient.previous_sub_stage),
+                                       (patient.current_cohort, patient.current_sub_stage)))
+                adjust_occupancy(deltas)
+                PatientHistory.objects.bulk_create(history)
+                record_history(history)
+            if rescheduled:
+                for patient in rescheduled:
+                    patient.version += 1
+                Patient.objects.bulk_update(rescheduled, ['next_evaluation_at'])
+            invalidate_patients(patient.id for patient in moved + rescheduled)
+        logger.info(f"Bulk transition moved {len(moved)} of {len(outcomes)} patients.")
+
+    return outcomes
+
+
+def _claim_versions(patients):
+    """
+    Bump the version of every patient whose row still has the version it was loaded with
+    and return the ids that matched. Each check and bump is one conditional UPDATE, like
+    PatientViewSet._commit_transition, so no other writer can slip in between them even
+    where select_for_update() is a no-op (SQLite).
+    """
+    return {
+        patient.id for patient in patients
+        if Patient.objects.filter(id=patient.id, version=patient.version).update(version=F('version') + 1)
+    }
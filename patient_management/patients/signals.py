@@ -0,0 +1,43 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Patient
+from .cache import invalidate_patients
+from .occupancy import adjust_occupancy, arrival, departure
+from .rules import rule_engine
+
+
+@receiver(pre_save, sender=Patient)
+def schedule_next_evaluation(sender, instance, raw=False, **kwargs):
+    # Saves that pass update_fields must include next_evaluation_at for this to be stored
+    if not raw:
+        instance.next_evaluation_at = rule_engine.next_evaluation_at(instance)
+
+
+@receiver(pre_save, sender=Patient)
+def bump_version(sender, instance, raw=False, **kwargs):
+    # Any write to an existing patient invalidates transitions computed from the old row
+    if not raw and not instance._state.adding:
+        instance.version += 1
+
+
+@receiver(post_save, sender=Patient)
+def count_admission(sender, instance, created, raw=False, **kwargs):
+    # Transitions adjust the counters themselves; saves that change the stage any
+    # other way are picked up by the reconcile_occupancy command
+    if created and not raw:
+        adjust_occupancy(arrival(instance))
+
+
+@receiver(post_delete, sender=Patient)
+def count_discharge(sender, instance, **kwargs):
+    adjust_occupancy(departure(instance))
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def invalidate_cached_patient(sender, instance, **kwargs):
+    # New patients too. Ids come from AUTOINCREMENT and aren't reused, but entries for an
+    # id can outlive its row when the database is flushed or restored under a kept cache,
+    # or a row is saved with an explicit id; a fresh generation token orphans them
+    invalidate_patients([instance.pk])
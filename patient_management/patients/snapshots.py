@@ -0,0 +1,146 @@
+import logging
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Patient, PatientHistory, PopulationSnapshot, SnapshotMembership
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_BATCH_SIZE = 1000
+
+
+def take_snapshot(now=None, batch_size=SNAPSHOT_BATCH_SIZE):
+    """Record every patient's current stage, walking Patient by id so memory stays flat."""
+    now = now or timezone.now()
+    counts = Counter()
+    with transaction.atomic():
+        snapshot = PopulationSnapshot.objects.create(taken_at=now)
+        last_id = 0
+        while True:
+            rows = list(
+                Patient.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'current_cohort', 'current_sub_stage')[:batch_size]
+            )
+            if not rows:
+                break
+            SnapshotMembership.objects.bulk_create([
+                SnapshotMembership(snapshot=snapshot, patient_id=patient_id, cohort=cohort, sub_stage=sub_stage)
+                for patient_id, cohort, sub_stage in rows
+            ])
+            counts.update((cohort, sub_stage) for _, cohort, sub_stage in rows)
+            last_id = rows[-1][0]
+
+        snapshot.patients = sum(counts.values())
+        snapshot.counts = [
+            {'cohort': cohort, 'sub_stage': sub_stage, 'count': count}
+            for (cohort, sub_stage), count in sorted(counts.items())
+        ]
+        snapshot.save(update_fields=['patients', 'counts'])
+    return snapshot
+
+
+def snapshot_before(at):
+    """Latest snapshot taken at or before `at`, or None."""
+    return PopulationSnapshot.objects.filter(taken_at__lte=at).order_by('-taken_at').first()
+
+
+def stage_at(patient_id, at):
+    """
+    (cohort, sub_stage, source) the patient was in at `at`, or None for an unknown patient.
+
+    The last transition at or before `at` decides, looking back no further than the
+    nearest snapshot, which answers otherwise. Without either, the stage the patient
+    left on its first later transition is used, and failing that its current stage.
+    A patient admitted after `at` gives (None, None, 'not_admitted'); patients with no
+    recorded admission time are assumed to have existed at `at`.
+    """
+    snapshot = snapshot_before(at)
+    history = PatientHistory.objects.filter(patient_id=patient_id, transition_date__lte=at)
+    if snapshot is not None:
+        history = history.filter(transition_date__gt=snapshot.taken_at)
+    last = history.order_by('-transition_date', '-id').values('next_cohort', 'next_sub_stage').first()
+    if last is not None:
+        return last['next_cohort'], last['next_sub_stage'], 'history'
+
+    if snapshot is not None:
+        member = snapshot.memberships.filter(patient_id=patient_id).values('cohort', 'sub_stage').first()
+        if member is not None:
+            return member['cohort'], member['sub_stage'], 'snapshot'
+
+    current = (
+        Patient.objects.filter(id=patient_id)
+        .values('current_cohort', 'current_sub_stage', 'admitted_at').first()
+    )
+    if current is None:
+        return None
+    if current['admitted_at'] is not None and current['admitted_at'] > at:
+        return None, None, 'not_admitted'
+
+    following = (
+        PatientHistory.objects.filter(patient_id=patient_id, transition_date__gt=at)
+        .order_by('transition_date', 'id').values('previous_cohort', 'previous_sub_stage').first()
+    )
+    if following is not None:
+        return following['previous_cohort'], following['previous_sub_stage'], 'history'
+    return current['current_cohort'], current['current_sub_stage'], 'current'
+
+
+def population_at(at):
+    """
+    (snapshot, counts) with the number of patients in each (cohort, sub_stage) at `at`,
+    or (None, None) when no snapshot was taken at or before it.
+
+    Starts from the snapshot's counts, adds the patients admitted between the snapshot
+    and `at` at the stage they were admitted into, then replays the transitions written
+    since, grouped by edge in one query over the transition_date index. Only the
+    transitions of patients counted by one of those two steps are replayed, so every
+    move out of a stage is matched by a patient counted in it.
+    """
+    snapshot = snapshot_before(at)
+    if snapshot is None:
+        return None, None
+
+    counts = Counter({(row['cohort'], row['sub_stage']): row['count'] for row in snapshot.counts})
+    members = snapshot.memberships.values('patient_id')
+
+    # A patient's admission stage is the one it left on its first transition, or its
+    # current stage if it has not transitioned yet
+    first = PatientHistory.objects.filter(patient_id=OuterRef('pk')).order_by('transition_date', 'id')
+    admitted = (
+        Patient.objects.filter(admitted_at__gt=snapshot.taken_at, admitted_at__lte=at).exclude(id__in=members)
+        .annotate(
+            cohort=Coalesce(Subquery(first.values('previous_cohort')[:1]), 'current_cohort'),
+            sub_stage=Coalesce(Subquery(first.values('previous_sub_stage')[:1]), 'current_sub_stage'),
+        )
+        .order_by()
+        .values('cohort', 'sub_stage')
+        .annotate(patients=Count('id'))
+    )
+    for row in admitted:
+        counts[(row['cohort'], row['sub_stage'])] += row['patients']
+
+    edges = (
+        PatientHistory.objects.filter(transition_date__gt=snapshot.taken_at, transition_date__lte=at)
+        .filter(Q(patient_id__in=members) | Q(patient__admitted_at__gt=snapshot.taken_at, patient__admitted_at__lte=at))
+        .order_by()
+        .values('previous_cohort', 'previous_sub_stage', 'next_cohort', 'next_sub_stage')
+        .annotate(moves=Count('id'))
+    )
+    for edge in edges:
+        counts[(edge['previous_cohort'], edge['previous_sub_stage'])] -= edge['moves']
+        counts[(edge['next_cohort'], edge['next_sub_stage'])] += edge['moves']
+
+    # A negative count means the snapshot and the history disagree; keep it in the
+    # result so the drift shows up instead of being hidden
+    drifted = sorted(stage for stage, count in counts.items() if count < 0)
+    if drifted:
+        logger.warning(f"Population at {at} from snapshot {snapshot.id} has negative counts for {drifted}; "
+                       f"the snapshot and the transition history disagree.")
+    return snapshot, [
+        {'cohort': cohort, 'sub_stage': sub_stage, 'count': count}
+        for (cohort, sub_stage), count in sorted(counts.items()) if count != 0
+    ]
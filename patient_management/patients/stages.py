@@ -0,0 +1,106 @@
+from django.core import checks
+from django.utils import timezone
+
+from .aging import DAY_COUNTERS, day_count
+from .models import (
+    StageRecord, NewRecommendationsStage, FollowUpStage, ClinicalInterventionStage, QuotationPhaseStage,
+    ReadyToScheduleStage, PreAdmissionPrepStage, PostponedAdmissionsStage, ClinicalStage,
+    InitialTransitionStage, FinalTransitionStage, ClosedStage,
+)
+from .transitions import state_transitions
+
+# Stage table for every (cohort, sub_stage) a patient can be moved into. Keys use the
+# exact strings the state transition table produces; None marks a target that
+# deliberately has no stage table.
+STAGE_REGISTRY = {
+    ("A", "New Recommendations"): NewRecommendationsStage,
+    ("A", "Follow-up"): FollowUpStage,
+    ("B", "Clinical Intervention"): ClinicalInterventionStage,
+    ("B", "Quotation Phase"): QuotationPhaseStage,
+    ("B", "Pre-Admission Prep"): PreAdmissionPrepStage,
+    ("C", "Ready to Schedule"): ReadyToScheduleStage,
+    ("C", "Pre-Admission Prep"): PreAdmissionPrepStage,
+    ("C", "Postponed Admissions"): PostponedAdmissionsStage,
+    ("C", "Clinical Stage"): ClinicalStage,
+    ("D", "Clinical Stage"): ClinicalStage,
+    ("E", "Initial Transition"): InitialTransitionStage,
+    ("E", "Final Transition"): FinalTransitionStage,
+    ("E", "Move to previous"): None,
+    ("End", "Closed"): ClosedStage,
+    # Rule A3 names the target cohort by its sub-stage code
+    ("A4", "Ready to Schedule"): ReadyToScheduleStage,
+}
+
+
+# Stage-specific columns of each stage table, copied into StageRecord.payload
+STAGE_PAYLOAD_FIELDS = {
+    stage_class: tuple(
+        field.name for field in stage_class._meta.concrete_fields
+        if field.name not in ('id', 'patient', 'timestamp')
+    )
+    for stage_class in set(STAGE_REGISTRY.values()) if stage_class is not None
+}
+
+
+def get_stage_class(cohort, sub_stage):
+    """Return the stage model for (cohort, sub_stage), or None if there is no stage table for it."""
+    return STAGE_REGISTRY.get((cohort, sub_stage))
+
+
+def is_registered(cohort, sub_stage):
+    return (cohort, sub_stage) in STAGE_REGISTRY
+
+
+def stage_code(stage_class):
+    return stage_class._meta.model_name
+
+
+def build_stage_record(patient, stage_class, now=None):
+    """
+    Unsaved StageRecord for the patient entering stage_class, with its payload snapshotted
+    from the patient. Day counters are derived as of `now`, since the stored columns are
+    only refreshed for patients without an anchor timestamp.
+    """
+    now = now or timezone.now()
+    return StageRecord(
+        patient=patient,
+        stage_code=stage_code(stage_class),
+        cohort=patient.current_cohort,
+        sub_stage=patient.current_sub_stage,
+        entered_at=now,
+        payload={
+            name: day_count(patient, name, now) if name in DAY_COUNTERS else getattr(patient, name)
+            for name in STAGE_PAYLOAD_FIELDS[stage_class]
+        },
+    )
+
+
+def save_stage_records(records):
+    """
+    Insert the records in one statement, overwriting the existing row when a patient
+    re-enters a stage. Primary keys are set on the records.
+    """
+    if not records:
+        return records
+    return StageRecord.objects.bulk_create(
+        records,
+        update_conflicts=True,
+        unique_fields=['patient', 'stage_code'],
+        update_fields=['cohort', 'sub_stage', 'entered_at', 'payload'],
+    )
+
+
+@checks.register()
+def check_stage_registry(app_configs=None, **kwargs):
+    """Every transition target in the state transition table must be routed to a stage."""
+    errors = []
+    for transition in state_transitions['state_transitions']:
+        target = (transition['next_cohort'], transition['next_sub_cohort'])
+        if target not in STAGE_REGISTRY:
+            errors.append(checks.Error(
+                f"Transition target {target} from ({transition['current_cohort']}, "
+                f"{transition['current_sub_stage']}) has no entry in STAGE_REGISTRY.",
+                obj='patients.stages.STAGE_REGISTRY',
+                id='patients.E001',
+            ))
+    return errors
@@ -0,0 +1,86 @@
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.db import OperationalError
+from django.db.models import Max, Min
+
+from .models import Patient
+from .services import DEFAULT_CHUNK_SIZE, due_patients, transition_patients
+from .workers import init_worker, sweep_range_task
+
+# How often a chunk is retried when SQLite reports the database as locked/busy
+MAX_BUSY_RETRIES = 8
+BUSY_BACKOFF_SECONDS = 0.05
+
+
+def id_ranges(queryset, parts):
+    """Split the id span of the queryset into at most `parts` contiguous, inclusive (low, high) ranges."""
+    bounds = queryset.aggregate(low=Min('id'), high=Max('id'))
+    low, high = bounds['low'], bounds['high']
+    if low is None:
+        return []
+    parts = max(1, min(parts, high - low + 1))
+    step = (high - low + 1) / parts
+    edges = [low + round(step * i) for i in range(parts)] + [high + 1]
+    return [[edges[i], edges[i + 1] - 1] for i in range(parts) if edges[i] < edges[i + 1]]
+
+
+def sweep_candidates(full=False):
+    """Patients a sweep reads: the ones that are due, or everyone for a full rescan."""
+    return Patient.objects.all() if full else due_patients()
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def sweep_range(id_range, chunk_size=DEFAULT_CHUNK_SIZE, full=False):
+    """
+    Sweep the candidate patients whose id falls in the inclusive range, chunk by chunk.
+
+    Each chunk is loaded and written inside the retry loop, so a chunk that hit a
+    locked database is re-read and re-evaluated from committed state.
+    """
+    low, high = id_range
+    queryset = sweep_candidates(full).filter(id__gte=low, id__lte=high).order_by('id')
+    summary = {'range': list(id_range), 'scanned': 0, 'transitioned': 0, 'retries': 0}
+    last_id = low - 1
+    while True:
+        for attempt in range(MAX_BUSY_RETRIES + 1):
+            try:
+                chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+                outcomes = transition_patients(chunk) if chunk else []
+                break
+            except OperationalError as e:
+                if not _is_busy(e) or attempt == MAX_BUSY_RETRIES:
+                    raise
+                summary['retries'] += 1
+                # Exponential backoff with jitter so the workers don't retry in lockstep
+                time.sleep(BUSY_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+        if not chunk:
+            return summary
+        summary['scanned'] += len(chunk)
+        summary['transitioned'] += sum(1 for outcome in outcomes if outcome['status'] == 'transitioned')
+        last_id = chunk[-1].id
+
+
+def run_parallel_sweep(ranges, workers, databases, chunk_size=DEFAULT_CHUNK_SIZE, full=False):
+    """Fan the id ranges out to a process pool and yield each range's summary as it finishes."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=init_worker, initargs=(databases,)) as executor:
+        futures = [executor.submit(sweep_range_task, id_range, chunk_size, full) for id_range in ranges]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def merge_summaries(summaries):
+    total = {'ranges': 0, 'scanned': 0, 'transitioned': 0, 'retries': 0}
+    for summary in summaries:
+        total['ranges'] += 1
+        for key in ('scanned', 'transitioned', 'retries'):
+            total[key] += summary[key]
+    return total
@@ -1,3 +1,1259 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+from collections import Counter
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DatabaseError, NotSupportedError, connection, connections
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from .models import (
+    Patient, PatientHistory, FollowUpStage, PopulationSnapshot, PreAdmissionPrepStage, ReadyToScheduleStage, StageRecord,
+    TransitionRollup,
+)
+from .aging import DaysSince, day_count, refresh_day_counters
+from .checkpoints import save_checkpoint
+from .dwell import DEFAULT_WINDOW_DAYS
+from .exports import export_blocks
+from .management.commands import import_patients
+from .management.commands.benchmark_rules import build_population
+from .occupancy import occupancy_stats, reconcile_occupancy
+from . import services
+from .rules import RuleEngine, rule_engine
+from .serializers import (
+    PatientHistoryEntrySerializer, PatientHistorySerializer, PatientListSerializer, PatientSerializer, StageRecordSerializer,
+)
+from .stages import STAGE_REGISTRY, check_stage_registry
+from .snapshots import stage_at, take_snapshot
+from .services import due_patients, enter_initial_stages, patient_histories, schedule_patients, transition_patients
+from .sweep import id_ranges, merge_summaries, sweep_range
+from .transitions import state_transitions
+from .views import PatientViewSet, VersionConflict
+from .values_serializers import (
+    ValuesSerializer, history_entry_values, patient_list_values, patient_values, stage_record_values,
+)
+
+
+def ready_patient(**overrides):
+    """A saved patient in (New Recommendations, A1) that rule A1 moves on; keyword arguments override any field."""
+    fields = dict(name="Jane", current_sub_stage="A1", current_cohort="New Recommendations",
+                  days_since_follow_up=2, clinical_intervention_required=True,
+                  quotation_phase_required=True, patient_ready=True)
+    fields.update(overrides)
+    return Patient.objects.create(**fields)
+
+class RuleEngineTests(TestCase):
+
+    def test_rules_are_indexed_by_sub_stage_and_cohort(self):
+        self.assertEqual(len(rule_engine.rules), len(state_transitions['state_transitions']))
+        rule, = rule_engine.rules[("A1", "New Recommendations")]
+        self.assertEqual((rule.next_cohort, rule.next_sub_stage), ("A", "Follow-up"))
+
+    def test_match_requires_every_condition(self):
+        patient = Patient(current_sub_stage="A1", current_cohort="New Recommendations",
+                          days_since_follow_up=1, clinical_intervention_required=True,
+                          quotation_phase_required=True, patient_ready=True)
+        self.assertEqual(rule_engine.match(patient).next_sub_stage, "Follow-up")
+        patient.patient_ready = False
+        self.assertIsNone(rule_engine.match(patient))
+
+    def test_unknown_stage_has_no_rules(self):
+        self.assertIsNone(rule_engine.match(Patient(current_sub_stage="Follow-up", current_cohort="A")))
+
+    def test_sub_condition_is_applied(self):
+        patient = Patient(current_sub_stage="C1", current_cohort="Postponed Admissions",
+                          scheduled_date_in_past=True, admission_completed=False)
+        self.assertIsNotNone(rule_engine.match(patient))
+        patient.admission_completed = True
+        self.assertIsNone(rule_engine.match(patient))
+
+    @override_settings(TRANSITION_THRESHOLDS={'Y': 2})
+    def test_placeholder_thresholds_come_from_settings(self):
+        engine = RuleEngine(state_transitions)
+        patient = Patient(current_sub_stage="A3", current_cohort="Quotation Phase",
+                          quotation_accepted=True, days_since_last_contact=2)
+        self.assertIsNone(engine.match(patient))
+        patient.days_since_last_contact = 3
+        self.assertIsNotNone(engine.match(patient))
+
+
+class RuleQueryEquivalenceTests(TestCase):
+    """The SQL path (rule.as_q) must select exactly the patients the Python path accepts."""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(7)
+        now = timezone.now()
+        patients = build_population(600, seed=42)
+        for patient in patients[::3]:
+            # Half-day offsets keep anchors away from day boundaries while the test runs
+            patient.last_follow_up_at = now - timedelta(days=rng.randint(0, 10) + 0.5)
+            patient.last_contact_at = now - timedelta(days=rng.randint(0, 10) + 0.5)
+            patient.admission_date = timezone.localdate(now) + timedelta(days=rng.randint(-3, 10))
+        Patient.objects.bulk_create(patients)
+        cls.patients = list(Patient.objects.all())
+
+    def test_each_rule_selects_the_same_patients(self):
+        for rules in rule_engine.rules.values():
+            for rule in rules:
+                with self.subTest(rule=rule):
+                    expected = {p.id for p in self.patients if rule in rule_engine.rules_for(p) and rule.matches(p)}
+                    selected = set(rule.eligible_patients().values_list('id', flat=True))
+                    self.assertEqual(selected, expected)
+
+    def test_engine_selects_the_same_patients(self):
+        expected = {p.id for p in self.patients if rule_engine.match(p) is not None}
+        self.assertTrue(expected)
+        self.assertEqual(set(rule_engine.eligible_patients().values_list('id', flat=True)), expected)
+
+    def test_sub_condition_is_part_of_the_query(self):
+        rule, = rule_engine.rules[("C1", "Postponed Admissions")]
+        self.assertFalse(rule.eligible_patients().filter(admission_completed=True).exists())
+
+    def test_eligibility_is_a_single_query(self):
+        rule, = rule_engine.rules[("A1", "New Recommendations")]
+        with self.assertNumQueries(1):
+            list(rule.eligible_patients())
+
+
+class DayCounterTests(TestCase):
+
+    def test_counters_derive_from_anchors(self):
+        now = timezone.now()
+        patient = Patient(days_since_follow_up=99, days_until_admission=99,
+                          last_follow_up_at=now - timedelta(days=3, hours=2),
+                          admission_date=timezone.localdate(now) + timedelta(days=4))
+        self.assertEqual(day_count(patient, 'days_since_follow_up', now), 3)
+        self.assertEqual(day_count(patient, 'days_until_admission', now), 4)
+        # No anchor: the stored counter is used as is
+        self.assertEqual(day_count(patient, 'days_since_last_contact', now), 0)
+
+    def test_refresh_is_one_update(self):
+        now = timezone.now()
+        Patient.objects.bulk_create([
+            Patient(name=str(i), current_cohort="A", current_sub_stage="Follow-up",
+                    last_follow_up_at=now - timedelta(days=i, hours=1), last_contact_at=now - timedelta(days=2 * i, hours=1),
+                    admission_date=timezone.localdate(now) + timedelta(days=i))
+            for i in range(5)
+        ] + [Patient(name="legacy", current_cohort="A", current_sub_stage="Follow-up", days_since_follow_up=42)])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(refresh_day_counters(now), 5)
+
+        for patient in Patient.objects.all():
+            for counter in ('days_since_follow_up', 'days_since_last_contact', 'days_until_admission'):
+                self.assertEqual(getattr(patient, counter), day_count(patient, counter, now))
+        self.assertEqual(Patient.objects.get(name="legacy").days_since_follow_up, 42)
+
+    def test_refresh_floors_future_anchors_like_day_count(self):
+        now = timezone.now()
+        patient = Patient.objects.create(name="Ahead", current_cohort="A", current_sub_stage="Follow-up",
+                                         last_contact_at=now + timedelta(hours=2), days_since_follow_up=7)
+        refresh_day_counters(now)
+        patient.refresh_from_db()
+        self.assertEqual(patient.days_since_last_contact, day_count(patient, 'days_since_last_contact', now))
+        self.assertEqual(patient.days_since_last_contact, -1)
+        # Counters without an anchor keep their stored value, and the row is bumped once
+        self.assertEqual(patient.days_since_follow_up, 7)
+        self.assertEqual(patient.version, 1)
+
+    def test_days_since_needs_backend_sql(self):
+        with self.assertRaises(NotSupportedError):
+            DaysSince(F('last_contact_at'), timezone.now()).as_sql(None, connection)
+
+
+class SchedulingTests(TestCase):
+
+    def test_waiting_on_day_threshold_is_scheduled_for_the_crossing(self):
+        follow_up = timezone.now() - timedelta(hours=2)
+        patient = ready_patient(last_follow_up_at=follow_up)
+        self.assertEqual(patient.next_evaluation_at, follow_up + timedelta(days=1))
+        self.assertFalse(due_patients().filter(id=patient.id).exists())
+        self.assertTrue(due_patients(follow_up + timedelta(days=1)).filter(id=patient.id).exists())
+
+    def test_eligible_patient_is_due_now(self):
+        patient = ready_patient(days_since_follow_up=1)
+        self.assertLessEqual(patient.next_evaluation_at, timezone.now())
+        self.assertTrue(due_patients().filter(id=patient.id).exists())
+
+    def test_patient_waiting_on_a_write_is_not_scheduled(self):
+        self.assertIsNone(ready_patient(days_since_follow_up=1, patient_ready=False).next_evaluation_at)
+        self.assertIsNone(Patient.objects.create(name="Done", current_cohort="End", current_sub_stage="Closed").next_evaluation_at)
+
+    def test_transition_reschedules_for_the_new_stage(self):
+        patient = ready_patient(days_since_follow_up=1)
+        transition_patients([patient])
+        patient.refresh_from_db()
+        self.assertEqual(patient.current_sub_stage, "Follow-up")
+        self.assertIsNone(patient.next_evaluation_at)
+
+    def test_rescheduling_only_versions_patients_whose_schedule_moved(self):
+        patient = ready_patient(last_follow_up_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(schedule_patients(Patient.objects.all()), 0)
+        self.assertEqual(Patient.objects.get(id=patient.id).version, patient.version)
+
+        Patient.objects.filter(id=patient.id).update(next_evaluation_at=None)
+        self.assertEqual(schedule_patients(Patient.objects.all()), 1)
+        self.assertEqual(Patient.objects.get(id=patient.id).version, patient.version + 1)
+
+    def test_command_schedules_patients_saved_before_the_column(self):
+        patient = ready_patient(days_since_follow_up=1)
+        waiting = ready_patient(days_since_follow_up=1, patient_ready=False)
+        Patient.objects.update(next_evaluation_at=None)
+        self.assertFalse(due_patients().exists())
+
+        out = StringIO()
+        call_command('schedule_patients', stdout=out)
+        self.assertIn("1 patients rescheduled", out.getvalue())
+        self.assertEqual(list(due_patients().values_list('id', flat=True)), [patient.id])
+        waiting.refresh_from_db()
+        self.assertIsNone(waiting.next_evaluation_at)
+
+
+class StageRegistryTests(TestCase):
+
+    def test_every_rule_target_is_routed(self):
+        self.assertEqual(check_stage_registry(), [])
+
+    def test_unrouted_target_is_reported(self):
+        with mock.patch.dict(STAGE_REGISTRY, clear=True):
+            errors = check_stage_registry()
+        self.assertEqual(len(errors), len(state_transitions['state_transitions']))
+        self.assertEqual(errors[0].id, 'patients.E001')
+
+    def test_rule_target_strings_reach_their_stage_table(self):
+        # "Pre-Admission Prep" used to miss the "Pre Admission Prep" branch of _move_to_stage
+        patient = Patient.objects.create(name="Jane", current_sub_stage="A4", current_cohort="Ready to Schedule",
+                                         scheduled_admission=True)
+        self.client.put(reverse('patient-transition', args=[patient.id]))
+        self.assertEqual(PreAdmissionPrepStage.objects.filter(patient=patient).count(), 1)
+
+
+class StageRecordTests(APITestCase):
+
+    def test_transition_points_patient_at_its_stage_record(self):
+        patient = ready_patient()
+        self.client.put(reverse('patient-transition', args=[patient.id]))
+        patient.refresh_from_db()
+        record = patient.current_stage
+        self.assertEqual((record.stage_code, record.cohort, record.sub_stage), ("followupstage", "A", "Follow-up"))
+        self.assertEqual(record.payload, {"days_since_follow_up": 2, "clinical_intervention_completed": False,
+                                          "quotation_phase_required": True})
+
+    def test_payload_day_counters_are_derived_from_their_anchor(self):
+        # The stored counter is stale; the payload reports the days since the anchor
+        patient = ready_patient(last_follow_up_at=timezone.now() - timedelta(days=5, hours=1))
+        transition_patients([patient])
+        self.assertEqual(StageRecord.objects.get(patient=patient).payload["days_since_follow_up"], 5)
+
+    def test_reentering_a_stage_updates_its_record(self):
+        patient = ready_patient()
+        transition_patients([patient])
+        first = StageRecord.objects.get(patient=patient)
+        Patient.objects.filter(id=patient.id).update(current_cohort="New Recommendations", current_sub_stage="A1")
+        transition_patients(list(Patient.objects.filter(id=patient.id)))
+
+        self.assertEqual(StageRecord.objects.filter(patient=patient).count(), 1)
+        patient.refresh_from_db()
+        self.assertEqual(patient.current_stage_id, first.id)
+        self.assertGreater(patient.current_stage.entered_at, first.entered_at)
+
+    def test_backfill_labels_records_with_the_stage_the_patient_entered(self):
+        # Both patients sit in stages whose table is shared with another (cohort, sub_stage)
+        prep = Patient.objects.create(name="Prep", current_cohort="B", current_sub_stage="Pre-Admission Prep")
+        ready = Patient.objects.create(name="Ready", current_cohort="A4", current_sub_stage="Ready to Schedule")
+        PreAdmissionPrepStage.objects.create(patient=prep)
+        ReadyToScheduleStage.objects.create(patient=ready)
+        Patient.objects.update(current_stage=None)
+        StageRecord.objects.all().delete()
+
+        migration = import_module('patients.migrations.0012_backfill_stage_records')
+        migration.backfill_stage_records(django_apps, None)
+        for patient, code in ((prep, "preadmissionprepstage"), (ready, "readytoschedulestage")):
+            patient.refresh_from_db()
+            record = patient.current_stage
+            self.assertEqual((record.stage_code, record.cohort, record.sub_stage),
+                             (code, patient.current_cohort, patient.current_sub_stage))
+
+    def test_stages_endpoint(self):
+        patient = ready_patient()
+        self.client.put(reverse('patient-transition', args=[patient.id]))
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('patient-stages', args=[patient.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['current_stage']['stage_code'], "followupstage")
+        self.assertEqual(len(response.data['stages']), 1)
+        self.assertEqual(self.client.get(reverse('patient-stages', args=[999999])).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TransitionViewTests(APITestCase):
+
+    def test_transition_moves_patient_and_records_history(self):
+        patient = ready_patient()
+        response = self.client.put(reverse('patient-transition', args=[patient.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        patient.refresh_from_db()
+        self.assertEqual((patient.current_cohort, patient.current_sub_stage), ("A", "Follow-up"))
+        self.assertEqual((patient.previous_cohort, patient.previous_sub_stage), ("New Recommendations", "A1"))
+        self.assertEqual(PatientHistory.objects.filter(patient=patient).count(), 1)
+        self.assertEqual(FollowUpStage.objects.filter(patient=patient).count(), 1)
+
+    def test_transition_query_budget(self):
+        patient = ready_patient()
+        # select, savepoint, stage insert, stage record upsert, compare-and-swap update,
+        # occupancy insert + update, history insert, rollup insert + update, release
+        with self.assertNumQueries(11) as captured:
+            self.client.put(reverse('patient-transition', args=[patient.id]))
+        update = next(q['sql'] for q in captured.captured_queries if q['sql'].startswith('UPDATE "patients_patient"'))
+        self.assertNotIn('"name"', update)
+
+    def test_failed_stage_write_rolls_back_the_transition(self):
+        patient = ready_patient()
+        with mock.patch.object(FollowUpStage.objects, 'create', side_effect=DatabaseError("disk full")):
+            response = self.client.put(reverse('patient-transition', args=[patient.id]))
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        patient.refresh_from_db()
+        self.assertEqual(patient.current_sub_stage, "A1")
+        self.assertFalse(PatientHistory.objects.exists())
+
+    def _bump_version_once(self, patient):
+        # Simulates another writer committing between our read and our update
+        match = rule_engine.match
+        calls = []
+
+        def racing_match(candidate):
+            if not calls:
+                Patient.objects.filter(id=patient.id).update(version=F('version') + 1)
+            calls.append(candidate)
+            return match(candidate)
+        return racing_match, calls
+
+    def test_lost_version_race_is_retried(self):
+        patient = ready_patient()
+        racing_match, calls = self._bump_version_once(patient)
+        with mock.patch.object(rule_engine, 'match', side_effect=racing_match):
+            response = self.client.put(reverse('patient-transition', args=[patient.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(PatientHistory.objects.filter(patient=patient).count(), 1)
+        patient.refresh_from_db()
+        self.assertEqual(patient.version, 2)
+
+    def test_persistent_conflict_returns_409(self):
+        patient = ready_patient()
+        match = rule_engine.match
+
+        def always_racing(candidate):
+            Patient.objects.filter(id=patient.id).update(version=F('version') + 1)
+            return match(candidate)
+
+        with mock.patch.object(rule_engine, 'match', side_effect=always_racing):
+            response = self.client.put(reverse('patient-transition', args=[patient.id]))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(PatientHistory.objects.exists())
+
+    def test_no_matching_rule(self):
+        patient = Patient.objects.create(name="Jane", current_sub_stage="A1", current_cohort="New Recommendations")
+        response = self.client.put(reverse('patient-transition', args=[patient.id]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(PatientHistory.objects.exists())
+
+
+class PatientListTests(APITestCase):
+
+    def setUp(self):
+        Patient.objects.bulk_create([
+            Patient(name=f"P{i}", current_cohort="C", current_sub_stage="Ready to Schedule" if i % 2 else "Clinical Stage",
+                    patient_ready=i % 3 == 0, admission_status="Pending" if i % 4 == 0 else "Postponed")
+            for i in range(20)
+        ])
+        self.url = reverse('patient-list')
+
+    def test_filters_and_pages_by_id(self):
+        expected = list(Patient.objects.filter(current_sub_stage="Ready to Schedule", patient_ready=True)
+                        .order_by('id').values_list('id', flat=True))
+        seen = []
+        cursor = None
+        while True:
+            params = {'current_cohort': "C", 'current_sub_stage': "Ready to Schedule", 'patient_ready': 'true', 'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            with self.assertNumQueries(1):
+                response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(patient['id'] for patient in response.data['patients'])
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_unset_flags_do_not_filter(self):
+        response = self.client.get(self.url, {'admission_status': 'Pending'})
+        self.assertEqual(len(response.data['patients']), 5)
+        self.assertEqual(set(response.data['patients'][0]), {'id', 'name', 'current_cohort', 'current_sub_stage',
+                                                               'admission_status', 'next_evaluation_at', 'version'})
+
+    def test_worklist_filters_use_an_index(self):
+        worklists = [
+            Patient.objects.filter(current_cohort="C", current_sub_stage="Clinical Stage"),
+            Patient.objects.filter(current_cohort="C", current_sub_stage="Clinical Stage", patient_ready=True),
+            Patient.objects.filter(admission_status="Pending", current_cohort="C", current_sub_stage="Clinical Stage"),
+            Patient.objects.filter(admission_status="Pending"),
+        ]
+        for queryset in worklists:
+            plan = queryset.order_by('id').only('id').explain()
+            self.assertRegex(plan, r"INDEX patient_\w+_idx")
+            self.assertNotIn("TEMP B-TREE", plan)  # id order comes off the index, no sort
+
+    def test_rejects_bad_filters(self):
+        self.assertEqual(self.client.get(self.url, {'admission_status': 'Lost'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'patient_ready': 'maybe'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class HistoryPaginationTests(APITestCase):
+
+    def setUp(self):
+        caches['patients'].clear()
+        self.patient = Patient.objects.create(name="Jane", current_sub_stage="A1", current_cohort="New Recommendations")
+        start = timezone.now() - timedelta(days=30)
+        PatientHistory.objects.bulk_create([
+            PatientHistory(patient=self.patient, previous_cohort="A", previous_sub_stage=f"S{i}",
+                           next_cohort="A", next_sub_stage=f"S{i + 1}")
+            for i in range(12)
+        ])
+        # Pairs of rows share a timestamp so the id tiebreak is exercised
+        for i, entry in enumerate(PatientHistory.objects.order_by('id')):
+            PatientHistory.objects.filter(id=entry.id).update(transition_date=start + timedelta(days=i // 2))
+        self.url = reverse('patient-history', args=[self.patient.id])
+
+    def test_walks_every_row_once_in_order(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 5, **({'cursor': cursor} if cursor else {})}
+            # validators (cached after the first page) + the page itself
+            with self.assertNumQueries(1 if cursor else 2):
+                response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(entry['id'] for entry in response.data['history'])
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+        expected = list(PatientHistory.objects.order_by('transition_date', 'id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_since_filter(self):
+        since = PatientHistory.objects.order_by('transition_date', 'id')[8].transition_date
+        response = self.client.get(self.url, {'since': since.isoformat()})
+        self.assertEqual(len(response.data['history']), 4)
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_rows_keep_the_model_serializer_shape(self):
+        entry = self.client.get(self.url, {'limit': 1}).data['history'][0]
+        expected = PatientHistorySerializer(PatientHistory.objects.order_by('transition_date', 'id').first()).data
+        self.assertEqual(dict(entry), dict(expected))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'not-a-cursor'}).status_code, status.HTTP_400_BAD_REQUEST)
+        # Well-formed, but the transition_date element is a list
+        wrong_type = base64.urlsafe_b64encode(json.dumps([[1], 1]).encode()).decode().rstrip('=')
+        self.assertEqual(self.client.get(self.url, {'cursor': wrong_type}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'limit': 0}).status_code, status.HTTP_400_BAD_REQUEST)
+        missing = self.client.get(reverse('patient-history', args=[999999]))
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BatchHistoryTests(APITestCase):
+
+    def setUp(self):
+        self.patients = [Patient.objects.create(name=f"P{i}", current_sub_stage="A1", current_cohort="New Recommendations")
+                         for i in range(3)]
+        PatientHistory.objects.bulk_create([
+            PatientHistory(patient=patient, previous_cohort="A", previous_sub_stage=f"S{step}",
+                           next_cohort="A", next_sub_stage=f"S{step + 1}")
+            for patient in self.patients[:2] for step in range(4)
+        ])
+        self.ids = ",".join(str(patient.id) for patient in self.patients)
+
+    def test_groups_every_requested_patient_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('history-batch'), {'patient_ids': self.ids})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        histories = {group['patient_id']: group['history'] for group in response.data['histories']}
+        self.assertEqual(list(histories), [patient.id for patient in self.patients])
+        self.assertEqual([entry['next_sub_stage'] for entry in histories[self.patients[0].id]], ["S1", "S2", "S3", "S4"])
+        self.assertEqual(histories[self.patients[2].id], [])
+
+    def test_latest_n_per_patient(self):
+        response = self.client.get(reverse('history-batch'), {'patient_ids': self.ids, 'latest': 2})
+        histories = {group['patient_id']: group['history'] for group in response.data['histories']}
+        self.assertEqual([entry['next_sub_stage'] for entry in histories[self.patients[1].id]], ["S3", "S4"])
+
+    def test_chunks_the_id_list(self):
+        ids = [patient.id for patient in self.patients]
+        with self.assertNumQueries(2):
+            grouped = patient_histories(ids, chunk_size=2)
+        self.assertEqual([len(rows) for rows in grouped.values()], [4, 4, 0])
+
+    def test_rejects_bad_id_lists(self):
+        for value in ("", "1,x", ",".join(str(i) for i in range(1, 5002))):
+            response = self.client.get(reverse('history-batch'), {'patient_ids': value})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkTransitionTests(APITestCase):
+
+    def test_bulk_transition_by_ids(self):
+        ready = [ready_patient() for _ in range(3)]
+        waiting = Patient.objects.create(name="Waiting", current_sub_stage="A1", current_cohort="New Recommendations")
+        ids = [p.id for p in ready] + [waiting.id, 999999]
+
+        response = self.client.post(reverse('patient-bulk-transition'), {"patient_ids": ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['transitioned'], 3)
+        self.assertEqual([r['status'] for r in response.data['results']],
+                         ["transitioned"] * 3 + ["no_transition", "not_found"])
+        self.assertEqual(Patient.objects.filter(current_cohort="A", current_sub_stage="Follow-up").count(), 3)
+        self.assertEqual(PatientHistory.objects.count(), 3)
+        self.assertEqual(FollowUpStage.objects.count(), 3)
+
+    def test_bulk_transition_by_filter(self):
+        for _ in range(4):
+            ready_patient()
+        response = self.client.post(reverse('patient-bulk-transition'),
+                                    {"cohort": "New Recommendations", "sub_stage": "A1", "chunk_size": 3}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['processed'], 4)
+        self.assertEqual(response.data['transitioned'], 4)
+
+    def test_queries_only_grow_by_the_version_claims(self):
+        # select + savepoint/stage/stage record/update/occupancy x2/history/rollup x2/release,
+        # plus one conditional version claim per patient
+        for count in (2, 20):
+            ids = [ready_patient().id for _ in range(count)]
+            with self.assertNumQueries(11 + count):
+                self.client.post(reverse('patient-bulk-transition'), {"patient_ids": ids}, format='json')
+
+    def test_concurrently_changed_patients_are_skipped(self):
+        first, second = [ready_patient() for _ in range(2)]
+        stale = list(Patient.objects.filter(id__in=[first.id, second.id]).order_by('id'))
+        Patient.objects.filter(id=second.id).update(version=F('version') + 1)
+
+        outcomes = transition_patients(stale)
+        self.assertEqual([o['status'] for o in outcomes], ["transitioned", "conflict"])
+        self.assertEqual(list(PatientHistory.objects.values_list('patient_id', flat=True)), [first.id])
+        self.assertEqual(Patient.objects.get(id=second.id).current_sub_stage, "A1")
+
+    def test_version_bumped_between_load_and_commit_is_a_conflict(self):
+        first, second = [ready_patient() for _ in range(2)]
+        loaded = list(Patient.objects.filter(id__in=[first.id, second.id]).order_by('id'))
+        claim = services._claim_versions
+
+        def write_then_claim(patients):
+            # Another writer commits after the rules were evaluated, just before the claim
+            Patient.objects.filter(id=second.id).update(version=F('version') + 1)
+            return claim(patients)
+
+        with mock.patch.object(services, '_claim_versions', write_then_claim):
+            outcomes = transition_patients(loaded)
+        self.assertEqual([o['status'] for o in outcomes], ["transitioned", "conflict"])
+        self.assertEqual(list(PatientHistory.objects.values_list('patient_id', flat=True)), [first.id])
+        self.assertEqual(Patient.objects.get(id=first.id).version, first.version + 1)
+        # Only the other writer's bump landed
+        self.assertEqual(Patient.objects.get(id=second.id).version, second.version + 1)
+        self.assertEqual(Patient.objects.get(id=second.id).current_sub_stage, "A1")
+
+    def test_requires_ids_or_filter(self):
+        response = self.client.post(reverse('patient-bulk-transition'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CohortOccupancyTests(APITestCase):
+
+    def _counts(self):
+        return {(row['cohort'], row['sub_stage']): row['count'] for row in occupancy_stats()}
+
+    def test_admission_and_transition_move_the_counters(self):
+        response = self.client.post(reverse('patient-list'), {
+            "name": "Jane", "current_cohort": "New Recommendations", "current_sub_stage": "A1",
+            "days_since_follow_up": 2, "clinical_intervention_required": True,
+            "quotation_phase_required": True, "patient_ready": True,
+        }, format='json')
+        self.assertEqual(self._counts(), {("New Recommendations", "A1"): 1})
+
+        self.client.put(reverse('patient-transition', args=[response.data['patient_id']]))
+        self.assertEqual(self._counts(), {("A", "Follow-up"): 1})
+
+    def test_bulk_transition_and_delete(self):
+        patients = [ready_patient() for _ in range(3)]
+        transition_patients(patients[:2])
+        self.assertEqual(self._counts(), {("New Recommendations", "A1"): 1, ("A", "Follow-up"): 2})
+        patients[2].delete()
+        self.assertEqual(self._counts(), {("A", "Follow-up"): 2})
+
+    def test_rolled_back_transition_leaves_counters_alone(self):
+        patient = ready_patient()
+        with mock.patch.object(PatientHistory.objects, 'create', side_effect=DatabaseError("disk full")):
+            self.client.put(reverse('patient-transition', args=[patient.id]))
+        self.assertEqual(self._counts(), {("New Recommendations", "A1"): 1})
+
+    def test_stats_endpoint(self):
+        ready_patient()
+        ready_patient()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('cohort-stats'))
+        self.assertEqual(response.data['total'], 2)
+        self.assertEqual(response.data['stages'], [{"cohort": "New Recommendations", "sub_stage": "A1", "count": 2}])
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        patient = ready_patient()
+        Patient.objects.filter(id=patient.id).update(current_cohort="A", current_sub_stage="Follow-up")
+
+        out = StringIO()
+        call_command('reconcile_occupancy', '--dry-run', stdout=out)
+        self.assertIn("A (Follow-up): counter 0, actual 1 (+1)", out.getvalue())
+        self.assertEqual(self._counts(), {("New Recommendations", "A1"): 1})
+
+        call_command('reconcile_occupancy', stdout=StringIO())
+        self.assertEqual(self._counts(), {("A", "Follow-up"): 1})
+        self.assertEqual(reconcile_occupancy(), [])
+
+
+class TransitionRollupTests(APITestCase):
+
+    def _edges(self, **params):
+        response = self.client.get(reverse('transition-matrix'), params)
+        return {(e['from_sub_stage'], e['to_sub_stage']): e['count'] for e in response.data['edges']}
+
+    def test_transitions_are_counted_as_they_happen(self):
+        first, second, third = [ready_patient() for _ in range(3)]
+        self.client.put(reverse('patient-transition', args=[first.id]))
+        transition_patients([second, third])
+        self.assertEqual(self._edges(), {("A1", "Follow-up"): 3})
+        self.assertEqual(TransitionRollup.objects.get().day, timezone.localdate())
+
+    def test_reports_never_read_history(self):
+        patient = ready_patient()
+        transition_patients([patient])
+        with self.assertNumQueries(1) as captured:
+            response = self.client.get(reverse('transition-funnel'))
+        self.assertNotIn("patienthistory", captured.captured_queries[0]['sql'])
+        self.assertEqual(response.data['stages'], [
+            {"cohort": "A", "sub_stage": "Follow-up", "entered": 1, "exited": 0},
+            {"cohort": "New Recommendations", "sub_stage": "A1", "entered": 0, "exited": 1},
+        ])
+
+    def test_backfill_rebuilds_from_history(self):
+        patients = [ready_patient() for _ in range(3)]
+        transition_patients(patients)
+        old = PatientHistory.objects.filter(patient=patients[0])
+        old.update(transition_date=timezone.now() - timedelta(days=10))
+        TransitionRollup.objects.all().delete()
+
+        call_command('backfill_transition_rollups', stdout=StringIO())
+        today = timezone.localdate()
+        self.assertEqual(self._edges(start=today.isoformat()), {("A1", "Follow-up"): 2})
+        self.assertEqual(self._edges(end=(today - timedelta(days=1)).isoformat()), {("A1", "Follow-up"): 1})
+
+        # Re-running over a range replaces, never double counts
+        call_command('backfill_transition_rollups', '--start', today.isoformat(), stdout=StringIO())
+        self.assertEqual(self._edges(), {("A1", "Follow-up"): 3})
+
+    def test_rejects_inverted_range(self):
+        response = self.client.get(reverse('transition-matrix'), {'start': '2024-02-01', 'end': '2024-01-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DwellTimeTests(APITestCase):
+
+    def test_transitions_store_the_dwell_of_the_stage_left(self):
+        patient = ready_patient(stage_entered_at=timezone.now() - timedelta(days=3))
+        self.client.put(reverse('patient-transition', args=[patient.id]))
+        history = PatientHistory.objects.get(patient=patient)
+        self.assertAlmostEqual(history.dwell_time.total_seconds(), timedelta(days=3).total_seconds(), delta=60)
+        patient.refresh_from_db()
+        self.assertAlmostEqual((timezone.now() - patient.stage_entered_at).total_seconds(), 0, delta=60)
+
+        other = ready_patient(stage_entered_at=timezone.now() - timedelta(days=5))
+        transition_patients([other])
+        self.assertEqual(PatientHistory.objects.get(patient=other).dwell_time.days, 5)
+
+    def test_unknown_entry_time_stores_no_dwell(self):
+        patient = ready_patient(stage_entered_at=timezone.now() - timedelta(days=1))
+        Patient.objects.filter(id=patient.id).update(stage_entered_at=None)
+        transition_patients(list(Patient.objects.filter(id=patient.id)))
+        self.assertIsNone(PatientHistory.objects.get(patient=patient).dwell_time)
+
+    def test_percentiles_per_stage_in_one_query(self):
+        transition_patients([ready_patient(stage_entered_at=timezone.now() - timedelta(days=days)) for days in range(1, 11)])
+        with self.assertNumQueries(1) as captured:
+            response = self.client.get(reverse('transition-dwell'), {'start': timezone.localdate().isoformat()})
+        self.assertNotIn("JOIN", captured.captured_queries[0]['sql'])
+        stage, = response.data['stages']
+        self.assertEqual((stage['cohort'], stage['sub_stage'], stage['transitions']), ("New Recommendations", "A1", 10))
+        self.assertEqual([round(stage[p] / 86400) for p in ('p50', 'p90', 'p99')], [5, 9, 10])
+
+        yesterday = (timezone.localdate() - timedelta(days=1)).isoformat()
+        self.assertEqual(self.client.get(reverse('transition-dwell'), {'end': yesterday}).data['stages'], [])
+
+
+    def test_report_without_a_window_covers_the_default_range(self):
+        transition_patients([ready_patient(stage_entered_at=timezone.now() - timedelta(days=days)) for days in (1, 2)])
+        PatientHistory.objects.filter(dwell_time__gte=timedelta(days=2)).update(
+            transition_date=timezone.now() - timedelta(days=DEFAULT_WINDOW_DAYS + 1),
+        )
+        response = self.client.get(reverse('transition-dwell'))
+        today = timezone.localdate()
+        self.assertEqual((response.data['start'], response.data['end']),
+                         (today - timedelta(days=DEFAULT_WINDOW_DAYS - 1), today))
+        stage, = response.data['stages']
+        self.assertEqual(stage['transitions'], 1)
+
+class PopulationSnapshotTests(APITestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.patients = [
+            ready_patient(name=f"P{i}")
+            for i in range(3)
+        ]
+        Patient.objects.update(admitted_at=self.now - timedelta(days=30))
+        take_snapshot(now=self.now - timedelta(days=10))
+        transition_patients(self.patients[:2])
+        # The first patient moved five days ago, the second one just now
+        PatientHistory.objects.filter(patient=self.patients[0]).update(transition_date=self.now - timedelta(days=5))
+
+    def _population(self, days_ago):
+        response = self.client.get(reverse('cohort-population'), {'at': (self.now - timedelta(days=days_ago)).isoformat()})
+        if response.status_code != status.HTTP_200_OK:
+            return response.status_code
+        return {(stage['cohort'], stage['sub_stage']): stage['count'] for stage in response.data['stages']}
+
+    def test_population_replays_history_since_the_snapshot(self):
+        self.assertEqual(self._population(7), {("New Recommendations", "A1"): 3})
+        self.assertEqual(self._population(3), {("New Recommendations", "A1"): 2, ("A", "Follow-up"): 1})
+        self.assertEqual(self._population(-1), {("New Recommendations", "A1"): 1, ("A", "Follow-up"): 2})
+        self.assertEqual(self._population(20), status.HTTP_404_NOT_FOUND)
+
+    def test_patients_admitted_after_the_snapshot(self):
+        # Admitted into an empty stage two days ago, then moved on a day ago
+        late = ready_patient(name="Late")
+        Patient.objects.filter(id=late.id).update(current_cohort="Ready to Schedule", current_sub_stage="A4",
+                                                  scheduled_admission=True, admitted_at=self.now - timedelta(days=2))
+        transition_patients([Patient.objects.get(id=late.id)])
+        PatientHistory.objects.filter(patient=late).update(transition_date=self.now - timedelta(days=1))
+
+        self.assertEqual(self._population(3), {("New Recommendations", "A1"): 2, ("A", "Follow-up"): 1})
+        self.assertEqual(self._population(1.5), {("New Recommendations", "A1"): 2, ("A", "Follow-up"): 1,
+                                                 ("Ready to Schedule", "A4"): 1})
+        actual = Counter(Patient.objects.values_list('current_cohort', 'current_sub_stage'))
+        self.assertEqual(self._population(-1), dict(actual))
+
+        self.assertEqual(stage_at(late.id, self.now - timedelta(days=3)), (None, None, "not_admitted"))
+        self.assertEqual(stage_at(late.id, self.now - timedelta(days=1.5)), ("Ready to Schedule", "A4", "history"))
+
+    def test_negative_counts_are_kept_and_logged(self):
+        # A snapshot that lost one of its members: replaying its move out of A1 drives the count below zero
+        snapshot = PopulationSnapshot.objects.get()
+        snapshot.counts = [{'cohort': "New Recommendations", 'sub_stage': "A1", 'count': 1}]
+        snapshot.save()
+        with self.assertLogs('patients.snapshots', 'WARNING'):
+            population = self._population(-1)
+        self.assertEqual(population, {("New Recommendations", "A1"): -1, ("A", "Follow-up"): 2})
+
+    def test_stage_at(self):
+        first, _, third = self.patients
+        with self.assertNumQueries(3):
+            self.assertEqual(stage_at(first.id, self.now - timedelta(days=7)), ("New Recommendations", "A1", "snapshot"))
+        self.assertEqual(stage_at(first.id, self.now - timedelta(days=3)), ("A", "Follow-up", "history"))
+        self.assertEqual(stage_at(third.id, self.now), ("New Recommendations", "A1", "snapshot"))
+        # Before any snapshot, fall back to the next transition, then to the current stage
+        self.assertEqual(stage_at(first.id, self.now - timedelta(days=20)), ("New Recommendations", "A1", "history"))
+        self.assertEqual(stage_at(third.id, self.now - timedelta(days=20)), ("New Recommendations", "A1", "current"))
+        self.assertIsNone(stage_at(999999, self.now))
+
+        response = self.client.get(reverse('patient-stage-at', args=[first.id]), {'at': self.now.isoformat()})
+        self.assertEqual((response.data['cohort'], response.data['sub_stage']), ("A", "Follow-up"))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('population_snapshot', stdout=out)
+        self.assertIn("Snapshot of 3 patients", out.getvalue())
+
+        out = StringIO()
+        call_command('population_snapshot', '--at', timezone.now().isoformat(), '--patient', str(self.patients[1].id), stdout=out)
+        self.assertIn("A (Follow-up), from snapshot", out.getvalue())
+
+
+class PatientCacheTests(APITestCase):
+
+    def setUp(self):
+        caches['patients'].clear()
+        self.patient = ready_patient()
+
+    def _stats(self, kind):
+        return self.client.get(reverse('cache-stats')).data['cache'].get(kind, {'hits': 0, 'misses': 0})
+
+    def test_state_is_served_from_cache_until_transition(self):
+        url = reverse('patient-detail', args=[self.patient.id])
+        before = self._stats('state')
+        self.assertEqual(self.client.get(url).data['current_sub_stage'], "A1")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).data['current_sub_stage'], "A1")
+        after = self._stats('state')
+        self.assertEqual((after['hits'] - before['hits'], after['misses'] - before['misses']), (1, 1))
+
+        self.client.put(reverse('patient-transition', args=[self.patient.id]))
+        self.assertEqual(self.client.get(url).data['current_sub_stage'], "Follow-up")
+
+    def test_history_pages_are_invalidated_by_bulk_transitions(self):
+        url = reverse('patient-history', args=[self.patient.id])
+        self.assertEqual(self.client.get(url).data['history'], [])
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transition_patients([self.patient])
+        self.assertEqual(len(self.client.get(url).data['history']), 1)
+
+    def test_invalidation_is_per_patient(self):
+        other = Patient.objects.create(name="John", current_sub_stage="A1", current_cohort="New Recommendations")
+        self.client.get(reverse('patient-detail', args=[self.patient.id]))
+        self.client.get(reverse('patient-detail', args=[other.id]))
+        other.name = "Johnny"
+        other.save()
+        with self.assertNumQueries(0):
+            self.client.get(reverse('patient-detail', args=[self.patient.id]))
+        self.assertEqual(self.client.get(reverse('patient-detail', args=[other.id])).data['name'], "Johnny")
+
+    def test_missing_patients_are_not_cached(self):
+        self.assertEqual(self.client.get(reverse('patient-detail', args=[999999])).status_code, status.HTTP_404_NOT_FOUND)
+        Patient.objects.filter(id=self.patient.id).update(id=999999)
+        self.assertEqual(self.client.get(reverse('patient-detail', args=[999999])).status_code, status.HTTP_200_OK)
+
+    def test_day_counter_refresh_invalidates_everyone(self):
+        url = reverse('patient-detail', args=[self.patient.id])
+        Patient.objects.filter(id=self.patient.id).update(last_contact_at=timezone.now() - timedelta(days=4))
+        self.client.get(url)
+        refresh_day_counters()
+        self.assertEqual(self.client.get(url).data['days_since_last_contact'], 4)
+
+
+class ConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        caches['patients'].clear()
+        self.patient = ready_patient()
+        self.history_url = reverse('patient-history', args=[self.patient.id])
+        self.detail_url = reverse('patient-detail', args=[self.patient.id])
+
+    def test_patient_etag_follows_the_version(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        self.assertEqual(self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.put(reverse('patient-transition', args=[self.patient.id]))
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_history_304_reads_no_rows(self):
+        self.client.put(reverse('patient-transition', args=[self.patient.id]))
+        response = self.client.get(self.history_url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        caches['patients'].clear()
+        with self.assertNumQueries(1) as captured:
+            response = self.client.get(self.history_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertTrue(captured.captured_queries[0]['sql'].startswith('SELECT "patients_patient"."version"'))
+
+        response = self.client.get(self.history_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_history_etag_changes_with_new_rows_and_params(self):
+        etag = self.client.get(self.history_url)['ETag']
+        self.assertNotEqual(self.client.get(self.history_url, {'limit': 10})['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transition_patients([self.patient])
+        response = self.client.get(self.history_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['history']), 1)
+
+
+class BulkAdmissionTests(APITestCase):
+
+    def _row(self, i, **fields):
+        return {"name": f"P{i}", "current_cohort": "A", "current_sub_stage": "Follow-up",
+                "days_since_follow_up": i % 10, **fields}
+
+    def test_json_array_in_chunks(self):
+        rows = [self._row(i) for i in range(25)]
+        # per chunk: savepoint, patient insert, stage insert, stage record upsert,
+        # current_stage update, occupancy insert + update, release
+        with self.assertNumQueries(3 * 8):
+            response = self.client.post(reverse('patient-bulk-create') + '?chunk_size=10', rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 25)
+        self.assertEqual(Patient.objects.count(), 25)
+
+        patient = Patient.objects.get(id=response.data['patient_ids'][3])
+        self.assertEqual(patient.current_stage.stage_code, "followupstage")
+        self.assertEqual(FollowUpStage.objects.count(), 25)
+        self.assertEqual(occupancy_stats(), [{"cohort": "A", "sub_stage": "Follow-up", "count": 25}])
+        self.assertEqual(patient.next_evaluation_at, rule_engine.next_evaluation_at(patient, patient.stage_entered_at))
+
+    def test_ndjson_with_bad_rows(self):
+        lines = [json.dumps(self._row(0)), "{not json", json.dumps(self._row(2, admission_status="Lost")), "",
+                 json.dumps(self._row(3))]
+        response = self.client.post(reverse('patient-bulk-create'), "\n".join(lines), content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [1, 2])
+        self.assertIn('admission_status', response.data['errors'][1]['errors'])
+
+    def test_rejects_non_array_bodies(self):
+        response = self.client.post(reverse('patient-bulk-create'), self._row(0), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('patient-bulk-create'), [{"name": "no stage"}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Patient.objects.count(), 0)
+
+
+class ImportPatientsCommandTests(TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.dir = tmp_dir.name
+
+    def _write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_imports_csv_with_mapped_columns(self):
+        path = self._write('patients.csv', (
+            'full_name,current_cohort,current_sub_stage,days_since_follow_up\n'
+            '"Ann\nSmith",A,Follow-up,3\n'
+            'Bob,A,Follow-up,\n'
+            'Cy,A,Follow-up,not a number\n'
+        ))
+        out, err = StringIO(), StringIO()
+        call_command('import_patients', path, '--map', 'full_name=name', batch_size=2, stdout=out, stderr=err)
+        self.assertIn("3 rows read, 2 patients admitted, 1 rejected", out.getvalue())
+        self.assertIn("Row 2 rejected", err.getvalue())
+        ann = Patient.objects.get(name="Ann\nSmith")
+        self.assertEqual(ann.days_since_follow_up, 3)
+        self.assertEqual(ann.current_stage.stage_code, "followupstage")
+        self.assertEqual(Patient.objects.get(name="Bob").days_since_follow_up, 0)
+        self.assertEqual(occupancy_stats(), [{"cohort": "A", "sub_stage": "Follow-up", "count": 2}])
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_imports_ndjson_and_resumes_after_failure(self):
+        lines = [json.dumps({"name": f"P{i}", "current_cohort": "A", "current_sub_stage": "Follow-up"}) for i in range(5)]
+        path = self._write('patients.ndjson', "\n".join(lines[:2] + ["{broken"] + lines[2:]) + "\n")
+
+        real_admit = import_patients.admit_rows
+        calls = []
+
+        def fail_second_batch(rows):
+            calls.append(1)
+            if len(calls) == 2:
+                raise DatabaseError("killed")
+            return real_admit(rows)
+
+        with mock.patch.object(import_patients, 'admit_rows', side_effect=fail_second_batch):
+            with self.assertRaises(DatabaseError):
+                call_command('import_patients', path, batch_size=2, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Patient.objects.count(), 2)
+        self.assertTrue(os.path.exists(path + '.checkpoint'))
+
+        out, err = StringIO(), StringIO()
+        call_command('import_patients', path, batch_size=2, stdout=out, stderr=err)
+        self.assertIn("Resuming after row 2", out.getvalue())
+        self.assertIn("Row 2 rejected", err.getvalue())
+        self.assertEqual(sorted(Patient.objects.values_list('name', flat=True)), [f"P{i}" for i in range(5)])
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+
+class ExportTests(APITestCase):
+
+    def setUp(self):
+        self.patients = Patient.objects.bulk_create(
+            Patient(name=f"P{i}", current_cohort="A", current_sub_stage="Follow-up") for i in range(5)
+        )
+        PatientHistory.objects.create(
+            patient=self.patients[0], previous_cohort="A", previous_sub_stage="Follow-up",
+            next_cohort="B", next_sub_stage="Quotation", dwell_time=timedelta(days=1, microseconds=5),
+        )
+
+    def _body(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_streams_ndjson(self):
+        response = self.client.get(reverse('export-patients'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self._body(response).splitlines()]
+        self.assertEqual([row['name'] for row in rows], [f"P{i}" for i in range(5)])
+        self.assertEqual(rows[0]['stage_entered_at'], self.patients[0].stage_entered_at.isoformat())
+
+        history = [json.loads(line) for line in self._body(self.client.get(reverse('export-history'))).splitlines()]
+        self.assertEqual(history[0]['dwell_time'], "1 00:00:00.000005")
+
+    def test_streams_gzipped_csv(self):
+        response = self.client.get(reverse('export-history'), {'output': 'csv', 'gzip': 'true'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('history.csv.gz', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(self._body(response)).decode())))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['next_cohort'], rows[0]['dwell_time']), ("B", "1 00:00:00.000005"))
+
+        response = self.client.get(reverse('export-stages'), {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_blocks_are_read_a_chunk_at_a_time(self):
+        blocks = export_blocks('patients', 'csv', chunk_size=2)
+        self.assertEqual(next(blocks)[0], 0)
+        with self.assertNumQueries(1):
+            count, data = next(blocks)
+        self.assertEqual((count, data.count(b"\n")), (2, 2))
+        self.assertEqual([count for count, _ in blocks], [2, 1])
+
+    def test_export_command_round_trips_through_import(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'patients.csv')
+            out = StringIO()
+            call_command('export', 'patients', '--format', 'csv', '--output', path, stdout=out)
+            self.assertIn("Exported 5 patients rows", out.getvalue())
+            Patient.objects.all().delete()
+            call_command('import_patients', path, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(sorted(Patient.objects.values_list('name', flat=True)), [f"P{i}" for i in range(5)])
+
+
+class ValuesSerializerTests(TestCase):
+
+    def setUp(self):
+        now = timezone.now().replace(microsecond=123456)
+        self.patients = [
+            Patient.objects.create(name="Zoë \u2028 \"quoted\"", current_cohort="A", current_sub_stage="Follow-up",
+                                   last_contact_at=now, admission_date=now.date(), admission_status="Pending"),
+            Patient.objects.create(name="Plain", current_cohort="B", current_sub_stage="Quotation", stage_entered_at=None),
+        ]
+        enter_initial_stages(self.patients[:1])
+        StageRecord.objects.filter(patient=self.patients[0]).update(payload={"notes": ["é", None], "n": 1.5})
+        PatientHistory.objects.create(patient=self.patients[0], previous_cohort="A", previous_sub_stage="Follow-up",
+                                      next_cohort="B", next_sub_stage="Quotation", transition_date=now,
+                                      dwell_time=timedelta(days=2, seconds=5, microseconds=7))
+        PatientHistory.objects.create(patient=self.patients[1], previous_cohort="B", previous_sub_stage="Quotation",
+                                      next_cohort="C", next_sub_stage="Done", transition_date=now)
+
+    def assertRendersLike(self, serializer_class, values, queryset):
+        renderer = JSONRenderer()
+        expected = renderer.render(serializer_class(queryset, many=True).data)
+        self.assertEqual(renderer.render(values.many(queryset.values(*values.columns))), expected)
+
+    def test_byte_parity_with_drf_serializers(self):
+        cases = [
+            (PatientSerializer, patient_values, Patient.objects.order_by('id')),
+            (PatientListSerializer, patient_list_values, Patient.objects.order_by('id')),
+            (PatientHistoryEntrySerializer, history_entry_values, PatientHistory.objects.order_by('id')),
+            (PatientHistorySerializer, ValuesSerializer(PatientHistorySerializer), PatientHistory.objects.order_by('id')),
+            (StageRecordSerializer, stage_record_values, StageRecord.objects.order_by('id')),
+        ]
+        for tz in ("UTC", "America/New_York"):
+            with timezone.override(tz):
+                for serializer_class, values, queryset in cases:
+                    with self.subTest(serializer=serializer_class.__name__, tz=tz):
+                        self.assertRendersLike(serializer_class, values, queryset)
+
+    def test_foreign_keys_read_the_attname_column(self):
+        self.assertIn('current_stage_id', patient_values.columns)
+        self.assertIn('patient_id', ValuesSerializer(PatientHistorySerializer).columns)
+        row = Patient.objects.filter(id=self.patients[0].id).values(*patient_values.columns).first()
+        self.assertEqual(patient_values.to_representation(row)['current_stage'], row['current_stage_id'])
+
+
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        caches['patients'].clear()
+        self.patient = ready_patient()
+
+    async def test_create_matches_the_sync_view(self):
+        body = {"name": "Async", "current_cohort": "A", "current_sub_stage": "Follow-up"}
+        response = await self.async_client.post(reverse('async-patient-create'), body, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        patient = await Patient.objects.select_related('current_stage').aget(id=response.json()['patient_id'])
+        self.assertEqual(patient.current_stage.stage_code, "followupstage")
+        self.assertEqual(await sync_to_async(occupancy_stats)(), [
+            {"cohort": "A", "sub_stage": "Follow-up", "count": 1},
+            {"cohort": "New Recommendations", "sub_stage": "A1", "count": 1},
+        ])
+
+        sync_response = await sync_to_async(self.client.post)(reverse('patient-list'), {"name": "Async"}, content_type='application/json')
+        response = await self.async_client.post(reverse('async-patient-create'), {"name": "Async"}, content_type='application/json')
+        self.assertEqual((response.status_code, response.content), (sync_response.status_code, sync_response.content))
+
+        response = await self.async_client.post(reverse('async-patient-create'), "{bad", content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.async_client.post(reverse('async-patient-create'), {"name": "form"})
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        response = await self.async_client.get(reverse('async-patient-create'))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    async def test_transition_and_history(self):
+        response = await self.async_client.put(reverse('async-patient-transition', args=[self.patient.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        patient = await Patient.objects.aget(id=self.patient.id)
+        self.assertEqual((patient.current_cohort, patient.current_sub_stage, patient.version), ("A", "Follow-up", self.patient.version + 1))
+        self.assertEqual(await PatientHistory.objects.filter(patient_id=self.patient.id).acount(), 1)
+
+        url = reverse('async-patient-history', args=[self.patient.id])
+        response = await self.async_client.get(url, {'limit': 10})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        sync_response = await sync_to_async(self.client.get)(reverse('patient-history', args=[self.patient.id]), {'limit': 10})
+        self.assertEqual(response.content, sync_response.content)
+        self.assertEqual((response['ETag'], response['Last-Modified']), (sync_response['ETag'], sync_response['Last-Modified']))
+
+        response = await self.async_client.get(url, {'limit': 10}, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = await self.async_client.get(url, {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_missing_patients_and_conflicts(self):
+        response = await self.async_client.put(reverse('async-patient-transition', args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.get(reverse('async-patient-history', args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # Every compare-and-swap loses: the retries run out and the view answers 409
+        with mock.patch.object(PatientViewSet, '_commit_transition', side_effect=VersionConflict):
+            response = await self.async_client.put(reverse('async-patient-transition', args=[self.patient.id]))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+
+class SweepTransitionsCommandTests(TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.checkpoint = os.path.join(tmp_dir.name, 'sweep.checkpoint')
+        self.ready = [
+            Patient.objects.create(
+                name=f"Patient {i}", current_sub_stage="A4", current_cohort="Ready to Schedule", scheduled_admission=True,
+            )
+            for i in range(5)
+        ]
+        self.waiting = Patient.objects.create(name="Waiting", current_sub_stage="A4", current_cohort="Ready to Schedule")
+
+    def test_sweep_transitions_every_eligible_patient(self):
+        out = StringIO()
+        call_command('sweep_transitions', chunk_size=2, checkpoint=self.checkpoint, stdout=out)
+        self.assertIn("5 transitioned", out.getvalue())
+        self.assertEqual(Patient.objects.filter(current_sub_stage="Pre-Admission Prep").count(), 5)
+        self.assertEqual(PatientHistory.objects.count(), 5)
+        self.waiting.refresh_from_db()
+        self.assertEqual(self.waiting.current_sub_stage, "A4")
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_sweep_resumes_after_checkpoint(self):
+        save_checkpoint(self.checkpoint, {'last_id': self.ready[2].id, 'scanned': 3, 'transitioned': 3})
+        call_command('sweep_transitions', chunk_size=2, checkpoint=self.checkpoint, stdout=StringIO())
+        moved = set(Patient.objects.filter(current_sub_stage="Pre-Admission Prep").values_list('id', flat=True))
+        self.assertEqual(moved, {p.id for p in self.ready[3:]})
+
+
+class ParallelSweepTests(TestCase):
+
+    def test_id_ranges_cover_the_id_span_without_overlap(self):
+        Patient.objects.bulk_create(Patient(name=str(i), current_cohort="A", current_sub_stage="Follow-up") for i in range(10))
+        ids = list(Patient.objects.order_by('id').values_list('id', flat=True))
+        ranges = id_ranges(Patient.objects.all(), 4)
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual(ranges[0][0], ids[0])
+        self.assertEqual(ranges[-1][1], ids[-1])
+        for (_, high), (low, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(low, high + 1)
+        self.assertEqual(id_ranges(Patient.objects.none(), 4), [])
+
+    def test_range_summaries_merge(self):
+        patients = Patient.objects.bulk_create(
+            Patient(name=str(i), current_sub_stage="A4", current_cohort="Ready to Schedule", scheduled_admission=True)
+            for i in range(6)
+        )
+        schedule_patients(Patient.objects.all())
+        ranges = id_ranges(Patient.objects.all(), 3)
+        total = merge_summaries(sweep_range(id_range, chunk_size=1) for id_range in ranges)
+        self.assertEqual(total, {'ranges': 3, 'scanned': 6, 'transitioned': 6, 'retries': 0})
+        self.assertFalse(rule_engine.eligible_patients().filter(id__in=[p.id for p in patients]).exists())
+
+
+class ParallelSweepCommandTests(TransactionTestCase):
+    # Spawned workers open their own connections, which can't see the in-memory test
+    # database, so these run against a migrated scratch SQLite file. The in-memory
+    # connection is set aside rather than closed, since closing it would drop the test database.
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.checkpoint = os.path.join(tmp_dir.name, 'sweep.checkpoint')
+        original = connections['default']
+        connections['default'] = original.__class__(
+            {**original.settings_dict, 'NAME': os.path.join(tmp_dir.name, 'sweep.sqlite3')}, 'default',
+        )
+        self.addCleanup(self._restore_connection, original)
+        call_command('migrate', verbosity=0)
+        self.ready = [
+            Patient.objects.create(
+                name=f"Patient {i}", current_sub_stage="A4", current_cohort="Ready to Schedule", scheduled_admission=True,
+            )
+            for i in range(8)
+        ]
+        self.waiting = Patient.objects.create(name="Waiting", current_sub_stage="A4", current_cohort="Ready to Schedule")
+
+    def _restore_connection(self, original):
+        connections['default'].close()
+        connections['default'] = original
+
+    def test_parallel_sweep_transitions_every_eligible_patient(self):
+        out = StringIO()
+        call_command('sweep_transitions', workers=2, chunk_size=2, checkpoint=self.checkpoint, stdout=out)
+        self.assertIn("8 transitioned", out.getvalue())
+        self.assertIn("with 2 workers", out.getvalue())
+        self.assertEqual(Patient.objects.filter(current_sub_stage="Pre-Admission Prep").count(), 8)
+        self.assertEqual(PatientHistory.objects.count(), 8)
+        self.waiting.refresh_from_db()
+        self.assertEqual(self.waiting.current_sub_stage, "A4")
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_parallel_sweep_resumes_after_checkpoint(self):
+        ranges = [[self.ready[0].id, self.ready[3].id], [self.ready[4].id, self.waiting.id]]
+        save_checkpoint(self.checkpoint, {'ranges': ranges, 'completed': [ranges[0]]})
+        out = StringIO()
+        call_command('sweep_transitions', workers=2, chunk_size=2, checkpoint=self.checkpoint, stdout=out)
+        self.assertIn("Resuming with 1 of 2 ranges done", out.getvalue())
+        moved = set(Patient.objects.filter(current_sub_stage="Pre-Admission Prep").values_list('id', flat=True))
+        self.assertEqual(moved, {p.id for p in self.ready[4:]})
+        self.assertFalse(os.path.exists(self.checkpoint))
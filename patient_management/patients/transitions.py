@@ -0,0 +1,192 @@
+# Load the state transition JSON structure
+state_transitions = {
+    "state_transitions": [
+        {
+            "current_sub_stage": "A1",
+            "current_cohort": "New Recommendations",
+            "conditions": {
+                "actions": [
+                    {
+                        "condition": "days_since_follow_up",
+                        "operator": ">=",
+                        "value": 1
+                    }
+                ],
+                "dispositions": [
+                    {
+                        "condition": "clinical_intervention_required",
+                        "value": True
+                    },
+                    {
+                        "condition": "quotation_phase_required",
+                        "value": True
+                    },
+                    {
+                        "condition": "patient_ready",
+                        "value": True
+                    }
+                ]
+            },
+            "next_cohort": "A",
+            "next_sub_cohort": "Follow-up"
+        },
+        {
+            "current_sub_stage": "A2",
+            "current_cohort": "Clinical Intervention",
+            "conditions": {
+                "actions": [
+                    {
+                        "condition": "days_since_last_contact",
+                        "operator": ">",
+                        "value": "Y"
+                    }
+                ],
+                "dispositions": [
+                    {
+                        "condition": "clinical_intervention_completed",
+                        "value": True
+                    },
+                    {
+                        "condition": "quotation_phase_required",
+                        "value": False
+                    }
+                ]
+            },
+            "next_cohort": "C",
+            "next_sub_cohort": "Clinical Stage"
+        },
+        {
+            "current_sub_stage": "A3",
+            "current_cohort": "Quotation Phase",
+            "conditions": {
+                "dispositions": [
+                    {
+                        "condition": "quotation_accepted",
+                        "value": True
+                    },
+                    {
+                        "condition": "days_since_last_contact",
+                        "operator": ">",
+                        "value": "Y"
+                    }
+                ]
+            },
+            "next_cohort": "A4",
+            "next_sub_cohort": "Ready to Schedule"
+        },
+        {
+            "current_sub_stage": "A4",
+            "current_cohort": "Ready to Schedule",
+            "conditions": {
+                "dispositions": [
+                    {
+                        "condition": "scheduled_admission",
+                        "value": True
+                    }
+                ]
+            },
+            "next_cohort": "B",
+            "next_sub_cohort": "Pre-Admission Prep"
+        },
+        {
+            "current_sub_stage": "B1",
+            "current_cohort": "Pre-Admission Prep",
+            "conditions": {
+                "actions": [
+                    {
+                        "condition": "days_until_admission",
+                        "operator": "<=",
+                        "value": "Z"
+                    }
+                ],
+                "dispositions": [
+                    {
+                        "condition": "admission_status",
+                        "value": "Postponed"
+                    }
+                ]
+            },
+            "next_cohort": "C",
+            "next_sub_cohort": "Postponed Admissions"
+        },
+        {
+            "current_sub_stage": "B2",
+            "current_cohort": "Admission Soon",
+            "conditions": {
+                "dispositions": [
+                    {
+                        "condition": "admission_status",
+                        "value": "Cancelled"
+                    }
+                ]
+            },
+            "next_cohort": "C",
+            "next_sub_cohort": "Postponed Admissions"
+        },
+        {
+            "current_sub_stage": "C1",
+            "current_cohort": "Postponed Admissions",
+            "conditions": {
+                "dispositions": [
+                    {
+                        "condition": "scheduled_date_in_past",
+                        "value": True,
+                        "sub_condition": {
+                            "condition": "admission_completed",
+                            "value": False
+                        }
+                    }
+                ]
+            },
+            "next_cohort": "D",
+            "next_sub_cohort": "Clinical Stage"
+        },
+        {
+            "current_sub_stage": "C2",
+            "current_cohort": "Clinical Stage",
+            "conditions": {
+                "dispositions": [
+                    {
+                        "condition": "clinical_intervention_completed",
+                        "value": True
+                    }
+                ]
+            },
+            "next_cohort": "E",
+            "next_sub_cohort": "Initial Transition"
+        },
+        {
+            "current_sub_stage": "E1",
+            "current_cohort": "Initial Transition",
+            "conditions": {
+                "dispositions": [
+                    {
+                        "condition": "lead_management_ends",
+                        "value": True
+                    }
+                ]
+            },
+            "next_cohort": "E",
+            "next_sub_cohort": "Move to previous"
+        },
+        {
+            "current_sub_stage": "E2",
+            "current_cohort": "Final Transition",
+            "conditions": {
+                "dispositions": [
+                    {
+                        "condition": "follow_up_attempts",
+                        "operator": ">",
+                        "value": "Final"
+                    },
+                    {
+                        "condition": "final_response_received",
+                        "value": True
+                    }
+                ]
+            },
+            "next_cohort": "End",
+            "next_sub_cohort": "Closed"
+        }
+    ]
+}
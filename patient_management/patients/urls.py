@@ -1,8 +1,10 @@
 from django.urls import path
-from .views import PatientViewSet
+from . import async_views
+from .views import CacheViewSet, CohortViewSet, ExportViewSet, PatientViewSet, TransitionReportViewSet
 
 # Defining individual views for each action in the PatientViewSet
-create_patient_view = PatientViewSet.as_view({
+patient_list_view = PatientViewSet.as_view({
+    'get': 'list',
     'post': 'create',
 })
 
@@ -14,8 +16,86 @@ transition_view = PatientViewSet.as_view({
     'put': 'transition',
 })
 
+bulk_transition_view = PatientViewSet.as_view({
+    'post': 'bulk_transition',
+})
+
+get_histories_view = PatientViewSet.as_view({
+    'get': 'get_histories',
+})
+
+get_stages_view = PatientViewSet.as_view({
+    'get': 'get_stages',
+})
+
+cohort_stats_view = CohortViewSet.as_view({
+    'get': 'stats',
+})
+
+transition_matrix_view = TransitionReportViewSet.as_view({
+    'get': 'matrix',
+})
+
+transition_funnel_view = TransitionReportViewSet.as_view({
+    'get': 'funnel',
+})
+
+transition_dwell_view = TransitionReportViewSet.as_view({
+    'get': 'dwell',
+})
+
+get_stage_at_view = PatientViewSet.as_view({
+    'get': 'get_stage_at',
+})
+
+cohort_population_view = CohortViewSet.as_view({
+    'get': 'population',
+})
+
+patient_detail_view = PatientViewSet.as_view({
+    'get': 'retrieve',
+})
+
+cache_stats_view = CacheViewSet.as_view({
+    'get': 'stats',
+})
+
+bulk_admission_view = PatientViewSet.as_view({
+    'post': 'bulk_create',
+})
+
+export_patients_view = ExportViewSet.as_view({
+    'get': 'patients',
+})
+
+export_history_view = ExportViewSet.as_view({
+    'get': 'history',
+})
+
+export_stages_view = ExportViewSet.as_view({
+    'get': 'stages',
+})
+
 urlpatterns = [
-    path('patients/', create_patient_view, name='patient-list'),  # Endpoint for creating a patient
+    path('patients/', patient_list_view, name='patient-list'),  # Endpoint for listing and creating patients
+    path('patients/bulk/', bulk_admission_view, name='patient-bulk-create'),  # Endpoint for admitting many patients at once
+    path('patients/transition/bulk/', bulk_transition_view, name='patient-bulk-transition'),  # Endpoint for transitioning many patients at once
+    path('patients/<int:patient_id>/', patient_detail_view, name='patient-detail'),  # Endpoint for retrieving a patient's current state
     path('patients/<int:patient_id>/history/', get_history_view, name='patient-history'),  # Endpoint for retrieving patient history
+    path('patients/<int:patient_id>/stage-at/', get_stage_at_view, name='patient-stage-at'),  # Endpoint for the patient's stage at a point in time
+    path('patients/<int:patient_id>/stages/', get_stages_view, name='patient-stages'),  # Endpoint for the patient's unified stage records
+    path('cohorts/stats/', cohort_stats_view, name='cohort-stats'),  # Endpoint for live patient counts per cohort and sub-stage
+    path('cohorts/population/', cohort_population_view, name='cohort-population'),  # Endpoint for patient counts per stage at a point in time
+    path('transitions/matrix/', transition_matrix_view, name='transition-matrix'),  # Endpoint for stage-to-stage transition counts
+    path('transitions/funnel/', transition_funnel_view, name='transition-funnel'),  # Endpoint for per-stage entries and exits
+    path('transitions/dwell/', transition_dwell_view, name='transition-dwell'),  # Endpoint for time-in-stage percentiles
+    path('cache/stats/', cache_stats_view, name='cache-stats'),  # Endpoint for cache hit and miss counters
+    path('export/patients/', export_patients_view, name='export-patients'),  # Endpoint for streaming every patient
+    path('export/history/', export_history_view, name='export-history'),  # Endpoint for streaming every history entry
+    path('export/stages/', export_stages_view, name='export-stages'),  # Endpoint for streaming every stage record
+    path('history/', get_histories_view, name='history-batch'),  # Endpoint for retrieving many patients' histories at once
     path('patients/<int:patient_id>/transition/', transition_view, name='patient-transition'),  # Endpoint for transitioning patient stages
+    path('async/patients/', async_views.create_patient, name='async-patient-create'),  # Endpoint for admitting a patient from an async view
+    path('async/patients/<int:patient_id>/history/', async_views.patient_history, name='async-patient-history'),  # Endpoint for patient history from an async view
+    path('async/patients/<int:patient_id>/transition/', async_views.transition_patient, name='async-patient-transition'),  # Endpoint for transitioning a patient from an async view
 ]
@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
+from django.utils.duration import duration_string
+from rest_framework import ISO_8601, relations, serializers
+
+from .serializers import (
+    PatientHistoryEntrySerializer, PatientListSerializer, PatientSerializer, StageRecordSerializer,
+)
+
+
+def _passthrough(value):
+    return value
+
+
+def _date(value):
+    return value.isoformat()
+
+
+def _datetime_in(tz):
+    # DateTimeField.to_representation with the default ISO 8601 format: aware values are
+    # shown in the current timezone and UTC is written as Z
+    fallback = serializers.DateTimeField().to_representation
+
+    def convert(value):
+        if tz is None or value.tzinfo is None:
+            return fallback(value)
+        value = value.astimezone(tz).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+# Marks a field converted with _datetime_in() the current timezone, looked up once per call
+_DATETIME = object()
+
+
+class ValuesSerializer:
+    """
+    Read-only stand-in for a DRF serializer over values() rows.
+
+    The field list, the values() column behind each field and a converter per field are
+    worked out once from the serializer class; serializing a row is then one loop over
+    that list with no per-field attribute lookups, SkipField handling or ReturnDict, and
+    the current timezone is looked up once per call rather than once per datetime.
+    Output is identical to serializer_class(instance).data: the converters reproduce
+    DRF's to_representation for the field types used here, and any other field type
+    falls back to the DRF field's own to_representation.
+    """
+
+    def __init__(self, serializer_class):
+        serializer = serializer_class()
+        model = getattr(getattr(serializer_class, 'Meta', None), 'model', None)
+        self._fields = []
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+            self._fields.append((field.field_name, self._column(model, field.source), self._converter(field)))
+        self.columns = tuple(dict.fromkeys(column for _, column, _ in self._fields))
+
+    @staticmethod
+    def _column(model, source):
+        # A relation field reads the related pk, which values() returns under the attname
+        if model is not None:
+            try:
+                return model._meta.get_field(source).attname
+            except FieldDoesNotExist:
+                pass
+        return source
+
+    @staticmethod
+    def _converter(field):
+        if isinstance(field, (relations.PrimaryKeyRelatedField, serializers.ChoiceField, serializers.JSONField)):
+            if isinstance(field, serializers.JSONField) and field.binary:
+                return field.to_representation
+            # values() already gives the pk, a valid choice or the decoded JSON
+            return _passthrough
+        if isinstance(field, serializers.BooleanField):
+            return bool
+        if isinstance(field, serializers.IntegerField):
+            return int
+        if isinstance(field, serializers.CharField):
+            return str
+        if isinstance(field, serializers.DurationField):
+            return duration_string
+        if isinstance(field, serializers.DateTimeField):
+            if getattr(field, 'format', ISO_8601) != ISO_8601 or getattr(field, 'timezone', None) is not None:
+                return field.to_representation
+            return _DATETIME
+        if isinstance(field, serializers.DateField):
+            if getattr(field, 'format', ISO_8601) != ISO_8601:
+                return field.to_representation
+            return _date
+        return field.to_representation
+
+    def _bound_fields(self):
+        datetime_converter = _datetime_in(timezone.get_current_timezone() if settings.USE_TZ else None)
+        return [
+            (name, column, datetime_converter if convert is _DATETIME else convert)
+            for name, column, convert in self._fields
+        ]
+
+    def to_representation(self, row):
+        return self.many([row])[0]
+
+    def many(self, rows):
+        fields = self._bound_fields()
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, convert in fields:
+                value = row[column]
+                item[name] = None if value is None else convert(value)
+            data.append(item)
+        return data
+
+
+patient_values = ValuesSerializer(PatientSerializer)
+patient_list_values = ValuesSerializer(PatientListSerializer)
+history_entry_values = ValuesSerializer(PatientHistoryEntrySerializer)
+stage_record_values = ValuesSerializer(StageRecordSerializer)
@@ -1,216 +1,54 @@
 from rest_framework import viewsets, status
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from django.shortcuts import get_object_or_404
-from .models import (
-    Patient, PatientHistory, NewRecommendationsStage, FollowUpStage,
-    ClinicalInterventionStage, QuotationPhaseStage, ReadyToScheduleStage,
-    PreAdmissionPrepStage, PostponedAdmissionsStage, ClinicalStage,
-    InitialTransitionStage, FinalTransitionStage, ClosedStage,CohortAStage,CohortBStage,CohortCStage,CohortDStage,CohortEStage,
+from django.db import transaction
+from django.db.models import F
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from .models import Patient, PatientHistory, StageRecord
+from .serializers import (
+    PatientSerializer, PatientListQuerySerializer, HistoryPageSerializer, BatchHistorySerializer,
+    BulkTransitionSerializer, BulkAdmissionSerializer, DateRangeSerializer, PointInTimeSerializer, ExportQuerySerializer,
 )
-from .serializers import PatientSerializer, PatientHistorySerializer
+from .pagination import InvalidCursor, keyset_page
+from .parsers import NDJSONParser
+from .services import (
+    HISTORY_COLUMNS, HISTORY_ORDERING, MAX_TRANSITION_RETRIES, TRANSITION_FIELDS,
+    dwell_time, enter_initial_stages, iter_patient_chunks, iter_patient_id_chunks,
+    patient_histories, patient_validators, transition_patients,
+)
+from .admissions import admit_rows
+from .cache import cache_stats, cached, invalidate_patients, params_digest
+from .occupancy import adjust_occupancy, move, occupancy_stats
+from .dwell import dwell_percentiles, dwell_window
+from .exports import CONTENT_TYPES, export_stream
+from .rollups import funnel, record_history, transition_matrix
+from .rules import rule_engine
+from .snapshots import population_at, stage_at
+from .stages import build_stage_record, get_stage_class, is_registered, save_stage_records
+from .values_serializers import history_entry_values, patient_list_values, patient_values, stage_record_values
 import logging
+from itertools import islice
+from types import GeneratorType
 
 logger = logging.getLogger(__name__)
 
-# Load the state transition JSON structure
-state_transitions = {
-    "state_transitions": [
-        {
-            "current_sub_stage": "A1",
-            "current_cohort": "New Recommendations",
-            "conditions": {
-                "actions": [
-                    {
-                        "condition": "days_since_follow_up",
-                        "operator": ">=",
-                        "value": 1
-                    }
-                ],
-                "dispositions": [
-                    {
-                        "condition": "clinical_intervention_required",
-                        "value": True
-                    },
-                    {
-                        "condition": "quotation_phase_required",
-                        "value": True
-                    },
-                    {
-                        "condition": "patient_ready",
-                        "value": True
-                    }
-                ]
-            },
-            "next_cohort": "A",
-            "next_sub_cohort": "Follow-up"
-        },
-        {
-            "current_sub_stage": "A2",
-            "current_cohort": "Clinical Intervention",
-            "conditions": {
-                "actions": [
-                    {
-                        "condition": "days_since_last_contact",
-                        "operator": ">",
-                        "value": "Y"
-                    }
-                ],
-                "dispositions": [
-                    {
-                        "condition": "clinical_intervention_completed",
-                        "value": True
-                    },
-                    {
-                        "condition": "quotation_phase_required",
-                        "value": False
-                    }
-                ]
-            },
-            "next_cohort": "C",
-            "next_sub_cohort": "Clinical Stage"
-        },
-        {
-            "current_sub_stage": "A3",
-            "current_cohort": "Quotation Phase",
-            "conditions": {
-                "dispositions": [
-                    {
-                        "condition": "quotation_accepted",
-                        "value": True
-                    },
-                    {
-                        "condition": "days_since_last_contact",
-                        "operator": ">",
-                        "value": "Y"
-                    }
-                ]
-            },
-            "next_cohort": "A4",
-            "next_sub_cohort": "Ready to Schedule"
-        },
-        {
-            "current_sub_stage": "A4",
-            "current_cohort": "Ready to Schedule",
-            "conditions": {
-                "dispositions": [
-                    {
-                        "condition": "scheduled_admission",
-                        "value": True
-                    }
-                ]
-            },
-            "next_cohort": "B",
-            "next_sub_cohort": "Pre-Admission Prep"
-        },
-        {
-            "current_sub_stage": "B1",
-            "current_cohort": "Pre-Admission Prep",
-            "conditions": {
-                "actions": [
-                    {
-                        "condition": "days_until_admission",
-                        "operator": "<=",
-                        "value": "Z"
-                    }
-                ],
-                "dispositions": [
-                    {
-                        "condition": "admission_status",
-                        "value": "Postponed"
-                    }
-                ]
-            },
-            "next_cohort": "C",
-            "next_sub_cohort": "Postponed Admissions"
-        },
-        {
-            "current_sub_stage": "B2",
-            "current_cohort": "Admission Soon",
-            "conditions": {
-                "dispositions": [
-                    {
-                        "condition": "admission_status",
-                        "value": "Cancelled"
-                    }
-                ]
-            },
-            "next_cohort": "C",
-            "next_sub_cohort": "Postponed Admissions"
-        },
-        {
-            "current_sub_stage": "C1",
-            "current_cohort": "Postponed Admissions",
-            "conditions": {
-                "dispositions": [
-                    {
-                        "condition": "scheduled_date_in_past",
-                        "value": True,
-                        "sub_condition": {
-                            "condition": "admission_completed",
-                            "value": False
-                        }
-                    }
-                ]
-            },
-            "next_cohort": "D",
-            "next_sub_cohort": "Clinical Stage"
-        },
-        {
-            "current_sub_stage": "C2",
-            "current_cohort": "Clinical Stage",
-            "conditions": {
-                "dispositions": [
-                    {
-                        "condition": "clinical_intervention_completed",
-                        "value": True
-                    }
-                ]
-            },
-            "next_cohort": "E",
-            "next_sub_cohort": "Initial Transition"
-        },
-        {
-            "current_sub_stage": "E1",
-            "current_cohort": "Initial Transition",
-            "conditions": {
-                "dispositions": [
-                    {
-                        "condition": "lead_management_ends",
-                        "value": True
-                    }
-                ]
-            },
-            "next_cohort": "E",
-            "next_sub_cohort": "Move to previous"
-        },
-        {
-            "current_sub_stage": "E2",
-            "current_cohort": "Final Transition",
-            "conditions": {
-                "dispositions": [
-                    {
-                        "condition": "follow_up_attempts",
-                        "operator": ">",
-                        "value": "Final"
-                    },
-                    {
-                        "condition": "final_response_received",
-                        "value": True
-                    }
-                ]
-            },
-            "next_cohort": "End",
-            "next_sub_cohort": "Closed"
-        }
-    ]
-}
+
+class VersionConflict(Exception):
+    """The patient was written by someone else between our read and our compare-and-swap."""
+
+
 class PatientViewSet(viewsets.ViewSet):
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [NDJSONParser]
 
     def create(self, request):
         serializer = PatientSerializer(data=request.data)
         if serializer.is_valid():
             try:
-                patient = serializer.save()
+                patient = self._admit(serializer)
                 logger.info(f"Patient admitted successfully with ID: {patient.id}")
                 return Response({"message": "Patient admitted successfully", "patient_id": patient.id}, status=status.HTTP_201_CREATED)
             except Exception as e:
@@ -219,218 +57,404 @@ class PatientViewSet(viewsets.ViewSet):
         logger.warning(f"Patient admission failed with errors: {serializer.errors}")
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    def transition(self, request, patient_id):
+    def _admit(self, serializer):
+        # The occupancy counter is bumped by the post_save signal, inside this transaction
+        with transaction.atomic():
+            patient = serializer.save()
+            enter_initial_stages([patient])
+        return patient
+
+    def bulk_create(self, request):
+        # Admissions in chunks: one PatientSerializer(many=True) validation and one
+        # admit_patients() transaction per chunk. Rows are numbered from 0 in input order;
+        # invalid rows are reported and skipped, the valid ones in their chunk still go in.
+        params = BulkAdmissionSerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        chunk_size = params.validated_data['chunk_size']
+
+        rows = request.data
+        if not isinstance(rows, (list, GeneratorType)):
+            logger.warning("Bulk admission rejected: body is not a JSON array or NDJSON")
+            return Response({"error": "Expected a JSON array or an NDJSON body"}, status=status.HTTP_400_BAD_REQUEST)
+
+        patient_ids = []
+        errors = []
+        numbered = enumerate(rows)
         try:
-            patient = Patient.objects.get(id=patient_id)
-            logger.info(f"Transition initiated for patient ID: {patient_id}")
-        except Patient.DoesNotExist:
-            logger.error(f"Patient with ID {patient_id} not found")
-            return Response({"error": "Patient not found"}, status=status.HTTP_404_NOT_FOUND)
+            while True:
+                chunk = list(islice(numbered, chunk_size))
+                if not chunk:
+                    break
+                chunk_ids, chunk_errors = admit_rows(chunk)
+                patient_ids.extend(chunk_ids)
+                errors.extend(chunk_errors)
+        except Exception as e:
+            logger.error(f"Bulk admission failed after {len(patient_ids)} patients: {e}")
+            return Response({"error": "Failed to admit patients", "created": len(patient_ids), "patient_ids": patient_ids,
+                             "errors": errors}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        logger.info(f"Bulk admission created {len(patient_ids)} patients, rejected {len(errors)} rows.")
+        if errors and not patient_ids:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif errors:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response({"created": len(patient_ids), "patient_ids": patient_ids, "errors": errors}, status=response_status)
+
+    def list(self, request):
+        # Worklists: exact-match filters served by the stage/status/flag indexes on Patient,
+        # keyset-paginated on id and projected to the listed columns
+        params = PatientListQuerySerializer(data=request.query_params.dict())
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        filters = {name: value for name, value in params.validated_data.items() if name not in ('cursor', 'limit')}
+
+        patients = Patient.objects.filter(**filters).values(*patient_list_values.columns)
+        try:
+            page, next_cursor = keyset_page(patients, ('id',), params.validated_data.get('cursor'), params.validated_data['limit'])
+        except InvalidCursor as e:
+            logger.warning(f"Rejected patient list cursor: {e}")
+            return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"patients": patient_list_values.many(page), "next_cursor": next_cursor}, status=status.HTTP_200_OK)
+
+    def transition(self, request, patient_id):
+        # Optimistic concurrency: evaluate the rules without holding any lock, then
+        # compare-and-swap on Patient.version. A lost race re-reads and re-evaluates,
+        # up to MAX_TRANSITION_RETRIES times, before giving up with 409.
+        for attempt in range(MAX_TRANSITION_RETRIES + 1):
+            try:
+                patient = Patient.objects.get(id=patient_id)
+                logger.info(f"Transition initiated for patient ID: {patient_id}")
+            except Patient.DoesNotExist:
+                logger.error(f"Patient with ID {patient_id} not found")
+                return Response({"error": "Patient not found"}, status=status.HTTP_404_NOT_FOUND)
+
+            rule = rule_engine.match(patient)
+            if rule is None:
+                logger.warning("No transition applied.")
+                return Response({"message": "No transition applied"}, status=status.HTTP_400_BAD_REQUEST)
+
+            logger.info(f"Evaluating transition for cohort: {patient.current_cohort}, sub-stage: {patient.current_sub_stage}")
+            previous_cohort, previous_sub_stage, dwell = self._apply_rule(patient, rule)
+            try:
+                self._commit_transition(patient, rule, previous_cohort, previous_sub_stage, dwell)
+            except VersionConflict:
+                logger.info(f"Patient ID {patient_id} changed concurrently, retrying transition (attempt {attempt + 1}).")
+                continue
+            except Exception as e:
+                logger.error(f"Failed to transition patient {patient_id}, changes rolled back: {e}")
+                return Response({"error": "Failed to transition patient"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            return Response({"message": "Patient transitioned successfully", "patient_id": patient.id}, status=status.HTTP_200_OK)
+
+        logger.warning(f"Transition for patient ID {patient_id} kept conflicting with concurrent updates.")
+        return Response({"error": "Patient was modified concurrently, retry the transition"}, status=status.HTTP_409_CONFLICT)
+
+    def _apply_rule(self, patient, rule):
+        """Move the in-memory patient to the rule's stage; returns the stage it left and its dwell time there."""
         previous_cohort = patient.current_cohort
         previous_sub_stage = patient.current_sub_stage
+        now = timezone.now()
+        dwell = dwell_time(patient, now)
+        patient.stage_entered_at = now
+        patient.previous_cohort = previous_cohort
+        patient.previous_sub_stage = previous_sub_stage
+        patient.current_cohort = rule.next_cohort
+        patient.current_sub_stage = rule.next_sub_stage
+        patient.next_evaluation_at = rule_engine.next_evaluation_at(patient, now)
+        return previous_cohort, previous_sub_stage, dwell
 
-        for transition in state_transitions['state_transitions']:
-            if (patient.current_sub_stage == transition['current_sub_stage'] and 
-                patient.current_cohort == transition['current_cohort']):
-                
-                logger.info(f"Evaluating transition for cohort: {patient.current_cohort}, sub-stage: {patient.current_sub_stage}")
-
-                if self._check_conditions(patient, transition['conditions']):
-                    patient.previous_cohort = previous_cohort
-                    patient.previous_sub_stage = previous_sub_stage
-                    patient.current_cohort = transition['next_cohort']
-                    patient.current_sub_stage = transition['next_sub_cohort']
-                    
-                    try:
-                        patient.save()
-                        logger.info(f"Patient cohort and sub-stage updated to: {patient.current_cohort}, {patient.current_sub_stage}")
-                    except Exception as e:
-                        logger.error(f"Failed to save patient data: {e}")
-                        return Response({"error": "Failed to save patient data"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-                    try:
-                        PatientHistory.objects.create(
-                            patient=patient,
-                            previous_cohort=previous_cohort,
-                            previous_sub_stage=previous_sub_stage,
-                            next_cohort=transition['next_cohort'],
-                            next_sub_stage=transition['next_sub_cohort'],
-                        )
-                        logger.info("Transition history saved.")
-                    except Exception as e:
-                        logger.error(f"Failed to save transition history: {e}")
-                        return Response({"error": "Failed to save transition history"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-                    logger.info(f"Calling _move_to_stage for patient ID {patient.id} with cohort {patient.current_cohort}")
-                    self._move_to_stage(patient)
-                    return Response({"message": "Patient transitioned successfully", "patient_id": patient.id}, status=status.HTTP_200_OK)
-
-        logger.warning("No transition applied.")
-        return Response({"message": "No transition applied"}, status=status.HTTP_400_BAD_REQUEST)
-
-    def _check_conditions(self, patient, conditions):
-        logger.info("Checking conditions for transition.")
-        for action in conditions.get('actions', []):
-            if not self._evaluate_condition(patient, action):
-                logger.info(f"Action condition not met: {action}")
-                return False
-        for disposition in conditions.get('dispositions', []):
-            if not self._evaluate_condition(patient, disposition):
-                logger.info(f"Disposition condition not met: {disposition}")
-                return False
-        logger.info("All conditions met for transition.")
-        return True
-
-    def _evaluate_condition(self, patient, condition):
-        patient_value = getattr(patient, condition['condition'], None)
-        if patient_value is None:
-            logger.warning(f"Condition {condition['condition']} not found on patient.")
-            return False
-
-        operator = condition.get('operator')
-        value = condition['value']
-
-        if operator == ">=":
-            return patient_value >= value
-        elif operator == ">":
-            return patient_value > value
-        elif operator == "<=":
-            return patient_value <= value
-        elif operator == "<":
-            return patient_value < value
-        return patient_value == value
-    
-    def _move_to_stage(self, patient):
-        logger.info(f"Entered _move_to_stage function for patient ID: {patient.id}.")
-    
-    # Mapping cohorts to specific stages/substages
-        stage_classes = {
-            "Follow-up": FollowUpStage,
-            "Clinical Intervention": ClinicalInterventionStage,
-            "Quotation Phase": QuotationPhaseStage,
-            "Ready to Schedule": ReadyToScheduleStage,
-            "Pre-Admission Prep": PreAdmissionPrepStage,
-            "Postponed Admissions": PostponedAdmissionsStage,
-            "Clinical Stage": ClinicalStage,
-            "Initial Transition": InitialTransitionStage,
-            "Final Transition": FinalTransitionStage,
-            "Closed": ClosedStage,
-            "A": CohortAStage,
-            "B": CohortBStage,
-            "C": CohortCStage,
-            "D": CohortDStage,
-            "E": CohortEStage     
-        }
+    def _commit_transition(self, patient, rule, previous_cohort, previous_sub_stage, dwell):
+        """
+        Write the transition prepared by _apply_rule() in one transaction, so a failure at any
+        step leaves the patient, its history and its stage rows untouched. Raises
+        VersionConflict when the patient was written since it was read.
+        """
+        with transaction.atomic():
+            logger.info(f"Calling _move_to_stage for patient ID {patient.id} with cohort {patient.current_cohort}")
+            stage_record = self._move_to_stage(patient)
 
+            updated = Patient.objects.filter(id=patient.id, version=patient.version).update(
+                version=F('version') + 1,
+                current_stage=stage_record,
+                **{field: getattr(patient, field) for field in TRANSITION_FIELDS},
+            )
+            if not updated:
+                # Roll back the stage rows written above and go around again
+                raise VersionConflict()
+            patient.version += 1
+            patient.current_stage = stage_record
+            adjust_occupancy(move((previous_cohort, previous_sub_stage), (patient.current_cohort, patient.current_sub_stage)))
+            invalidate_patients([patient.id])
+            logger.info(f"Patient cohort and sub-stage updated to: {patient.current_cohort}, {patient.current_sub_stage}")
+
+            history = PatientHistory.objects.create(
+                patient=patient,
+                previous_cohort=previous_cohort,
+                previous_sub_stage=previous_sub_stage,
+                next_cohort=rule.next_cohort,
+                next_sub_stage=rule.next_sub_stage,
+                dwell_time=dwell,
+            )
+            record_history([history])
+            logger.info("Transition history saved.")
+
+    def bulk_transition(self, request):
+        serializer = BulkTransitionSerializer(data=request.data)
+        if not serializer.is_valid():
+            logger.warning(f"Bulk transition rejected with errors: {serializer.errors}")
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        chunk_size = data['chunk_size']
+        results = []
         try:
-            # Check if the patient belongs to Cohort A
-            if patient.current_cohort == "A":
-                # Decide which sub-stage to assign based on the patient's current sub-stage
-                if patient.current_sub_stage == "New Recommendations":
-                    stage_class = NewRecommendationsStage
-                elif patient.current_sub_stage == "Follow-up":
-                    stage_class = FollowUpStage
-                else:
-                    logger.error(f"Invalid sub-stage for Cohort A: {patient.current_sub_stage}")
-                    return Response(
-                        {"error": f"Invalid sub-stage for Cohort A: {patient.current_sub_stage}"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            elif patient.current_cohort == "B":
-                # Decide which sub-stage to assign based on the patient's current sub-stage
-                if patient.current_sub_stage == "Clinical Intervention":
-                    stage_class = ClinicalInterventionStage
-                elif patient.current_sub_stage == "Quotation Phase":
-                    stage_class = QuotationPhaseStage
-                else:
-                    logger.error(f"Invalid sub-stage for Cohort A: {patient.current_sub_stage}")
-                    return Response(
-                        {"error": f"Invalid sub-stage for Cohort A: {patient.current_sub_stage}"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            elif patient.current_cohort == "C":
-                # Decide which sub-stage to assign based on the patient's current sub-stage
-                if patient.current_sub_stage == "Ready To Schedule":
-                    stage_class = ReadyToScheduleStage
-                elif patient.current_sub_stage == "Pre Admission Prep":
-                    stage_class = PreAdmissionPrepStage
-                elif patient.current_sub_stage == "Postponed Admission":
-                    stage_class = PostponedAdmissionsStage
-                else:
-                    logger.error(f"Invalid sub-stage for Cohort A: {patient.current_sub_stage}")
-                    return Response(
-                        {"error": f"Invalid sub-stage for Cohort A: {patient.current_sub_stage}"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            elif patient.current_cohort == "D":
-                # Decide which sub-stage to assign based on the patient's current sub-stage
-                if patient.current_sub_stage == "Clinical Stage":
-                    stage_class = ClinicalStage
-                else:
-                    logger.error(f"Invalid sub-stage for Cohort A: {patient.current_sub_stage}")
-                    return Response(
-                        {"error": f"Invalid sub-stage for Cohort A: {patient.current_sub_stage}"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            elif patient.current_cohort == "E":
-                # Decide which sub-stage to assign based on the patient's current sub-stage
-                if patient.current_sub_stage == "Initial Transition":
-                    stage_class = InitialTransitionStage
-                elif patient.current_sub_stage == "Final Transition":
-                    stage_class = FinalTransitionStage
-                else:
-                    logger.error(f"Invalid sub-stage for Cohort A: {patient.current_sub_stage}")
-                    return Response(
-                        {"error": f"Invalid sub-stage for Cohort A: {patient.current_sub_stage}"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+            if 'patient_ids' in data:
+                patient_ids = list(dict.fromkeys(data['patient_ids']))
+                for ids, patients in iter_patient_id_chunks(patient_ids, chunk_size):
+                    outcomes = {outcome['patient_id']: outcome for outcome in transition_patients(patients)}
+                    results.extend(outcomes.get(patient_id, {"patient_id": patient_id, "status": "not_found"}) for patient_id in ids)
             else:
-                # For other cohorts, fetch the stage class from the dictionary
-                stage_class = stage_classes.get(patient.current_cohort)
-            
-            if not stage_class:
-                logger.error(f"Stage class not found for cohort: {patient.current_cohort}")
-                return Response(
-                    {"error": f"Stage class not found for cohort: {patient.current_cohort}"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            logger.info(f"Attempting to create a new stage for patient ID {patient.id} in cohort {patient.current_cohort}")
-            
-            # Create the stage instance using the selected subclass
-            stage_instance = stage_class.objects.create(patient=patient)
-
-            # Verification log to confirm instance creation
-            logger.info(f"New stage instance created for patient ID {patient.id} in cohort {patient.current_cohort}")
-
-            # Double-check stage creation in the database
-            saved_stage = stage_class.objects.filter(patient=patient).latest('id')
-            if saved_stage != stage_instance:
-                logger.error(f"Stage creation verification failed for patient ID {patient.id}.")
-                return Response(
-                    {"error": "Stage creation verification failed"},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-
-            logger.info(f"Patient moved to stage {patient.current_cohort} successfully.")
-
+                queryset = Patient.objects.all()
+                if 'cohort' in data:
+                    queryset = queryset.filter(current_cohort=data['cohort'])
+                if 'sub_stage' in data:
+                    queryset = queryset.filter(current_sub_stage=data['sub_stage'])
+                for patients in iter_patient_chunks(queryset, chunk_size):
+                    results.extend(transition_patients(patients))
         except Exception as e:
-            logger.error(f"Failed to move patient to stage: {e}")
-            return Response(
-                {"error": f"Failed to move patient to stage: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            logger.error(f"Bulk transition failed: {e}")
+            return Response({"error": "Bulk transition failed", "results": results}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        transitioned = sum(1 for outcome in results if outcome['status'] == 'transitioned')
+        logger.info(f"Bulk transition processed {len(results)} patients, {transitioned} transitioned.")
+        return Response({"processed": len(results), "transitioned": transitioned, "results": results}, status=status.HTTP_200_OK)
+
+    def _move_to_stage(self, patient):
+        """Write the stage rows for the patient's new stage and return its StageRecord, if it has one."""
+        logger.info(f"Entered _move_to_stage function for patient ID: {patient.id}.")
+
+        if not is_registered(patient.current_cohort, patient.current_sub_stage):
+            logger.error(f"Stage class not found for cohort: {patient.current_cohort}, sub-stage: {patient.current_sub_stage}")
+            return None
+        stage_class = get_stage_class(patient.current_cohort, patient.current_sub_stage)
+        if stage_class is None:
+            logger.info(f"No stage table for cohort {patient.current_cohort}, sub-stage {patient.current_sub_stage}.")
+            return None
+
+        logger.info(f"Attempting to create a new stage for patient ID {patient.id} in cohort {patient.current_cohort}")
+
+        # Create the stage instance using the selected subclass; errors propagate so
+        # the caller's transaction rolls back the whole transition
+        stage_class.objects.create(patient=patient)
+        stage_record, = save_stage_records([build_stage_record(patient, stage_class)])
+        logger.info(f"New stage instance created for patient ID {patient.id} in cohort {patient.current_cohort}")
+
+        logger.info(f"Patient moved to stage {patient.current_cohort} successfully.")
+        return stage_record
+
+    def get_stages(self, request, patient_id):
+        patient = Patient.objects.filter(id=patient_id).values('current_stage_id').first()
+        if patient is None:
+            logger.error(f"Patient with ID {patient_id} not found")
+            return Response({"error": "Patient not found"}, status=status.HTTP_404_NOT_FOUND)
+        current_stage_id = patient['current_stage_id']
+
+        records = StageRecord.objects.filter(patient_id=patient_id).order_by('entered_at').values(*stage_record_values.columns)
+        stages = stage_record_values.many(records)
+        current = next((record for record in stages if record['id'] == current_stage_id), None)
+        return Response({"patient_id": patient_id, "current_stage": current, "stages": stages}, status=status.HTTP_200_OK)
+
+    def get_stage_at(self, request, patient_id):
+        params = PointInTimeSerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        at = params.validated_data['at']
+
+        stage = stage_at(patient_id, at)
+        if stage is None:
+            logger.error(f"Patient with ID {patient_id} not found")
+            return Response({"error": "Patient not found"}, status=status.HTTP_404_NOT_FOUND)
+        cohort, sub_stage, source = stage
+        return Response({"patient_id": patient_id, "at": at, "cohort": cohort, "sub_stage": sub_stage, "source": source},
+                        status=status.HTTP_200_OK)
+
+    def retrieve(self, request, patient_id):
+        # Conditional GET on the patient's version; the validators and the state are both
+        # served from the cache until the patient is next written, see cache.py
+        validators = cached('validators', patient_id, {}, lambda: patient_validators(patient_id))
+        if validators is None:
+            logger.error(f"Patient with ID {patient_id} not found")
+            return Response({"error": "Patient not found"}, status=status.HTTP_404_NOT_FOUND)
+        etag = f'"p{patient_id}-v{validators["version"]}"'
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        state = cached('state', patient_id, {}, lambda: self._patient_state(patient_id))
+        if state is None:
+            logger.error(f"Patient with ID {patient_id} not found")
+            return Response({"error": "Patient not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(state, status=status.HTTP_200_OK, headers={'ETag': etag})
 
+    def _patient_state(self, patient_id):
+        patient = Patient.objects.filter(id=patient_id).values(*patient_values.columns).first()
+        if patient is None:
+            return None
+        return patient_values.to_representation(patient)
 
     def get_history(self, request, patient_id):
-        try:
-            patient = Patient.objects.get(id=patient_id)
-            logger.info(f"Retrieving history for patient ID: {patient_id}")
-        except Patient.DoesNotExist:
+        # Keyset pagination on (transition_date, id): each page is one range scan on
+        # history_patient_date_idx reading only the returned columns, however long the history is.
+        # Pages are cached per patient and query until the patient's next transition.
+        params = HistoryPageSerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # History only grows, so the newest row identifies every page's content; a matching
+        # If-None-Match/If-Modified-Since answers 304 without reading or serializing any rows
+        validators = cached('validators', patient_id, {}, lambda: patient_validators(patient_id))
+        if validators is None:
             logger.error(f"Patient with ID {patient_id} not found")
             return Response({"error": "Patient not found"}, status=status.HTTP_404_NOT_FOUND)
+        etag, last_modified = self._history_validators(patient_id, params.validated_data, validators)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        try:
+            page = cached('history', patient_id, params.validated_data,
+                          lambda: self._history_page(patient_id, params.validated_data))
+        except InvalidCursor as e:
+            logger.warning(f"Rejected history cursor for patient {patient_id}: {e}")
+            return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(page, status=status.HTTP_200_OK, headers=self._history_headers(etag, last_modified))
+
+    def _history_validators(self, patient_id, params, validators):
+        """ETag and Last-Modified timestamp (or None) of a history page, from the patient's cached validators."""
+        etag = f'"h{patient_id}-{validators["latest_history_id"] or 0}-{params_digest(params)[:16]}"'
+        last_modified = validators['latest_transition_at']
+        return etag, last_modified and int(last_modified.timestamp())
+
+    def _history_headers(self, etag, last_modified):
+        headers = {'ETag': etag}
+        if last_modified:
+            headers['Last-Modified'] = http_date(last_modified)
+        return headers
+
+    def _history_entries(self, patient_id, params):
+        logger.info(f"Retrieving history for patient ID: {patient_id}")
+
+        history_entries = PatientHistory.objects.filter(patient_id=patient_id).values(*HISTORY_COLUMNS)
+        if 'since' in params:
+            history_entries = history_entries.filter(transition_date__gte=params['since'])
+        return history_entries
+
+    def _history_page(self, patient_id, params):
+        rows, next_cursor = keyset_page(
+            self._history_entries(patient_id, params), HISTORY_ORDERING, params.get('cursor'), params['limit'],
+        )
+        return {"patient_id": patient_id, "history": history_entry_values.many(rows), "next_cursor": next_cursor}
+
+    def get_histories(self, request):
+        # Dashboards ask for many patients at once; answer from PatientHistory alone,
+        # one query per chunk of ids, instead of a Patient lookup plus a history query each.
+        params = BatchHistorySerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        patient_ids = params.validated_data['patient_ids']
+        latest = params.validated_data.get('latest')
+        logger.info(f"Retrieving history for {len(patient_ids)} patients" + (f", latest {latest} each" if latest else ""))
+
+        grouped = patient_histories(patient_ids, latest)
+        histories = [
+            {"patient_id": patient_id, "history": history_entry_values.many(rows)}
+            for patient_id, rows in grouped.items()
+        ]
+        return Response({"histories": histories}, status=status.HTTP_200_OK)
+
+
+class CohortViewSet(viewsets.ViewSet):
+
+    def stats(self, request):
+        # Read from the materialized counters: one row per stage, not a GROUP BY over Patient
+        stages = occupancy_stats()
+        return Response({"stages": stages, "total": sum(stage['count'] for stage in stages)}, status=status.HTTP_200_OK)
+
+    def population(self, request):
+        # Nearest earlier snapshot plus the transitions written since, never a full history replay
+        params = PointInTimeSerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        at = params.validated_data['at']
+
+        snapshot, stages = population_at(at)
+        if snapshot is None:
+            logger.warning(f"No population snapshot at or before {at}")
+            return Response({"error": "No population snapshot at or before this time"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"at": at, "snapshot_taken_at": snapshot.taken_at, "stages": stages,
+                         "total": sum(stage['count'] for stage in stages)}, status=status.HTTP_200_OK)
+
+
+class TransitionReportViewSet(viewsets.ViewSet):
+    # The matrix and funnel read the daily TransitionRollup, never PatientHistory itself
+
+    def matrix(self, request):
+        params = DateRangeSerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        start, end = params.validated_data.get('start'), params.validated_data.get('end')
+        return Response({"start": start, "end": end, "edges": transition_matrix(start, end)}, status=status.HTTP_200_OK)
+
+    def funnel(self, request):
+        params = DateRangeSerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        start, end = params.validated_data.get('start'), params.validated_data.get('end')
+        return Response({"start": start, "end": end, "stages": funnel(start, end)}, status=status.HTTP_200_OK)
+
+    def dwell(self, request):
+        # Percentiles come from the dwell time stored on each history row, not from pairing rows
+        params = DateRangeSerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        start, end = dwell_window(params.validated_data.get('start'), params.validated_data.get('end'))
+        return Response({"start": start, "end": end, "stages": dwell_percentiles(start, end)}, status=status.HTTP_200_OK)
+
+
+class CacheViewSet(viewsets.ViewSet):
+
+    def stats(self, request):
+        # Counters are per process, like the locmem cache they describe
+        return Response({"cache": cache_stats()}, status=status.HTTP_200_OK)
+
+
+class ExportViewSet(viewsets.ViewSet):
+    # Whole tables streamed as NDJSON or CSV, optionally gzipped, straight from a
+    # chunked values_list() iterator; nothing is buffered beyond one chunk
+
+    def patients(self, request):
+        return self._export(request, 'patients')
+
+    def history(self, request):
+        return self._export(request, 'history')
+
+    def stages(self, request):
+        return self._export(request, 'stages')
+
+    def _export(self, request, table):
+        params = ExportQuerySerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+        fmt, gzip = params.validated_data['output'], params.validated_data['gzip']
 
-        history_entries = PatientHistory.objects.filter(patient=patient)
-        serializer = PatientHistorySerializer(history_entries, many=True)
-        return Response({"patient_id": patient.id, "history": serializer.data}, status=status.HTTP_200_OK)
+        filename = f"{table}.{fmt}.gz" if gzip else f"{table}.{fmt}"
+        response = StreamingHttpResponse(
+            export_stream(table, fmt, gzip), content_type='application/gzip' if gzip else CONTENT_TYPES[fmt],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        logger.info(f"Streaming {table} export as {filename}")
+        return response
@@ -0,0 +1,19 @@
+# Entry points for spawned worker processes. Kept free of model imports so the
+# module can be unpickled in a child before Django has been set up.
+import os
+
+
+def init_worker(databases):
+    # Configure Django against the parent's databases; the first query then
+    # opens this process's own connection.
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'patient_management.settings')
+    from django.conf import settings
+    settings.DATABASES = databases
+
+    import django
+    django.setup()
+
+
+def sweep_range_task(id_range, chunk_size, full):
+    from .sweep import sweep_range
+    return sweep_range(id_range, chunk_size, full)